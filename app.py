@@ -5,6 +5,10 @@ from crocolake import DataLoader
 import pandas as pd
 from datetime import datetime, time
 
+# Above this many filtered observations, plots and tables show binned
+# aggregates computed by the loader instead of the raw points
+AGGREGATE_THRESHOLD = 100_000
+
 # Page config
 st.set_page_config(
     page_title="CrocoLake Data Explorer",
@@ -73,19 +77,21 @@ if len(selected_dates) == 2:
 else:
     selected_time = None
 
-# Load filtered data
-data = loader.load_dataset(
-    selected_dataset,
+# Count the filtered observations without loading them
+filters = dict(
     variables=selected_variables,
     depth_range=selected_depth,
     time_range=selected_time
 )
+counts = loader.aggregate(selected_dataset, by=['variable'], **filters)
+n_observations = int(counts['count'].sum())
+aggregated = n_observations > AGGREGATE_THRESHOLD
 
 # Display dataset info
 st.header("Dataset Information")
 col1, col2, col3 = st.columns(3)
 with col1:
-    st.metric("Number of Observations", f"{len(data):,}")
+    st.metric("Number of Observations", f"{n_observations:,}")
 with col2:
     st.metric("Variables", len(info['variables']))
 with col3:
@@ -94,6 +100,66 @@ with col3:
 # Create visualizations
 st.header("Data Visualization")
 
+if aggregated:
+    st.info(
+        f"More than {AGGREGATE_THRESHOLD:,} observations selected: "
+        "showing daily, 1° cell and 10 m depth bin aggregates."
+    )
+    
+    # Time series of daily means
+    by_time = loader.aggregate(selected_dataset, by=['variable', 'time'], time_bucket='day', **filters)
+    fig_time = px.line(
+        by_time,
+        x='timestamp',
+        y='mean',
+        color='variable',
+        title='Daily Mean Over Time',
+        labels={'mean': 'Mean Value', 'timestamp': 'Time'},
+        hover_data=['min', 'max', 'count']
+    )
+    st.plotly_chart(fig_time, use_container_width=True)
+    
+    # Spatial distribution of cell means
+    by_cell = loader.aggregate(selected_dataset, by=['cell'], resolution=1.0, **filters)
+    fig_map = px.scatter_mapbox(
+        by_cell,
+        lat='latitude',
+        lon='longitude',
+        color='mean',
+        size='count',
+        hover_data=['min', 'max', 'count'],
+        title='Spatial Distribution (1° cells)',
+        mapbox_style='carto-positron',
+        zoom=2
+    )
+    st.plotly_chart(fig_map, use_container_width=True)
+    
+    # Mean depth profile
+    by_depth = loader.aggregate(selected_dataset, by=['variable', 'depth'], depth_bins=10.0, **filters)
+    fig_depth = px.line(
+        by_depth,
+        x='mean',
+        y='depth',
+        color='variable',
+        title='Mean Depth Profile',
+        labels={'mean': 'Mean Value', 'depth': 'Depth (m)'},
+        hover_data=['min', 'max', 'count']
+    )
+    fig_depth.update_yaxes(autorange="reversed")  # Depth increases downward
+    st.plotly_chart(fig_depth, use_container_width=True)
+    
+    # Aggregated data table
+    st.header("Aggregated Data")
+    st.dataframe(
+        by_time,
+        hide_index=True,
+        use_container_width=True
+    )
+    st.stop()
+
+# Load filtered data
+data = loader.load_dataset(selected_dataset, **filters)
+
 # Time series plot
 fig_time = px.scatter(
     data,
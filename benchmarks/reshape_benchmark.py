@@ -0,0 +1,69 @@
+"""
+Benchmark of the wide-to-long reshape: crocolake's NumPy engine against
+the previous DataFrame.melt path.
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from crocolake.converters.reshape import wide_to_long
+
+def make_wide(n_rows: int, n_variables: int, nan_fraction: float, seed: int = 0) -> pd.DataFrame:
+    """Synthetic wide table with a fraction of missing measurements."""
+    rng = np.random.default_rng(seed)
+    data = {
+        'timestamp': pd.date_range('2023-01-01', periods=n_rows, freq='s'),
+        'latitude': rng.uniform(-90, 90, n_rows),
+        'longitude': rng.uniform(-180, 180, n_rows),
+        'depth': rng.uniform(0, 2000, n_rows)
+    }
+    for i in range(n_variables):
+        values = rng.normal(size=n_rows)
+        values[rng.random(n_rows) < nan_fraction] = np.nan
+        data[f'var_{i}'] = values
+    return pd.DataFrame(data)
+
+def melt_path(wide: pd.DataFrame, id_vars: list) -> pd.DataFrame:
+    """The reshape previously done by the converters, followed by dropna."""
+    df_long = wide.melt(id_vars=id_vars, var_name='variable', value_name='value')
+    df_long = df_long.dropna(subset=['value'])
+    df_long['variable'] = df_long['variable'].astype('category')
+    return df_long
+
+def best_time(func, repeat: int) -> float:
+    """Best wall time of several runs, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--variables', type=int, default=8)
+    parser.add_argument('--nan-fraction', type=float, default=0.3)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    wide = make_wide(args.rows, args.variables, args.nan_fraction)
+    id_vars = ['timestamp', 'latitude', 'longitude', 'depth']
+    
+    engine = wide_to_long(wide, id_vars=id_vars)
+    melted = melt_path(wide, id_vars)
+    assert len(engine) == len(melted)
+    
+    melt_time = best_time(lambda: melt_path(wide, id_vars), args.repeat)
+    engine_time = best_time(lambda: wide_to_long(wide, id_vars=id_vars), args.repeat)
+    
+    print(f"{args.rows:,} rows x {args.variables} variables, {args.nan_fraction:.0%} missing "
+          f"-> {len(engine):,} long rows")
+    print(f"melt + dropna: {melt_time:8.3f} s  ({melted.memory_usage(deep=True).sum() / 1e6:,.0f} MB)")
+    print(f"wide_to_long:  {engine_time:8.3f} s  ({engine.memory_usage(deep=True).sum() / 1e6:,.0f} MB)")
+    print(f"speedup:       {melt_time / engine_time:8.1f}x")
+
+if __name__ == '__main__':
+    main()
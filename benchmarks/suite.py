@@ -0,0 +1,247 @@
+"""
+Benchmark suite of the CrocoLake converters and loader.
+
+Synthetic CSV and NetCDF sources are generated and converted, and the
+converted dataset is queried with each kind of filter. Every case runs in
+its own process, where it is timed (best of several runs) and
+memory-profiled: peak Python/NumPy allocations traced by tracemalloc, peak
+Arrow allocations of the default memory pool, and the peak RSS of the
+process. Results are written as JSON and can be compared against a stored
+baseline.
+
+    PYTHONPATH=. python benchmarks/suite.py --rows 1000000 --output results.json
+    PYTHONPATH=. python benchmarks/suite.py --baseline results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from crocolake.converters import CSVConverter, NetCDFConverter
+from crocolake.loader import DataLoader
+from crocolake.profiling import max_rss_bytes
+from synthetic import CSV_MAPPING, NETCDF_MAPPING, write_csv, write_netcdf
+
+def measure(case: Callable[..., Callable[[], Any]], repeat: int, **options: Any) -> Dict[str, Any]:
+    """
+    Time and memory profile of a benchmark case, run in a fresh process.
+    
+    The Arrow memory pool and the process' peak RSS are high-water marks of
+    the whole process, so each case gets its own interpreter to have them
+    cover that case alone.
+    
+    Args:
+        case: Module-level function returning the callable to profile
+        repeat: Timed runs of the callable
+        options: Keyword arguments of case
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_measure, case, repeat, options).result()
+
+def csv_case(source: str, target: str, **options: Any) -> Callable[[], Any]:
+    """Conversion of a generated CSV file."""
+    return CSVConverter(source, target, mapping=CSV_MAPPING, **options).convert
+
+def netcdf_case(source: str, target: str) -> Callable[[], Any]:
+    """Conversion of a generated NetCDF file."""
+    return NetCDFConverter(source, target, variable_mapping=NETCDF_MAPPING).convert
+
+def loader_case(data_dir: str, method: str, *args: Any, **kwargs: Any) -> Callable[[], Any]:
+    """Loader call; queries bypass the cache, so every run reads from disk."""
+    loader = DataLoader(data_dir, cache_bytes=0)
+    return partial(getattr(loader, method), *args, **kwargs)
+
+def query_cases(time_range: tuple) -> Dict[str, Dict[str, Any]]:
+    """load_dataset filters of the loader benchmarks, one per filter type."""
+    start, end = [pd.Timestamp(value) for value in time_range]
+    return {
+        'load_all': {},
+        'load_variables': {'variables': ['temp']},
+        'load_time_range': {'time_range': (start, start + (end - start) / 10)},
+        'load_bbox': {'bbox': {'min_lat': 0.0, 'max_lat': 20.0, 'min_lon': -60.0, 'max_lon': -30.0}},
+        'load_depth_range': {'depth_range': (0.0, 200.0)},
+        'load_combined': {
+            'variables': ['temp'],
+            'time_range': (start, start + (end - start) / 2),
+            'bbox': {'min_lat': -40.0, 'max_lat': 40.0, 'min_lon': -180.0, 'max_lon': 180.0},
+            'depth_range': (0.0, 1000.0)
+        }
+    }
+
+def run_suite(args: argparse.Namespace, work_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Generate the sources and run every case."""
+    results = {}
+    
+    csv_path = work_dir / 'synthetic.csv'
+    csv_size = write_csv(
+        csv_path, n_rows=args.rows, n_variables=args.variables,
+        depth_levels=args.depth_levels, seed=args.seed
+    )
+    results['convert_csv'] = dict(measure(
+        csv_case, args.repeat, source=str(csv_path), target=str(work_dir / 'csv.parquet')
+    ), **csv_size)
+    results['convert_csv_pyarrow'] = dict(measure(
+        csv_case, args.repeat, source=str(csv_path),
+        target=str(work_dir / 'csv_pyarrow.parquet'), engine='pyarrow'
+    ), **csv_size)
+    
+    netcdf_path = work_dir / 'synthetic.nc'
+    netcdf_size = write_netcdf(
+        netcdf_path, n_times=args.times, depth_levels=args.depth_levels,
+        grid=tuple(args.grid), n_variables=args.variables, seed=args.seed
+    )
+    results['convert_netcdf'] = dict(measure(
+        netcdf_case, args.repeat, source=str(netcdf_path), target=str(work_dir / 'netcdf.parquet')
+    ), **netcdf_size)
+    
+    results['get_dataset_info'] = measure(
+        loader_case, args.repeat, data_dir=str(work_dir), method='get_dataset_info', dataset_name='csv'
+    )
+    
+    time_range = DataLoader(str(work_dir)).get_dataset_info('csv')['time_range']
+    for name, filters in query_cases(time_range).items():
+        results[name] = measure(
+            loader_case, args.repeat, data_dir=str(work_dir), method='load_dataset',
+            dataset_name='csv', **filters
+        )
+    
+    return results
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> List[str]:
+    """
+    Print the results next to a baseline.
+    
+    Returns:
+        Names of the cases slower than the baseline by more than tolerance
+    """
+    regressions = []
+    print(f"{'case':<20} {'seconds':>10} {'baseline':>10} {'ratio':>8} {'peak MB':>10}")
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:<20} {result['seconds']:>10.3f} {'-':>10} {'-':>8} {result['peak_mb']:>10.1f}")
+            continue
+        
+        ratio = result['seconds'] / reference['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<20} {result['seconds']:>10.3f} {reference['seconds']:>10.3f} "
+              f"{ratio:>8.2f} {result['peak_mb']:>10.1f}{flag}")
+    
+    return regressions
+
+def environment() -> Dict[str, str]:
+    """Versions the results depend on."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__
+    }
+
+def _measure(case: Callable[..., Callable[[], Any]], repeat: int,
+             options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Profile a case in the current process, see measure.
+    
+    The callable is run once under tracemalloc for its peak allocations,
+    then repeat times untraced for its best wall time. Arrow buffers are
+    not seen by tracemalloc, so the memory pool's peak is added to the
+    traced one; the sum is an upper bound, as both peaks need not coincide.
+    """
+    func = case(**options)
+    pool = pa.default_memory_pool()
+    arrow_start = pool.bytes_allocated()
+    rss_start = _max_rss_mb()
+    
+    tracemalloc.start()
+    result = func()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_peak = max(pool.max_memory() - arrow_start, 0)
+    max_rss = _max_rss_mb()
+    
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    
+    measurement = {
+        'seconds': min(times),
+        'mean_seconds': float(np.mean(times)),
+        'peak_mb': (traced_peak + arrow_peak) / 1e6,
+        'peak_traced_mb': traced_peak / 1e6,
+        'peak_arrow_mb': arrow_peak / 1e6,
+        'max_rss_mb': max_rss,
+        'rss_growth_mb': None if max_rss is None else max_rss - rss_start
+    }
+    if isinstance(result, (pd.DataFrame, pa.Table)):
+        measurement['rows'] = len(result)
+    return measurement
+
+def _max_rss_mb() -> Optional[float]:
+    """Peak resident set size of the process so far in MB, if available (not on Windows)."""
+    max_rss = max_rss_bytes()
+    return None if max_rss is None else max_rss / 1e6
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000, help="Rows of the CSV source")
+    parser.add_argument('--variables', type=int, default=2, help="Variables per source")
+    parser.add_argument('--depth-levels', type=int, default=20, help="Depth levels per profile/grid")
+    parser.add_argument('--times', type=int, default=10, help="Time steps of the NetCDF source")
+    parser.add_argument('--grid', type=int, nargs=2, default=[90, 180], metavar=('NLAT', 'NLON'),
+                        help="Lat/lon grid size of the NetCDF source")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Compare against the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_suite(args, Path(work_dir))
+    
+    report = {
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline', 'tolerance')},
+        'environment': environment(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    
+    if regressions:
+        print(f"Slower than baseline: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Synthetic CSV and NetCDF sources for the CrocoLake benchmarks.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import Dict
+
+# Names of the generated variables; extra ones are called var_<i>
+VARIABLES = ['temperature_c', 'salinity_psu']
+
+# Column mapping of the generated CSV files, as passed to CSVConverter
+CSV_MAPPING = {
+    'time': 'timestamp',
+    'depth_m': 'depth',
+    'temperature_c': 'temp',
+    'salinity_psu': 'sal'
+}
+
+# Variable mapping of the generated NetCDF files, as passed to NetCDFConverter
+NETCDF_MAPPING = {
+    'temperature_c': 'temp',
+    'salinity_psu': 'sal'
+}
+
+def variable_names(n_variables: int) -> list:
+    """Names of the first n_variables generated variables."""
+    extra = [f'var_{i}' for i in range(max(n_variables - len(VARIABLES), 0))]
+    return (VARIABLES + extra)[:n_variables]
+
+def make_profiles(n_rows: int, n_variables: int = 2, depth_levels: int = 20,
+                  nan_fraction: float = 0.1, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic wide-format profiles, as found in cruise or float CSV files.
+    
+    Args:
+        n_rows: Approximate number of rows (profiles x depth levels)
+        n_variables: Number of measured variables per row
+        depth_levels: Number of depth levels per profile
+        nan_fraction: Fraction of missing measurements
+        seed: Random seed
+    
+    Returns:
+        DataFrame with time, latitude, longitude, depth_m and one column
+        per variable
+    """
+    rng = np.random.default_rng(seed)
+    n_profiles = max(n_rows // depth_levels, 1)
+    
+    # Profiles drift along random tracks, one hour apart
+    latitude = np.clip(np.cumsum(rng.normal(0, 0.5, n_profiles)) % 160 - 80, -90, 90)
+    longitude = np.cumsum(rng.normal(0, 0.5, n_profiles)) % 360 - 180
+    times = pd.date_range('2020-01-01', periods=n_profiles, freq='h')
+    depths = np.linspace(0, 2000, depth_levels)
+    
+    data = {
+        'time': np.repeat(times.values, depth_levels),
+        'latitude': np.repeat(latitude, depth_levels),
+        'longitude': np.repeat(longitude, depth_levels),
+        'depth_m': np.tile(depths, n_profiles)
+    }
+    for name in variable_names(n_variables):
+        values = rng.normal(10.0, 5.0, n_profiles * depth_levels)
+        values[rng.random(len(values)) < nan_fraction] = np.nan
+        data[name] = values
+    
+    return pd.DataFrame(data)
+
+def make_grid(n_times: int, depth_levels: int, grid: tuple, n_variables: int = 2,
+              land_fraction: float = 0.3, seed: int = 0) -> xr.Dataset:
+    """
+    Synthetic gridded model output, as found in NetCDF files.
+    
+    Args:
+        n_times: Number of time steps
+        depth_levels: Number of depth levels
+        grid: Number of (latitude, longitude) grid points
+        n_variables: Number of 4-D variables
+        land_fraction: Fraction of grid columns masked as land (NaN)
+        seed: Random seed
+    
+    Returns:
+        Dataset with time, depth, lat and lon dimensions
+    """
+    rng = np.random.default_rng(seed)
+    n_lat, n_lon = grid
+    shape = (n_times, depth_levels, n_lat, n_lon)
+    land = rng.random((n_lat, n_lon)) < land_fraction
+    
+    data_vars = {}
+    for name in variable_names(n_variables):
+        values = rng.normal(10.0, 5.0, shape)
+        values[:, :, land] = np.nan
+        data_vars[name] = (('time', 'depth', 'lat', 'lon'), values)
+    
+    return xr.Dataset(
+        data_vars,
+        coords={
+            'time': pd.date_range('2020-01-01', periods=n_times, freq='D'),
+            'depth': np.linspace(0, 2000, depth_levels),
+            'lat': np.linspace(-80, 80, n_lat),
+            'lon': np.linspace(-180, 180, n_lon, endpoint=False)
+        }
+    )
+
+def write_csv(path: str, **kwargs) -> Dict[str, int]:
+    """Write synthetic profiles to a CSV file, see make_profiles."""
+    df = make_profiles(**kwargs)
+    df.to_csv(path, index=False)
+    return {'rows': len(df), 'values': int(df.iloc[:, 4:].notna().sum().sum())}
+
+def write_netcdf(path: str, **kwargs) -> Dict[str, int]:
+    """Write synthetic gridded data to a NetCDF file, see make_grid."""
+    ds = make_grid(**kwargs)
+    ds.to_netcdf(path)
+    return {
+        'rows': int(np.prod([ds.sizes[dim] for dim in ('time', 'depth', 'lat', 'lon')])),
+        'values': int(sum(ds[name].notnull().sum() for name in ds.data_vars))
+    }
@@ -0,0 +1,492 @@
+"""
+CrocoLake dataset catalog
+
+Opening a dataset directory lists all of its files, and planning a filtered
+query opens every file of the matching partitions to read its footer; on
+lakes with tens of thousands of files both dominate the query time, and
+get_dataset_info reads one statistics sidecar per source. The catalog
+records all of it once, when a dataset is written:
+
+- each dataset directory gets a `_catalog.arrow` file index with the
+  path, size, rows and value ranges (from the row-group statistics) of
+  every file, and the dataset schema and partition values. The dataset is
+  opened from it without listing its directories, and files whose ranges
+  cannot match a query are skipped without being opened;
+- the data directory gets a `_catalog.json` with the version, files, rows,
+  schema, partition values and merged statistics of every dataset.
+
+DataLoader only uses an entry whose recorded version (see dataset_version)
+still matches the dataset on disk, and otherwise falls back to discovering
+the files. The version changes whenever DatasetWriter, BatchConverter or
+the Compactor write a dataset, but not when another tool rewrites a file
+inside a partition directory in place: such writers must run
+update_catalog (or crocolake-catalog) afterwards, which also invalidates
+the query caches of running loaders.
+
+    crocolake-catalog data/processed
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from . import compaction
+from .stats import dataset_stats
+
+logger = logging.getLogger(__name__)
+
+# Catalog of the datasets of a data directory
+CATALOG_NAME = '_catalog.json'
+
+# File locked while the catalog is updated, so that concurrent writers do
+# not lose each other's entries
+LOCK_NAME = '_catalog.json.lock'
+
+# File index of a dataset directory, an Arrow IPC file so that globs for
+# '*.parquet' do not mistake it for data
+INDEX_NAME = '_catalog.arrow'
+
+# Conversion manifest of batch-written datasets; its mtime changes on every run
+MANIFEST_NAME = '_manifest.json'
+
+# Columns whose per-file value range is recorded in the file index
+RANGE_COLUMNS = ['timestamp', 'latitude', 'longitude', 'depth']
+
+# Schema metadata keys of the file index
+SCHEMA_KEY = b'crocolake.dataset_schema'
+PARTITIONS_KEY = b'crocolake.partitions'
+
+# Nanoseconds per unit of parquet timestamp statistics
+TIME_UNITS = {'milliseconds': 10**6, 'microseconds': 10**3, 'nanoseconds': 1}
+
+def dataset_version(dataset_path: str) -> Tuple:
+    """
+    Token that changes whenever a dataset is rewritten.
+    
+    Files are identified by their mtime and size. Directories change
+    their mtime when files or sidecars are added at the top level,
+    and the mtime of their conversion manifest changes on every batch
+    run, like that of their compaction log on every compaction. Files
+    rewritten in place inside partition directories are not seen, as that
+    would take a stat of every file; whoever rewrites them must update the
+    catalog, which replaces the top-level file index.
+    """
+    dataset_path = Path(dataset_path)
+    stat = dataset_path.stat()
+    
+    if not dataset_path.is_dir():
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    mtimes = []
+    for name in (MANIFEST_NAME, compaction.COMPACTION_LOG):
+        path = dataset_path / name
+        mtimes.append(path.stat().st_mtime_ns if path.exists() else None)
+    return (stat.st_mtime_ns, *mtimes)
+
+def build_index(dataset_path: str) -> pa.Table:
+    """
+    File index of a dataset directory.
+    
+    Files are discovered like DataLoader does, without those hidden by
+    compaction, and their footers are read once.
+    
+    Returns:
+        Table with one row per file: its 'path' relative to the dataset,
+        'bytes', 'rows', 'row_groups' and the '<column>_min' and
+        '<column>_max' of the RANGE_COLUMNS, null where a file has no
+        statistics. The schema metadata holds the dataset schema and the
+        partition values.
+    """
+    dataset_path = Path(dataset_path).resolve()
+    hidden = compaction.hidden_files(dataset_path)
+    dataset = ds.dataset(
+        str(dataset_path), format='parquet',
+        partitioning=ds.HivePartitioning.discover(infer_dictionary=True)
+    )
+    
+    columns: Dict[str, list] = {name: [] for name in ('path', 'bytes', 'rows', 'row_groups')}
+    for name in RANGE_COLUMNS:
+        columns[f"{name}_min"] = []
+        columns[f"{name}_max"] = []
+    
+    for file in sorted(dataset.files):
+        relative = Path(file).relative_to(dataset_path).as_posix()
+        if relative in hidden:
+            continue
+        metadata = pq.read_metadata(file)
+        columns['path'].append(relative)
+        columns['bytes'].append(os.path.getsize(file))
+        columns['rows'].append(metadata.num_rows)
+        columns['row_groups'].append(metadata.num_row_groups)
+        for name, (low, high) in _value_ranges(metadata).items():
+            columns[f"{name}_min"].append(low)
+            columns[f"{name}_max"].append(high)
+    
+    arrays = {
+        name: pa.array(values, type=pa.string() if name == 'path' else pa.int64())
+        for name, values in columns.items() if name in ('path', 'bytes', 'rows', 'row_groups')
+    }
+    for name in RANGE_COLUMNS:
+        for bound in ('min', 'max'):
+            values = columns[f"{name}_{bound}"]
+            arrays[f"{name}_{bound}"] = (
+                pa.array(values, type=pa.int64()).cast(pa.timestamp('ns')) if name == 'timestamp'
+                else pa.array(values, type=pa.float64())
+            )
+    
+    # Discovered partition fields have dictionaries; without partition
+    # directories pyarrow reports the file fields, without dictionaries
+    partitions = {}
+    if dataset.partitioning is not None:
+        partitions = {
+            name: dictionary.to_pylist()
+            for name, dictionary in zip(dataset.partitioning.schema.names,
+                                        dataset.partitioning.dictionaries)
+            if dictionary is not None
+        }
+    
+    return pa.table(arrays).replace_schema_metadata({
+        SCHEMA_KEY: base64.b64encode(dataset.schema.serialize().to_pybytes()),
+        PARTITIONS_KEY: json.dumps(partitions)
+    })
+
+def open_index(dataset_path: str, filesystem: Optional[pafs.FileSystem] = None
+               ) -> Tuple[ds.FileSystemDataset, pa.Table]:
+    """
+    Open a dataset directory from its file index, without listing it.
+    
+    Returns:
+        The dataset, with the same schema and partition columns as when
+        discovered, and the file index, in the order of its fragments
+    """
+    dataset_path = Path(dataset_path).resolve()
+    index = feather.read_table(dataset_path / INDEX_NAME)
+    schema, partitions = _index_schema(index)
+    
+    partitioning = None
+    if partitions:
+        partition_schema = pa.schema([schema.field(name) for name in partitions])
+        partitioning = ds.HivePartitioning(partition_schema, dictionaries={
+            name: pa.array(values, type=partition_schema.field(name).type.value_type)
+            for name, values in partitions.items()
+        })
+    
+    # Files of a directory share its partition expression
+    expressions = {}
+    partition_expressions = []
+    paths = index.column('path').to_pylist()
+    for path in paths:
+        directory = path.rpartition('/')[0]
+        if directory not in expressions:
+            expressions[directory] = (
+                partitioning.parse(f"/{directory}/") if partitioning is not None and directory
+                else ds.scalar(True)
+            )
+        partition_expressions.append(expressions[directory])
+    
+    dataset = ds.FileSystemDataset.from_paths(
+        [f"{dataset_path.as_posix()}/{path}" for path in paths],
+        schema=schema,
+        format=ds.ParquetFileFormat(),
+        filesystem=filesystem or pafs.LocalFileSystem(),
+        partitions=partition_expressions
+    )
+    return dataset, index
+
+def candidate_files(index: pa.Table, time_range: Optional[tuple] = None,
+                    bbox: Optional[Dict[str, float]] = None,
+                    depth_range: Optional[tuple] = None) -> np.ndarray:
+    """
+    Mask of the files of an index whose value ranges can match the filters
+    of a query, with the semantics of DataLoader.load_dataset. Files without
+    statistics for a filtered column are kept.
+    """
+    keep = np.ones(index.num_rows, dtype=bool)
+    
+    if time_range:
+        start, end = (
+            pa.scalar(pd.Timestamp(value)).cast(pa.timestamp('ns'), safe=False)
+            for value in time_range
+        )
+        keep &= _overlaps(index, 'timestamp', start, end)
+    
+    if depth_range:
+        keep &= _overlaps(index, 'depth', float(depth_range[0]), float(depth_range[1]))
+    
+    if bbox:
+        keep &= _overlaps(index, 'latitude', float(bbox['min_lat']), float(bbox['max_lat']))
+        if bbox['min_lon'] <= bbox['max_lon']:
+            keep &= _overlaps(index, 'longitude', float(bbox['min_lon']), float(bbox['max_lon']))
+        else:
+            # A box crossing the antimeridian only misses files lying
+            # entirely between its eastern and western edges
+            keep &= ~(_above(index, 'longitude', float(bbox['max_lon'])) &
+                      _below(index, 'longitude', float(bbox['min_lon'])))
+    
+    return keep
+
+class DatasetCatalog:
+    """
+    Catalog entries of the datasets of a data directory.
+    
+    Each entry records the dataset 'version' it describes (see
+    dataset_version), its 'files', 'rows', 'row_groups' and 'bytes', its
+    'schema' as column types, its 'partitions' values, its merged
+    statistics sidecars as 'stats' (None without sidecars) and the name of
+    its file 'index' (None for single files).
+    """
+    
+    def __init__(self, data_dir: str):
+        self.data_dir = Path(data_dir)
+        self.datasets: Dict[str, Dict[str, Any]] = {}
+    
+    @property
+    def path(self) -> Path:
+        return self.data_dir / CATALOG_NAME
+    
+    @classmethod
+    def load(cls, data_dir: str) -> 'DatasetCatalog':
+        """Load the catalog of a data directory, or return an empty one."""
+        catalog = cls(data_dir)
+        if catalog.path.exists():
+            with open(catalog.path) as f:
+                catalog.datasets = json.load(f)['datasets']
+        return catalog
+    
+    def save(self) -> None:
+        """Atomically write the catalog."""
+        with _atomic_path(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': 1, 'datasets': self.datasets}, f, indent=2)
+    
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """Hold the catalog's file lock, to load, update and save it safely."""
+        with open(self.data_dir / LOCK_NAME, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    
+    def entry(self, dataset_name: str, version: Tuple) -> Optional[Dict[str, Any]]:
+        """Entry of a dataset, or None if missing or recorded for another version."""
+        entry = self.datasets.get(dataset_name)
+        if entry is None or entry['version'] != list(version):
+            return None
+        return entry
+    
+    def update(self, dataset_name: str) -> Dict[str, Any]:
+        """
+        Record the current state of a dataset of the data directory,
+        writing its file index if it is a directory.
+        
+        Returns:
+            The new entry
+        """
+        dataset_path = self.data_dir / f"{dataset_name}.parquet"
+        if not dataset_path.exists():
+            raise FileNotFoundError(f"Dataset {dataset_name} not found at {dataset_path}")
+        
+        if dataset_path.is_dir():
+            index = build_index(dataset_path)
+            with _atomic_path(dataset_path / INDEX_NAME) as tmp_path:
+                feather.write_feather(index, tmp_path, compression='uncompressed')
+            
+            schema, partitions = _index_schema(index)
+            n_files = index.num_rows
+            counts = {
+                name: int(pc.sum(index.column(name)).as_py() or 0)
+                for name in ('rows', 'row_groups', 'bytes')
+            }
+        else:
+            metadata = pq.read_metadata(dataset_path)
+            schema = metadata.schema.to_arrow_schema()
+            partitions = {}
+            n_files = 1
+            counts = {
+                'rows': metadata.num_rows,
+                'row_groups': metadata.num_row_groups,
+                'bytes': dataset_path.stat().st_size
+            }
+        
+        entry = {
+            # Taken after writing the index, which changes the directory's mtime
+            'version': list(dataset_version(dataset_path)),
+            'files': n_files,
+            **counts,
+            'schema': {field.name: str(field.type) for field in schema},
+            'partitions': partitions,
+            'stats': dataset_stats(dataset_path, compaction.hidden_files(dataset_path)),
+            'index': INDEX_NAME if dataset_path.is_dir() else None
+        }
+        self.datasets[dataset_name] = entry
+        return entry
+    
+    def prune(self) -> None:
+        """Drop the entries of datasets that no longer exist."""
+        self.datasets = {
+            name: entry for name, entry in self.datasets.items()
+            if (self.data_dir / f"{name}.parquet").exists()
+        }
+
+def update_catalog(dataset_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Update the catalog entry of a dataset after it was written.
+    
+    Files written inside a dataset directory (e.g. by a batch conversion)
+    are part of that dataset, not datasets of their own, and are skipped.
+    
+    The catalog only speeds up reading, so the update is best-effort: a
+    failure is logged and never fails the write.
+    
+    Returns:
+        The new entry, or None if the path is not a dataset of a data
+        directory or the update failed
+    """
+    dataset_path = Path(dataset_path)
+    if dataset_path.suffix != '.parquet' or dataset_path.parent.suffix == '.parquet':
+        return None
+    if dataset_path.name.startswith('_') or not dataset_path.exists():
+        return None
+    
+    try:
+        catalog = DatasetCatalog(dataset_path.parent)
+        with catalog.lock():
+            catalog = DatasetCatalog.load(dataset_path.parent)
+            entry = catalog.update(dataset_path.stem)
+            catalog.prune()
+            catalog.save()
+    except Exception as error:
+        logger.warning("Could not update the catalog of %s: %s", dataset_path, error)
+        return None
+    return entry
+
+@contextmanager
+def _atomic_path(path: Path) -> Iterator[Path]:
+    """
+    Temporary path in the directory of path, moved over path once written.
+    Its name is unique, so concurrent writers never share it.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{path.name}.", suffix='.tmp', dir=path.parent)
+    os.close(fd)
+    try:
+        yield Path(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def _index_schema(index: pa.Table) -> Tuple[pa.Schema, Dict[str, List[Any]]]:
+    """Dataset schema and partition values stored in a file index."""
+    metadata = index.schema.metadata
+    schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(metadata[SCHEMA_KEY])))
+    return schema, json.loads(metadata[PARTITIONS_KEY])
+
+def _value_ranges(metadata: pq.FileMetaData) -> Dict[str, Tuple[Any, Any]]:
+    """
+    Min/max of the RANGE_COLUMNS over the row groups of a file, timestamps
+    as integer nanoseconds; (None, None) where statistics are missing.
+    """
+    positions = {
+        metadata.schema.column(i).path: i for i in range(metadata.num_columns)
+    }
+    ranges = {}
+    for name in RANGE_COLUMNS:
+        ranges[name] = (None, None)
+        if name not in positions:
+            continue
+        
+        scale = 1
+        if name == 'timestamp':
+            logical_type = json.loads(metadata.schema.column(positions[name]).logical_type.to_json())
+            scale = TIME_UNITS.get(logical_type.get('timeUnit'))
+            if scale is None:
+                continue
+        
+        lows, highs = [], []
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            statistics = row_group.column(positions[name]).statistics
+            if statistics is not None and statistics.has_min_max:
+                lows.append(statistics.min_raw)
+                highs.append(statistics.max_raw)
+            elif statistics is None or statistics.null_count != row_group.num_rows:
+                # Only all-null row groups, which never match a filter, may
+                # lack a range
+                break
+        else:
+            if lows:
+                ranges[name] = (min(lows) * scale, max(highs) * scale)
+    
+    return ranges
+
+def _overlaps(index: pa.Table, column: str, low: Any, high: Any) -> np.ndarray:
+    """Files whose range of a column may intersect [low, high]."""
+    return ~(_below(index, column, low) | _above(index, column, high))
+
+def _below(index: pa.Table, column: str, value: Any) -> np.ndarray:
+    """Files whose values of a column are all smaller than value."""
+    return pc.fill_null(pc.less(index.column(f"{column}_max"), value), False).to_numpy()
+
+def _above(index: pa.Table, column: str, value: Any) -> np.ndarray:
+    """Files whose values of a column are all greater than value."""
+    return pc.fill_null(pc.greater(index.column(f"{column}_min"), value), False).to_numpy()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point rebuilding the catalog of a data directory."""
+    parser = argparse.ArgumentParser(
+        description="Rebuild the catalog of the datasets of a CrocoLake data directory."
+    )
+    parser.add_argument('data_dir', help="Data directory")
+    args = parser.parse_args(argv)
+    
+    data_dir = Path(args.data_dir)
+    if not data_dir.is_dir():
+        raise FileNotFoundError(f"Data directory not found: {data_dir}")
+    
+    catalog = DatasetCatalog(data_dir)
+    with catalog.lock():
+        for path in sorted(data_dir.glob('*.parquet')):
+            if not path.name.startswith('_'):
+                catalog.update(path.stem)
+        catalog.save()
+    
+    print(json.dumps({
+        name: {key: entry[key] for key in ('files', 'rows', 'row_groups', 'bytes')}
+        for name, entry in catalog.datasets.items()
+    }, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
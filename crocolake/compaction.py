@@ -0,0 +1,409 @@
+"""
+CrocoLake dataset compaction
+
+Batch conversions leave one or more parquet files per source in every
+partition of a dataset, and scans of datasets with thousands of small files
+are dominated by opening files and reading footers. The Compactor rewrites
+the small files of each partition into files of a target size, with sorted
+rows and fresh parquet statistics.
+
+Compacted files replace the originals atomically for readers. Replacements
+are recorded in a log at the root of the dataset: a group of new files is
+first logged as pending (readers ignore the new files), then written, then
+committed in a single atomic write of the log (readers ignore the old files
+from then on). Old files are deleted by a later run once they have been
+replaced for longer than the retention period, so that queries which
+listed them before the commit can still read them.
+    
+    crocolake-compact data/processed/argo.parquet --target-mb 128
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Set
+
+from . import catalog
+from .stats import replace_files
+from .spatial import CELL_COLUMN
+
+# Name of the replacement log at the root of a dataset directory; the leading
+# underscore keeps it out of pyarrow's dataset discovery
+COMPACTION_LOG = '_compaction.json'
+
+# Size of the files written by compaction
+DEFAULT_TARGET_BYTES = 128 * 1024 * 1024
+
+# Seconds replaced files are kept for readers that listed them before
+DEFAULT_RETENTION = 3600.0
+
+# Number of rows per row group of compacted files, as written by DatasetWriter
+ROW_GROUP_SIZE = 128 * 1024
+
+# Prefix of the files written by compaction
+COMPACT_PREFIX = 'compact'
+
+class CompactionLog:
+    """
+    Replacement groups of a dataset directory.
+    
+    Each group maps 'old' files to the 'new' files holding their rows, with
+    a 'state' of 'pending' (new files are being written and are hidden) or
+    'committed' (old files are hidden until deleted). Paths are relative to
+    the dataset directory.
+    """
+    
+    def __init__(self, dataset_path: str):
+        self.dataset_path = Path(dataset_path)
+        self.groups: List[Dict[str, Any]] = []
+    
+    @property
+    def path(self) -> Path:
+        return self.dataset_path / COMPACTION_LOG
+    
+    @classmethod
+    def load(cls, dataset_path: str) -> 'CompactionLog':
+        """Load the log of a dataset, or return an empty one."""
+        log = cls(dataset_path)
+        if log.path.exists():
+            with open(log.path) as f:
+                log.groups = json.load(f)['groups']
+        return log
+    
+    def save(self) -> None:
+        """Atomically write the log; this is the commit point of replacements."""
+        if not self.groups:
+            if self.path.exists():
+                self.path.unlink()
+            return
+        
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': 1, 'groups': self.groups}, f, indent=2)
+        os.replace(tmp_path, self.path)
+    
+    def hidden_files(self) -> Set[str]:
+        """Files readers must ignore: new files of pending groups, old files of committed ones."""
+        hidden = set()
+        for group in self.groups:
+            hidden.update(group['new'] if group['state'] == 'pending' else group['old'])
+        return hidden
+
+def hidden_files(dataset_path: str) -> Set[str]:
+    """Paths, relative to a dataset directory, of the files readers must ignore."""
+    return CompactionLog.load(dataset_path).hidden_files()
+
+class Compactor:
+    """
+    Merge the small parquet files of a dataset directory.
+    
+    Runs are incremental: files at least small_bytes large are left alone,
+    so a run after new conversions only rewrites the new small files. The
+    compactor must not run concurrently with writers of the same dataset;
+    readers are safe.
+    """
+    
+    def __init__(self, dataset_path: str, target_bytes: int = DEFAULT_TARGET_BYTES,
+                 small_bytes: Optional[int] = None, min_files: int = 2,
+                 retention: float = DEFAULT_RETENTION, compression: str = 'snappy'):
+        """
+        Initialize the compactor.
+        
+        Args:
+            dataset_path: Path of a hive-partitioned (or batch-converted)
+                dataset directory
+            target_bytes: Approximate size of the compacted files
+            small_bytes: Files smaller than this are compacted (default:
+                half of target_bytes)
+            min_files: Minimum number of small files in a partition for it
+                to be compacted
+            retention: Seconds replaced files are kept before deletion
+            compression: Parquet compression codec of the compacted files
+        """
+        self.dataset_path = Path(dataset_path)
+        if not self.dataset_path.is_dir():
+            raise ValueError(f"Only dataset directories can be compacted: {dataset_path}")
+        
+        self.target_bytes = target_bytes
+        self.small_bytes = target_bytes // 2 if small_bytes is None else small_bytes
+        self.min_files = min_files
+        self.retention = retention
+        self.compression = compression
+    
+    def compact(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Compact the small files of every partition.
+        
+        Interrupted runs are rolled back and expired replaced files are
+        deleted first, see vacuum.
+        
+        Args:
+            dry_run: Only report the files that would be compacted
+        
+        Returns:
+            Report with the number of 'partitions' compacted,
+            'files_compacted', 'files_written', 'bytes_before',
+            'bytes_after', 'files_deleted' by the vacuum and 'seconds'
+        """
+        start = time.perf_counter()
+        log = CompactionLog.load(self.dataset_path)
+        report = {
+            'partitions': 0,
+            'files_compacted': 0,
+            'files_written': 0,
+            'bytes_before': 0,
+            'bytes_after': 0,
+            'files_deleted': 0 if dry_run else self._vacuum(log)
+        }
+        
+        plans = self._plan(log)
+        for bins in plans.values():
+            report['partitions'] += 1
+            for files in bins:
+                report['files_compacted'] += len(files)
+                report['bytes_before'] += sum(self._size(path) for path in files)
+        
+        if dry_run:
+            report['seconds'] = time.perf_counter() - start
+            return report
+        if not plans:
+            catalog.update_catalog(self.dataset_path)
+            report['seconds'] = time.perf_counter() - start
+            return report
+        
+        groups = []
+        for partition, bins in plans.items():
+            for files in bins:
+                group = self._group(partition, files, n_new=1)
+                groups.append(group)
+                log.groups.append(group)
+        log.save()
+        
+        for group in groups:
+            self._rewrite(group['old'], group['new'][0])
+            report['files_written'] += 1
+            report['bytes_after'] += self._size(group['new'][0])
+            self._commit(group)
+        log.save()
+        
+        # The rows are unchanged, so the statistics and overviews stay valid
+        # once their sidecars describe the compacted files
+        for group in groups:
+            replace_files(self.dataset_path, group['old'], group['new'])
+        catalog.update_catalog(self.dataset_path)
+        
+        report['seconds'] = time.perf_counter() - start
+        return report
+    
+    def vacuum(self, retention: Optional[float] = None) -> int:
+        """
+        Roll back interrupted runs and delete the files replaced for longer
+        than the retention period.
+        
+        Returns:
+            Number of files deleted
+        """
+        log = CompactionLog.load(self.dataset_path)
+        deleted = self._vacuum(log, retention)
+        catalog.update_catalog(self.dataset_path)
+        return deleted
+    
+    def remove_source(self, source: str, partitions: List[str]) -> int:
+        """
+        Remove the rows of a source from the compacted files of partitions,
+        e.g. when the source is re-converted or deleted.
+        
+        Args:
+            source: Value of the 'source' column of the rows to remove
+            partitions: Partition directories, relative to the dataset
+        
+        Returns:
+            Number of rows removed
+        """
+        log = CompactionLog.load(self.dataset_path)
+        hidden = log.hidden_files()
+        
+        rewrites = []
+        for partition in sorted(set(partitions)):
+            directory = self.dataset_path / partition
+            for path in sorted(directory.glob(f"{COMPACT_PREFIX}-*.parquet")):
+                relative = path.relative_to(self.dataset_path).as_posix()
+                if relative in hidden:
+                    continue
+                sources = pq.read_table(path, columns=['source']).column('source')
+                matches = int(pc.sum(pc.equal(sources.cast(pa.string()), source)).as_py() or 0)
+                if matches:
+                    rewrites.append((relative, matches))
+        
+        if not rewrites:
+            return 0
+        
+        groups = [self._group(Path(relative).parent.as_posix(), [relative], n_new=1) for relative, _ in rewrites]
+        log.groups.extend(groups)
+        log.save()
+        
+        for group in groups:
+            self._rewrite(group['old'], group['new'][0], exclude_source=source)
+            self._commit(group)
+        log.save()
+        
+        return sum(matches for _, matches in rewrites)
+    
+    def release(self, files: List[str]) -> int:
+        """
+        Delete replaced files before the end of their retention period, so
+        that new files can be written under their names.
+        
+        Args:
+            files: Paths, relative to the dataset, of files replaced by a
+                committed compaction
+        
+        Returns:
+            Number of files deleted
+        """
+        log = CompactionLog.load(self.dataset_path)
+        files = set(files)
+        deleted = 0
+        
+        for group in log.groups:
+            if group['state'] != 'committed':
+                continue
+            for relative in files.intersection(group['old']):
+                path = self.dataset_path / relative
+                if path.exists():
+                    path.unlink()
+                    deleted += 1
+            group['old'] = [relative for relative in group['old'] if relative not in files]
+        
+        log.groups = [group for group in log.groups if group['state'] == 'pending' or group['old']]
+        log.save()
+        return deleted
+    
+    def _plan(self, log: CompactionLog) -> Dict[str, List[List[str]]]:
+        """Small live files of each partition, in bins of about target_bytes."""
+        hidden = log.hidden_files()
+        small: Dict[str, List[str]] = {}
+        for path in sorted(self.dataset_path.rglob('*.parquet')):
+            relative = path.relative_to(self.dataset_path)
+            if any(part.startswith(('_', '.')) for part in relative.parts):
+                continue
+            if relative.as_posix() in hidden or path.stat().st_size >= self.small_bytes:
+                continue
+            small.setdefault(relative.parent.as_posix(), []).append(relative.as_posix())
+        
+        plans = {}
+        for partition, files in small.items():
+            if len(files) < self.min_files:
+                continue
+            bins = [[]]
+            size = 0
+            for relative in files:
+                file_size = self._size(relative)
+                if bins[-1] and size + file_size > self.target_bytes:
+                    bins.append([])
+                    size = 0
+                bins[-1].append(relative)
+                size += file_size
+            bins = [files for files in bins if len(files) >= self.min_files]
+            if bins:
+                plans[partition] = bins
+        return plans
+    
+    def _rewrite(self, old: List[str], new: str, exclude_source: Optional[str] = None) -> None:
+        """Write the rows of old files, sorted, to a new file."""
+        tables = [pq.read_table(self.dataset_path / relative) for relative in old]
+        schema = tables[0].schema
+        table = pa.concat_tables([table.cast(schema) for table in tables])
+        
+        if exclude_source is not None:
+            table = table.filter(pc.not_equal(table.column('source').cast(pa.string()), exclude_source))
+        
+        sort_keys = [name for name in (CELL_COLUMN, 'timestamp', 'latitude') if name in table.column_names]
+        if sort_keys:
+            table = table.take(pc.sort_indices(table, sort_keys=[(name, 'ascending') for name in sort_keys]))
+        
+        pq.write_table(
+            table, self.dataset_path / new,
+            row_group_size=ROW_GROUP_SIZE, compression=self.compression
+        )
+    
+    def _vacuum(self, log: CompactionLog, retention: Optional[float] = None) -> int:
+        retention = self.retention if retention is None else retention
+        now = time.time()
+        deleted = 0
+        
+        kept = []
+        for group in log.groups:
+            if group['state'] == 'pending':
+                # Interrupted run: its new files were never visible
+                paths = group['new']
+            elif now - group['committed_at'] >= retention:
+                paths = group['old']
+            else:
+                kept.append(group)
+                continue
+            
+            for relative in paths:
+                path = self.dataset_path / relative
+                if path.exists():
+                    path.unlink()
+                    deleted += 1
+        
+        if len(kept) != len(log.groups):
+            log.groups = kept
+            log.save()
+        return deleted
+    
+    @staticmethod
+    def _group(partition: str, old: List[str], n_new: int) -> Dict[str, Any]:
+        token = uuid.uuid4().hex[:12]
+        prefix = '' if partition in ('', '.') else f"{partition}/"
+        return {
+            'state': 'pending',
+            'old': list(old),
+            'new': [f"{prefix}{COMPACT_PREFIX}-{token}-{i}.parquet" for i in range(n_new)],
+            'committed_at': None
+        }
+    
+    @staticmethod
+    def _commit(group: Dict[str, Any]) -> None:
+        group['state'] = 'committed'
+        group['committed_at'] = time.time()
+    
+    def _size(self, relative: str) -> int:
+        return (self.dataset_path / relative).stat().st_size
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point of the compactor."""
+    parser = argparse.ArgumentParser(
+        description="Compact the small parquet files of a CrocoLake dataset directory."
+    )
+    parser.add_argument('dataset', help="Dataset directory")
+    parser.add_argument('--target-mb', type=float, default=DEFAULT_TARGET_BYTES / 2**20,
+                        help="Size of the compacted files in MiB")
+    parser.add_argument('--small-mb', type=float, default=None,
+                        help="Compact files smaller than this, in MiB (default: half the target)")
+    parser.add_argument('--retention', type=float, default=DEFAULT_RETENTION,
+                        help="Seconds replaced files are kept for running queries")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be compacted")
+    args = parser.parse_args(argv)
+    
+    compactor = Compactor(
+        args.dataset,
+        target_bytes=int(args.target_mb * 2**20),
+        small_bytes=None if args.small_mb is None else int(args.small_mb * 2**20),
+        retention=args.retention
+    )
+    report = compactor.compact(dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,9 +5,17 @@ CrocoLake data converters
 from .base import BaseConverter
 from .csv_converter import CSVConverter
 from .netcdf_converter import NetCDFConverter
+from .writer import DatasetWriter
+from .batch import BatchConverter
+from .manifest import ConversionManifest
+from .merge import DatasetMerger
 
 __all__ = [
     "BaseConverter",
     "CSVConverter",
-    "NetCDFConverter"
+    "NetCDFConverter",
+    "DatasetWriter",
+    "BatchConverter",
+    "ConversionManifest",
+    "DatasetMerger"
 ] 
\ No newline at end of file
@@ -1,26 +1,87 @@
 from abc import ABC, abstractmethod
+from pathlib import Path
+import numpy as np
 import pandas as pd
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List, ContextManager
+from ..schema import CrocoLakeSchema
+from .. import profiling
+from ..profiling import StageProfiler, Hook
+from ..validation import (
+    DEFAULT_MAX_SAMPLES, QuarantineWriter, coerce, quarantine_path, validate, violating_rows
+)
+from .writer import DatasetWriter
 
 class BaseConverter(ABC):
     """Base class for all data converters in CrocoLake."""
     
-    def __init__(self, source_path: str, target_path: Optional[str] = None):
+    def __init__(self, source_path: str, target_path: Optional[str] = None,
+                 writer_options: Optional[Dict[str, Any]] = None,
+                 validation: Optional[Dict[str, Any]] = None):
         """
         Initialize the converter.
         
         Args:
             source_path: Path to the source data file
             target_path: Optional path where to save the converted data
+            writer_options: Optional keyword arguments for DatasetWriter, e.g.
+                {'partitioned': True, 'time_partition': 'month'}
+            validation: Optional validation settings:
+                'schema' - CrocoLakeSchema to coerce and validate against;
+                    otherwise the default schema with the 'timestamp_format',
+                    'timezone' and 'ranges' settings, see
+                    CrocoLakeSchema.from_config
+                'on_invalid' - what to do with rows violating the schema:
+                    'raise' (default), 'drop' or 'quarantine' (drop them
+                    and append them to a side file, see quarantine_path)
+                'max_samples' - number of violating rows in error messages
         """
         self.source_path = source_path
         self.target_path = target_path or self._default_target_path()
+        self.writer_options = writer_options or {}
+        
+        validation = dict(validation or {})
+        self.on_invalid = validation.pop('on_invalid', 'raise')
+        if self.on_invalid not in ('raise', 'drop', 'quarantine'):
+            raise ValueError(f"Unsupported on_invalid: {self.on_invalid}")
+        self.max_samples = validation.pop('max_samples', DEFAULT_MAX_SAMPLES)
+        self.schema = validation.pop('schema', None) or CrocoLakeSchema.from_config(validation)
+        self.validation_counts: Dict[str, int] = {}
+        self._quarantine = None
+        self.hooks: List[Hook] = []
+        self.profiler: Optional[StageProfiler] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+    
+    def add_hook(self, hook: Hook) -> None:
+        """
+        Register a callback receiving the stage events and the report of
+        every conversion, see crocolake.profiling.
+        """
+        self.hooks.append(hook)
+    
+    def stage(self, name: str) -> ContextManager[Dict[str, int]]:
+        """
+        Time a stage of the current conversion, e.g. 'transform.reshape'.
+        
+        Yields a dict in which the stage can record its 'rows' and 'bytes'.
+        Outside convert() nothing is recorded.
+        """
+        return profiling.stage(self.profiler, name)
         
     @abstractmethod
     def read_data(self) -> pd.DataFrame:
         """Read the source data into a pandas DataFrame."""
         pass
     
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """
+        Yield the source data in chunks.
+        
+        Converters that can read their source incrementally override this
+        so that convert() never holds more than one chunk in memory. The
+        default yields the whole source as a single chunk.
+        """
+        yield self.read_data()
+    
     @abstractmethod
     def transform_data(self, data: pd.DataFrame) -> pd.DataFrame:
         """Transform the data into CrocoLake's schema."""
@@ -28,7 +89,11 @@ class BaseConverter(ABC):
     
     def validate_schema(self, data: pd.DataFrame) -> bool:
         """
-        Validate that the DataFrame follows CrocoLake's schema.
+        Validate that the DataFrame follows the converter's schema.
+        
+        Besides the presence and dtype of the columns, the values are
+        checked: no missing values, coordinates and depth within range,
+        finite measurements. See validate_data for the details of failures.
         
         Required columns:
         - timestamp: Timestamp of the observation
@@ -40,32 +105,191 @@ class BaseConverter(ABC):
         - unit: Unit of measurement
         - source: Source of the data
         """
-        required_columns = [
-            'timestamp', 'latitude', 'longitude', 'depth',
-            'variable', 'value', 'unit', 'source'
-        ]
+        return validate(data, self.schema, max_samples=0).valid
+    
+    def coerce_data(self, data: pd.DataFrame, numeric: List[str] = ()) -> pd.DataFrame:
+        """
+        Cast the schema columns (and the numeric measurement columns) of a
+        chunk to their types, see crocolake.validation.coerce.
+        
+        Values that cannot be parsed become missing and are counted as
+        '<column>:unparseable'; with on_invalid='raise' they are an error.
+        """
+        data, errors = coerce(data, self.schema, numeric=numeric)
+        for column, count in errors.items():
+            self._count_violations(f"{column}:unparseable", count)
+        
+        if errors and self.on_invalid == 'raise':
+            details = ', '.join(f"{column}: {count}" for column, count in errors.items())
+            raise ValueError(f"Values could not be parsed ({details})")
+        return data
+    
+    def validate_data(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Validate a transformed chunk and handle the rows violating the schema.
+        
+        Missing or mistyped columns always raise a ValueError. Violating
+        rows raise a ValueError listing counts per rule and sample rows with
+        on_invalid='raise'; otherwise they are dropped, and with
+        'quarantine' appended to the quarantine file.
+        
+        Returns:
+            The rows to write
+        """
+        result = validate(data, self.schema, max_samples=self.max_samples)
+        if result.structural:
+            raise ValueError(f"Transformed data does not match CrocoLake schema: {result.summary()}")
+        if result.valid:
+            return data
         
-        return all(col in data.columns for col in required_columns)
+        for rule, count in result.counts.items():
+            self._count_violations(rule, count)
+        self._count_violations('rows_invalid', result.n_invalid)
+        
+        if self.on_invalid == 'raise':
+            raise ValueError(
+                f"Transformed data does not match CrocoLake schema: {result.summary()}\n"
+                f"{result.samples.to_string()}"
+            )
+        
+        if self.on_invalid == 'quarantine':
+            if self._quarantine is None:
+                self._quarantine = QuarantineWriter(self.quarantine_path)
+            self._quarantine.write(violating_rows(data, result.masks))
+        
+        return data[~result.invalid]
+    
+    @property
+    def quarantine_path(self) -> Path:
+        """Path of the side file receiving the quarantined rows."""
+        target_path = Path(self.target_path)
+        if self.writer_options.get('partitioned'):
+            basename = self.writer_options.get('basename', 'part')
+            return quarantine_path(target_path / f"{basename}.parquet")
+        return quarantine_path(target_path)
     
     def save_data(self, data: pd.DataFrame) -> None:
-        """Save the data in parquet format."""
-        data.to_parquet(
-            self.target_path,
-            engine='pyarrow',
-            compression='snappy',
-            index=False
-        )
+        """
+        Save the data in parquet format.
+        
+        By default a single parquet file is written. With
+        writer_options={'partitioned': True} the data is written as a
+        hive-style directory partitioned by variable, see DatasetWriter.
+        """
+        with self.create_writer() as writer:
+            writer.write(data)
+    
+    def create_writer(self) -> DatasetWriter:
+        """Create the writer for the target dataset."""
+        return DatasetWriter(self.target_path, **self.writer_options)
     
-    def convert(self) -> None:
-        """Convert the data from source format to CrocoLake format."""
-        data = self.read_data()
-        transformed_data = self.transform_data(data)
+    def convert(self, profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Convert the data from source format to CrocoLake format.
+        
+        The source is processed chunk by chunk (see iter_chunks) and each
+        transformed chunk is appended to the target dataset.
         
-        if not self.validate_schema(transformed_data):
-            raise ValueError("Transformed data does not match CrocoLake schema")
+        Every stage (read, transform, validate, write, close and their
+        sub-stages) is timed and its rows and in-memory bytes are counted;
+        the hooks receive each stage as it ends and the report at the end.
         
-        self.save_data(transformed_data)
+        Args:
+            profile: Optional capture mode, 'cprofile' or 'tracemalloc',
+                see crocolake.profiling.StageProfiler
+        
+        Returns:
+            Run report, also stored in last_report
+        """
+        self.profiler = StageProfiler(self.hooks, mode=profile).start()
+        self.validation_counts = {}
+        if self.quarantine_path.exists():
+            self.quarantine_path.unlink()
+        
+        try:
+            with self.create_writer() as writer:
+                writer.profiler = self.profiler
+                # The quarantine file of a partitioned target lives in its directory
+                writer.prepare()
+                chunks = self.iter_chunks()
+                
+                while True:
+                    with self.stage('read') as counts:
+                        data = next(chunks, None)
+                        if data is not None:
+                            counts['rows'] = len(data)
+                            counts['bytes'] = int(data.memory_usage(index=False).sum())
+                    if data is None:
+                        break
+                    
+                    with self.stage('transform') as counts:
+                        transformed_data = self.transform_data(data)
+                        counts['rows'] = len(transformed_data)
+                    
+                    with self.stage('validate') as counts:
+                        transformed_data = self.validate_data(transformed_data)
+                        counts['rows'] = len(transformed_data)
+                    
+                    with self.stage('write') as counts:
+                        writer.write(transformed_data)
+                        counts['rows'] = len(transformed_data)
+                        counts['bytes'] = int(transformed_data.memory_usage(index=False).sum())
+                
+                with self.stage('close'):
+                    writer.close()
+            
+            self.profiler.count('bytes_written', _disk_size(self.target_path))
+            report = self.profiler.stop()
+        except BaseException:
+            self.profiler.cancel()
+            raise
+        finally:
+            self.profiler = None
+            if self._quarantine is not None:
+                self._quarantine.close()
+                self._quarantine = None
+        
+        report.update(
+            source=str(self.source_path),
+            target=str(self.target_path),
+            validation=dict(self.validation_counts)
+        )
+        self.last_report = report
+        return report
+    
+    def _count_violations(self, name: str, count: int) -> None:
+        self.validation_counts[name] = self.validation_counts.get(name, 0) + count
     
     def _default_target_path(self) -> str:
         """Generate default target path if none is provided."""
-        return self.source_path.rsplit('.', 1)[0] + '.parquet' 
\ No newline at end of file
+        return self.source_path.rsplit('.', 1)[0] + '.parquet' 
+
+def _disk_size(path: str) -> int:
+    """Size in bytes of a parquet file, or of all parquet files under a directory."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(item.stat().st_size for item in path.rglob('*.parquet'))
+    return path.stat().st_size if path.exists() else 0
+
+def constant_categorical(value: str, length: int) -> pd.Categorical:
+    """Categorical repeating a single value, without building a string per row."""
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[value])
+
+def map_categorical(values: pd.Series, mapping: Dict[str, str],
+                    default: Optional[str] = None) -> pd.Categorical:
+    """
+    Map the values of a column through a dictionary, as a categorical.
+    
+    Only the distinct values are looked up. Values missing from the mapping
+    are replaced by default, or kept if default is None.
+    """
+    values = values.astype('category')
+    mapped = [
+        mapping.get(category, category if default is None else default)
+        for category in values.cat.categories
+    ]
+    categories = list(dict.fromkeys(mapped))
+    
+    # Trailing -1 maps missing codes (-1) to missing
+    lookup = np.array([categories.index(m) for m in mapped] + [-1], dtype=np.int32)
+    return pd.Categorical.from_codes(lookup[values.cat.codes.to_numpy()], categories=categories)
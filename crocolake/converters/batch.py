@@ -0,0 +1,409 @@
+"""
+Batch conversion of many source files into one CrocoLake dataset
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Union
+
+from .base import BaseConverter
+from .csv_converter import CSVConverter
+from .netcdf_converter import NetCDFConverter
+from .manifest import ConversionManifest, MANIFEST_NAME, config_hash
+from ..compaction import Compactor, hidden_files
+from ..stats import stats_path
+from ..overviews import overview_path
+from ..validation import quarantine_path
+from ..catalog import update_catalog
+
+# Converter classes selectable by name
+CONVERTERS = {
+    'csv': CSVConverter,
+    'netcdf': NetCDFConverter
+}
+
+# Converter used for each source file extension when none is given
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.nc': 'netcdf',
+    '.nc4': 'netcdf',
+    '.netcdf': 'netcdf'
+}
+
+# Extensions of compressed sources, whose converter is inferred from the
+# extension before it (e.g. data.csv.gz)
+COMPRESSION_EXTENSIONS = ('.gz', '.bz2', '.zst')
+
+class BatchConverter:
+    """
+    Convert many source files in parallel into a single dataset.
+    
+    Each source is converted by its own converter instance, created with
+    the converter's from_config classmethod, in a pool of worker processes.
+    The outputs are written to one dataset directory: one parquet file per
+    source, or one set of files per source inside a hive-partitioned
+    directory when writer_options={'partitioned': True}.
+    """
+    
+    def __init__(self, sources: Union[str, List[str]], target_path: str,
+                 config: Optional[Dict[str, Any]] = None,
+                 converter: Optional[str] = None,
+                 n_workers: Optional[int] = None,
+                 max_retries: int = 2,
+                 retry_delay: float = 1.0,
+                 incremental: bool = False):
+        """
+        Initialize the batch converter.
+        
+        Args:
+            sources: Glob pattern, path of a manifest file listing one source
+                per line (.txt), or list of source paths
+            target_path: Directory of the combined dataset
+            config: Converter configuration shared by all sources, as
+                accepted by from_config (without 'source_path'/'target_path')
+            converter: Converter name ('csv' or 'netcdf'); inferred from
+                each source's extension if not given
+            n_workers: Number of worker processes (default: number of CPUs);
+                1 converts in the current process
+            max_retries: Number of extra attempts for a failing source
+            retry_delay: Seconds to wait before retrying a source
+            incremental: Only convert sources that are new or changed since
+                the last run, according to the dataset's manifest
+        """
+        if converter is not None and converter not in CONVERTERS:
+            raise ValueError(f"Unknown converter: {converter}")
+        
+        self.sources = resolve_sources(sources)
+        self.target_path = Path(target_path)
+        self.config = config or {}
+        self.converter = converter
+        self.n_workers = n_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.incremental = incremental
+    
+    @property
+    def partitioned(self) -> bool:
+        """Whether the combined dataset is hive-partitioned."""
+        return bool(self.config.get('writer_options', {}).get('partitioned'))
+    
+    @property
+    def manifest_path(self) -> Path:
+        """Path of the conversion manifest of the dataset."""
+        return self.target_path / MANIFEST_NAME
+    
+    def convert(self) -> List[Dict[str, Any]]:
+        """
+        Convert the sources into the dataset.
+        
+        Without incremental, any previous version of the dataset is replaced.
+        With incremental, sources whose size/content and converter config
+        match the manifest are skipped, and the outputs of sources that are
+        no longer listed are removed.
+        
+        Returns:
+            One report per source with keys 'source', 'target', 'status'
+            ('ok', 'failed', 'skipped' or 'removed'), 'attempts' and 'error'
+        """
+        if not self.incremental and self.target_path.exists():
+            shutil.rmtree(self.target_path)
+        self.target_path.mkdir(parents=True, exist_ok=True)
+        manifest = ConversionManifest.load(self.manifest_path)
+        
+        removed = []
+        sources = set(self.sources)
+        for source in list(manifest.entries):
+            if source not in sources:
+                self._remove_outputs(source, manifest.outputs(source))
+                manifest.remove(source)
+                removed.append(self._report(source, 'removed'))
+        
+        reports = {}
+        tasks = []
+        for source in self.sources:
+            task = self.task(source)
+            if manifest.is_current(source, task['config_hash']):
+                reports[source] = self._report(source, 'skipped')
+            else:
+                self._remove_outputs(source, manifest.outputs(source))
+                manifest.remove(source)
+                tasks.append(task)
+        
+        for task, report in zip(tasks, self._run(tasks)):
+            source = report['source']
+            reports[source] = report
+            if report['status'] == 'ok':
+                manifest.record(source, task['config_hash'], self._outputs(source))
+        
+        manifest.save()
+        update_catalog(self.target_path)
+        
+        return [reports[source] for source in self.sources] + removed
+    
+    def _run(self, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run convert_source for every task, in the order of the tasks."""
+        arguments = [
+            {key: task[key] for key in ('converter', 'config', 'max_retries', 'retry_delay')}
+            for task in tasks
+        ]
+        
+        if self.n_workers == 1:
+            return [convert_source(**kwargs) for kwargs in arguments]
+        
+        reports = {}
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = {
+                executor.submit(convert_source, **kwargs): kwargs['config']['source_path']
+                for kwargs in arguments
+            }
+            for future in as_completed(futures):
+                reports[futures[future]] = future.result()
+        
+        return [reports[kwargs['config']['source_path']] for kwargs in arguments]
+    
+    def _report(self, source: str, status: str) -> Dict[str, Any]:
+        """Report of a source that was not converted in this run."""
+        return {
+            'source': source,
+            'target': str(self.target_path),
+            'status': status,
+            'attempts': 0,
+            'error': None,
+            'run': None
+        }
+    
+    def _outputs(self, source: str) -> List[str]:
+        """Output files of a source, relative to the dataset directory."""
+        basename = output_basename(source)
+        if self.partitioned:
+            paths = list(self.target_path.rglob(f"{basename}-*.parquet"))
+        else:
+            paths = [self.target_path / f"{basename}.parquet"]
+        paths.append(stats_path(self.target_path / f"{basename}.parquet"))
+        for sidecar in (overview_path, quarantine_path):
+            path = sidecar(self.target_path / f"{basename}.parquet")
+            if path.exists():
+                paths.append(path)
+        return sorted(str(path.relative_to(self.target_path)) for path in paths)
+    
+    def _remove_outputs(self, source: str, outputs: List[str]) -> None:
+        """
+        Delete the output files of a source and any partition directory left
+        empty. Outputs already merged by compaction are replaced by rewriting
+        the compacted files of their partitions without the source's rows.
+        """
+        hidden = hidden_files(self.target_path)
+        compacted = set()
+        replaced = []
+        for output in outputs:
+            path = self.target_path / output
+            relative = Path(output).as_posix()
+            if not path.name.startswith('_') and (relative in hidden or not path.exists()):
+                compacted.add(Path(output).parent.as_posix())
+                if relative in hidden:
+                    replaced.append(relative)
+                continue
+            if path.exists():
+                path.unlink()
+            
+            parent = path.parent
+            while parent != self.target_path and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        
+        if compacted:
+            compactor = Compactor(self.target_path)
+            compactor.remove_source(source, sorted(compacted))
+            # The source is re-converted to the names of its replaced outputs
+            compactor.release(replaced)
+    
+    def task(self, source: str) -> Dict[str, Any]:
+        """Arguments of convert_source for one source file, and its config hash."""
+        converter = self.converter or EXTENSIONS.get(source_extension(source))
+        if converter is None:
+            raise ValueError(f"Cannot infer converter for {source}")
+        
+        config = dict(self.config)
+        config['source_path'] = source
+        basename = output_basename(source)
+        
+        if self.partitioned:
+            config['target_path'] = str(self.target_path)
+            config['writer_options'] = dict(
+                self.config['writer_options'], basename=basename, append=True
+            )
+        else:
+            config['target_path'] = str(self.target_path / f"{basename}.parquet")
+            # The combined dataset is catalogued once, when the batch ends
+            config['writer_options'] = dict(
+                self.config.get('writer_options', {}), catalog=False
+            )
+        
+        return {
+            'converter': converter,
+            'config': config,
+            'config_hash': config_hash(converter, self.config),
+            'max_retries': self.max_retries,
+            'retry_delay': self.retry_delay
+        }
+
+def resolve_sources(sources: Union[str, List[str]]) -> List[str]:
+    """
+    Expand a glob pattern or manifest file into a sorted list of sources.
+    
+    Args:
+        sources: Glob pattern, manifest file (.txt, one path per line) or
+            list of paths
+    
+    Returns:
+        List of source paths
+    """
+    if not isinstance(sources, str):
+        return list(sources)
+    
+    if sources.endswith('.txt') and Path(sources).is_file():
+        lines = Path(sources).read_text().splitlines()
+        return [line.strip() for line in lines if line.strip()]
+    
+    return sorted(glob.glob(sources, recursive=True))
+
+def source_extension(source: str) -> str:
+    """Extension of a source file, ignoring a compression extension."""
+    suffixes = [suffix.lower() for suffix in Path(source).suffixes]
+    if suffixes and suffixes[-1] in COMPRESSION_EXTENSIONS:
+        suffixes.pop()
+    return suffixes[-1] if suffixes else ''
+
+def output_basename(source: str) -> str:
+    """Stable, unique name of the output files of a source."""
+    digest = hashlib.sha1(str(Path(source).resolve()).encode()).hexdigest()[:12]
+    return f"{Path(source).stem}-{digest}"
+
+def convert_source(converter: str, config: Dict[str, Any],
+                   max_retries: int = 0, retry_delay: float = 0.0) -> Dict[str, Any]:
+    """
+    Convert one source, retrying on failure.
+    
+    Runs in a worker process. Errors are not raised but reported, so that
+    one bad file does not stop the batch.
+    
+    Returns:
+        Report with keys 'source', 'target', 'status', 'attempts', 'error'
+        and 'run', the converter's run report of the successful attempt
+    """
+    report = {
+        'source': config['source_path'],
+        'target': config['target_path'],
+        'status': 'failed',
+        'attempts': 0,
+        'error': None,
+        'run': None
+    }
+    
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(retry_delay)
+        report['attempts'] = attempt + 1
+        
+        converter_instance = None
+        try:
+            converter_instance = CONVERTERS[converter].from_config(dict(config))
+            report['run'] = converter_instance.convert()
+        except Exception:
+            report['error'] = traceback.format_exc()
+            if converter_instance is not None:
+                remove_outputs(converter_instance)
+            continue
+        
+        report['status'] = 'ok'
+        report['error'] = None
+        break
+    
+    return report
+
+def remove_outputs(converter: BaseConverter) -> None:
+    """Remove the (partial) output of a converter."""
+    target_path = Path(converter.target_path)
+    basename = converter.writer_options.get('basename')
+    
+    if converter.writer_options.get('append') and basename:
+        for path in target_path.rglob(f"{basename}-*.parquet"):
+            path.unlink()
+    elif target_path.is_dir():
+        shutil.rmtree(target_path)
+    elif target_path.exists():
+        target_path.unlink()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point of the batch converter."""
+    parser = argparse.ArgumentParser(
+        description="Convert many source files into one CrocoLake dataset"
+    )
+    parser.add_argument('sources', help="Glob pattern or manifest file (.txt) of source files")
+    parser.add_argument('target', help="Directory of the combined dataset")
+    parser.add_argument('--converter', choices=sorted(CONVERTERS),
+                        help="Converter to use (default: inferred from file extension)")
+    parser.add_argument('--config', help="JSON file with the converter configuration")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument('--retries', type=int, default=2,
+                        help="Number of retries for a failing source")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="Write a hive-style directory partitioned by variable")
+    parser.add_argument('--time-partition', choices=['year', 'month'],
+                        help="Also partition by year or month of the timestamp")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only convert new or modified sources")
+    parser.add_argument('--overviews', action='store_true',
+                        help="Write overview pyramids for fast aggregates")
+    args = parser.parse_args(argv)
+    
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    if args.partitioned or args.time_partition:
+        config['writer_options'] = dict(
+            config.get('writer_options', {}),
+            partitioned=True,
+            time_partition=args.time_partition
+        )
+    if args.overviews:
+        config['writer_options'] = dict(config.get('writer_options', {}), overviews=True)
+    
+    batch = BatchConverter(
+        args.sources,
+        args.target,
+        config=config,
+        converter=args.converter,
+        n_workers=args.workers,
+        max_retries=args.retries,
+        incremental=args.incremental
+    )
+    reports = batch.convert()
+    
+    failed = [report for report in reports if report['status'] == 'failed']
+    for report in failed:
+        print(f"Failed to convert {report['source']} after {report['attempts']} attempts:",
+              file=sys.stderr)
+        print(report['error'], file=sys.stderr)
+    
+    counts = {
+        status: sum(report['status'] == status for report in reports)
+        for status in ('ok', 'skipped', 'removed', 'failed')
+    }
+    print(f"{batch.target_path}: {counts['ok']} converted, {counts['skipped']} unchanged, "
+          f"{counts['removed']} removed, {counts['failed']} failed")
+    
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,35 @@
+import csv
+from contextlib import contextmanager
 import pandas as pd
-from typing import Dict, Any
-from .base import BaseConverter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from typing import Dict, Any, Optional, Iterator, List
+from .base import BaseConverter, constant_categorical, map_categorical
+from .reshape import wide_to_long
+
+# Number of CSV rows read and transformed at a time
+DEFAULT_CHUNKSIZE = 100_000
+
+# CSV parsers selectable with the engine option
+ENGINES = ('pandas', 'pyarrow')
+
+# Bytes of CSV text parsed per block (and thread) by the pyarrow engine
+BLOCK_SIZE = 4 << 20
+
+# pd.read_csv options understood by the pyarrow engine
+PYARROW_CSV_OPTIONS = ('sep', 'delimiter', 'usecols', 'na_values')
 
 class CSVConverter(BaseConverter):
     """Converter for CSV format data files."""
     
     def __init__(self, source_path: str, target_path: str = None, 
-                 mapping: Dict[str, str] = None, **csv_kwargs: Any):
+                 mapping: Dict[str, str] = None,
+                 writer_options: Optional[Dict[str, Any]] = None,
+                 validation: Optional[Dict[str, Any]] = None,
+                 chunksize: Optional[int] = DEFAULT_CHUNKSIZE,
+                 qc_columns: Optional[Dict[str, str]] = None,
+                 engine: str = 'pandas', **csv_kwargs: Any):
         """
         Initialize the CSV converter.
         
@@ -14,53 +37,93 @@ class CSVConverter(BaseConverter):
             source_path: Path to the source CSV file
             target_path: Optional path where to save the converted data
             mapping: Dictionary mapping source columns to CrocoLake schema columns
+            writer_options: Optional keyword arguments for the dataset writer
+            validation: Optional validation settings, e.g.
+                {'timestamp_format': '%Y-%m-%d %H:%M:%S', 'on_invalid': 'quarantine'},
+                see BaseConverter
+            chunksize: Number of CSV rows converted at a time, which bounds
+                peak memory; None reads the whole file at once
+            qc_columns: Optional mapping of variable to its QC flag column
+                (names after mapping), written to a 'qc' column
+            engine: CSV parser, 'pandas' or 'pyarrow'. The pyarrow engine
+                parses blocks on several threads with column types derived
+                from the mapping and schema, and streams compressed
+                (.gz, .bz2, .zst) files; it only accepts the csv_kwargs
+                in PYARROW_CSV_OPTIONS
             csv_kwargs: Additional keyword arguments passed to pd.read_csv
         """
-        super().__init__(source_path, target_path)
+        super().__init__(source_path, target_path, writer_options, validation)
         self.mapping = mapping or {}
+        self.chunksize = chunksize
+        self.qc_columns = qc_columns or {}
         self.csv_kwargs = csv_kwargs
+        
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported CSV engine: {engine}")
+        unsupported = set(csv_kwargs) - set(PYARROW_CSV_OPTIONS)
+        if engine == 'pyarrow' and unsupported:
+            raise ValueError(f"Options not supported by the pyarrow engine: {sorted(unsupported)}")
+        self.engine = engine
+        self._types: Dict[str, pa.DataType] = {}
     
     def read_data(self) -> pd.DataFrame:
         """Read the CSV file into a pandas DataFrame."""
+        if self.engine == 'pyarrow':
+            with self._open_source() as source, _parse_errors():
+                table = pa_csv.read_csv(source, **self._arrow_options())
+            return self._to_pandas(table)
         return pd.read_csv(self.source_path, **self.csv_kwargs)
     
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """Read the CSV file in chunks of at most chunksize rows."""
+        if self.chunksize is None:
+            yield from super().iter_chunks()
+            return
+        
+        if self.engine == 'pyarrow':
+            yield from self._iter_arrow_chunks()
+            return
+        
+        with pd.read_csv(self.source_path, chunksize=self.chunksize,
+                         **self.csv_kwargs) as reader:
+            yield from reader
+    
     def transform_data(self, data: pd.DataFrame) -> pd.DataFrame:
         """
         Transform the CSV data into CrocoLake's schema.
         
         This method handles the column mapping and any necessary
-        data transformations to match CrocoLake's schema.
+        data transformations to match CrocoLake's schema. The variable,
+        unit and source columns are returned as categoricals.
         """
         # Rename columns according to mapping
         if self.mapping:
             data = data.rename(columns=self.mapping)
         
-        # Ensure timestamp is in datetime format
-        if 'timestamp' in data.columns:
-            data['timestamp'] = pd.to_datetime(data['timestamp'])
-        
-        # Convert numeric columns
-        numeric_columns = ['latitude', 'longitude', 'depth', 'value']
-        for col in numeric_columns:
-            if col in data.columns:
-                data[col] = pd.to_numeric(data[col], errors='coerce')
-        
         # Get measurement columns (those not in the standard schema)
         id_vars = ['timestamp', 'latitude', 'longitude', 'depth']
         id_vars = [col for col in id_vars if col in data.columns]
-        value_vars = [col for col in data.columns 
-                     if col not in id_vars and col not in ['variable', 'value', 'unit', 'source']]
-        
-        # Melt the dataframe to get variables in long format
-        df_long = data.melt(
-            id_vars=id_vars,
-            value_vars=value_vars,
-            var_name='variable',
-            value_name='value'
-        )
+        excluded = set(id_vars) | {'variable', 'value', 'unit', 'source'}
+        excluded |= set(self.qc_columns.values())
+        value_vars = [col for col in data.columns if col not in excluded]
+        
+        # Parse timestamps with the schema's format and the coordinates and
+        # measurements as numbers
+        with self.stage('transform.coerce'):
+            data = self.coerce_data(data, numeric=value_vars)
+        
+        # Reshape to long format, dropping missing values
+        with self.stage('transform.reshape') as counts:
+            df_long = wide_to_long(
+                data,
+                id_vars=id_vars,
+                value_vars=value_vars,
+                qc_columns=self.qc_columns or None
+            )
+            counts['rows'] = len(df_long)
         
         # Add source column
-        df_long['source'] = self.source_path
+        df_long['source'] = constant_categorical(self.source_path, len(df_long))
         
         # Add unit column based on variable name
         # In a real application, this should be more sophisticated
@@ -68,10 +131,128 @@ class CSVConverter(BaseConverter):
             'temp': '°C',
             'sal': 'PSU'
         }
-        df_long['unit'] = df_long['variable'].map(unit_mapping).fillna('unknown')
+        df_long['unit'] = map_categorical(df_long['variable'], unit_mapping, default='unknown')
         
         return df_long
-
+    
+    def column_types(self, columns: List[str]) -> Dict[str, pa.DataType]:
+        """
+        Arrow types of the source columns, used by the pyarrow engine.
+        
+        Timestamps, coordinates and measurements get their schema types, so
+        the parser neither infers them nor leaves them as strings for pandas
+        to parse. QC flag columns are inferred.
+        
+        Args:
+            columns: Source column names, before mapping
+        """
+        qc_columns = set(self.qc_columns.values())
+        
+        types = {}
+        for column in columns:
+            name = self.mapping.get(column, column)
+            if name in qc_columns:
+                continue
+            if name in ('variable', 'unit', 'source'):
+                types[column] = pa.string()
+            elif name == 'timestamp':
+                types[column] = pa.timestamp('ns')
+            else:
+                types[column] = pa.float64()
+        return types
+    
+    def _open_source(self) -> pa.NativeFile:
+        """Open the source, decompressing it on the fly based on its extension."""
+        return pa.input_stream(self.source_path, compression='detect')
+    
+    def _header(self) -> List[str]:
+        """Column names of the source, from its first line."""
+        with self._open_source() as source:
+            text = b''
+            while b'\n' not in text:
+                block = source.read(64 << 10)
+                if not block:
+                    break
+                text += block
+        line = text.split(b'\n', 1)[0].decode('utf-8-sig').rstrip('\r')
+        return next(csv.reader([line], delimiter=self._delimiter()), [])
+    
+    def _delimiter(self) -> str:
+        return self.csv_kwargs.get('sep', self.csv_kwargs.get('delimiter', ','))
+    
+    def _arrow_options(self) -> Dict[str, Any]:
+        """
+        Read, parse and convert options of pyarrow.csv.
+        
+        Arrow fails on the first value it cannot parse, so when invalid
+        rows are dropped or quarantined the typed columns are read as
+        strings and cast per chunk by _to_pandas instead. Timestamps are
+        always cast there, as Arrow cannot read naive timestamps and ones
+        with a zone offset as one type.
+        """
+        self._types = self.column_types(self._header())
+        column_types = {
+            column: pa.string() if self.on_invalid != 'raise' or pa.types.is_timestamp(dtype) else dtype
+            for column, dtype in self._types.items()
+        }
+        
+        # Empty strings are missing values, as with pandas
+        convert_options = {'column_types': column_types, 'strings_can_be_null': True}
+        if self.csv_kwargs.get('usecols') is not None:
+            convert_options['include_columns'] = list(self.csv_kwargs['usecols'])
+        if self.csv_kwargs.get('na_values') is not None:
+            # Extends the default missing value markers, as in pandas
+            convert_options['null_values'] = (
+                pa_csv.ConvertOptions().null_values + list(self.csv_kwargs['na_values'])
+            )
+        
+        return {
+            'read_options': pa_csv.ReadOptions(use_threads=True, block_size=BLOCK_SIZE),
+            'parse_options': pa_csv.ParseOptions(delimiter=self._delimiter()),
+            'convert_options': pa_csv.ConvertOptions(**convert_options)
+        }
+    
+    def _iter_arrow_chunks(self) -> Iterator[pd.DataFrame]:
+        """Stream the source with pyarrow.csv, chunksize rows at a time."""
+        batches = []
+        n_rows = 0
+        with self._open_source() as source, _parse_errors():
+            reader = pa_csv.open_csv(source, **self._arrow_options())
+            for batch in reader:
+                batches.append(batch)
+                n_rows += batch.num_rows
+                while n_rows >= self.chunksize:
+                    table = pa.Table.from_batches(batches, schema=reader.schema)
+                    yield self._to_pandas(table.slice(0, self.chunksize))
+                    batches = table.slice(self.chunksize).to_batches()
+                    n_rows -= self.chunksize
+            
+            if n_rows:
+                yield self._to_pandas(pa.Table.from_batches(batches, schema=reader.schema))
+    
+    def _to_pandas(self, table: pa.Table) -> pd.DataFrame:
+        """
+        Convert a chunk read by the pyarrow engine, first casting the columns
+        read as strings to their types. Columns with values Arrow cannot
+        parse are left to coerce_data, which parses and counts them;
+        timestamps with a zone offset are read as UTC, and made naive by
+        coerce_data like with the pandas engine.
+        """
+        for i, name in enumerate(table.column_names):
+            target = self._types.get(name)
+            if target is None or table.schema.field(i).type == target:
+                continue
+            try:
+                if pa.types.is_timestamp(target):
+                    column = _parse_timestamps(table.column(i), self.schema.timestamp_format)
+                else:
+                    column = table.column(i).cast(target)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+            table = table.set_column(i, name, column)
+        
+        return table.to_pandas()
+    
     @classmethod
     def from_config(cls, config: Dict[str, Any]) -> 'CSVConverter':
         """
@@ -80,7 +261,8 @@ class CSVConverter(BaseConverter):
         Args:
             config: Dictionary containing configuration parameters
                    Must include 'source_path' and optionally 'target_path',
-                   'mapping', and any CSV reading parameters
+                   'mapping', 'writer_options', 'validation', 'chunksize',
+                   'qc_columns', 'engine' and any CSV reading parameters
         
         Returns:
             Configured CSVConverter instance
@@ -88,10 +270,34 @@ class CSVConverter(BaseConverter):
         source_path = config.pop('source_path')
         target_path = config.pop('target_path', None)
         mapping = config.pop('mapping', None)
+        writer_options = config.pop('writer_options', None)
+        validation = config.pop('validation', None)
         
         return cls(
             source_path=source_path,
             target_path=target_path,
             mapping=mapping,
+            writer_options=writer_options,
+            validation=validation,
             **config
-        ) 
\ No newline at end of file
+        )
+
+def _parse_timestamps(column: pa.ChunkedArray, timestamp_format: Optional[str]) -> pa.ChunkedArray:
+    """
+    Parse timestamp strings, naive ones as naive and ones with a zone
+    offset as UTC. Raises ArrowInvalid on mixed or unparseable values.
+    """
+    if timestamp_format not in (None, 'ISO8601'):
+        return pc.strptime(column, timestamp_format, unit='ns')
+    try:
+        return column.cast(pa.timestamp('ns'))
+    except pa.ArrowInvalid:
+        return column.cast(pa.timestamp('ns', tz='UTC'))
+
+@contextmanager
+def _parse_errors() -> Iterator[None]:
+    """Report values the pyarrow engine cannot parse like coerce_data does."""
+    try:
+        yield
+    except pa.ArrowInvalid as error:
+        raise ValueError(f"Values could not be parsed: {error}") from error
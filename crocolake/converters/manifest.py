@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+# File name of the manifest inside a dataset directory; the leading
+# underscore keeps it out of pyarrow's dataset discovery
+MANIFEST_NAME = '_manifest.json'
+
+# Bytes read at a time when hashing a source file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+class ConversionManifest:
+    """
+    Persistent record of the sources converted into a dataset.
+    
+    For every source the manifest stores its size, mtime and content hash,
+    a hash of the converter configuration and the output files it produced,
+    so that a later run only needs to convert new or modified sources.
+    """
+    
+    def __init__(self, path: str):
+        """
+        Initialize the manifest.
+        
+        Args:
+            path: Path of the JSON manifest file
+        """
+        self.path = Path(path)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+    
+    @classmethod
+    def load(cls, path: str) -> 'ConversionManifest':
+        """Load a manifest, or return an empty one if the file does not exist."""
+        manifest = cls(path)
+        if manifest.path.exists():
+            with open(manifest.path) as f:
+                manifest.entries = json.load(f)['sources']
+        return manifest
+    
+    def save(self) -> None:
+        """Atomically write the manifest to disk."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': 1, 'sources': self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+    
+    def is_current(self, source: str, config_hash: str) -> bool:
+        """
+        Check whether a source was converted with this config and is unchanged.
+        
+        Size and mtime are compared first; the content is only hashed when
+        they differ, so untouched files are never read.
+        """
+        entry = self.entries.get(source)
+        if entry is None or entry['config_hash'] != config_hash:
+            return False
+        if not os.path.exists(source):
+            return False
+        
+        stat = os.stat(source)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        
+        if file_hash(source) != entry['hash']:
+            return False
+        
+        # Touched but identical: remember the new mtime to skip hashing next time
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+    
+    def record(self, source: str, config_hash: str, outputs: List[str]) -> None:
+        """Record a successful conversion of a source."""
+        stat = os.stat(source)
+        self.entries[source] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': file_hash(source),
+            'config_hash': config_hash,
+            'outputs': outputs,
+            'converted_at': datetime.now(timezone.utc).isoformat()
+        }
+    
+    def remove(self, source: str) -> Optional[Dict[str, Any]]:
+        """Forget a source, returning its entry if there was one."""
+        return self.entries.pop(source, None)
+    
+    def outputs(self, source: str) -> List[str]:
+        """Output files recorded for a source."""
+        entry = self.entries.get(source)
+        return entry['outputs'] if entry else []
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def config_hash(converter: str, config: Dict[str, Any]) -> str:
+    """Hash of a converter name and its configuration."""
+    payload = json.dumps([converter, config], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -0,0 +1,220 @@
+"""
+Deduplicating merge of CrocoLake datasets.
+
+The same observation often reaches the lake through several archives (e.g.
+real-time and delayed-mode). DatasetMerger combines datasets into one in
+which each (timestamp, latitude, longitude, depth, variable) key appears
+once, keeping the row of the dataset with the highest priority.
+
+The merge is memory-bounded: the datasets are streamed and hash-partitioned
+on the key into spill files, so that all copies of a key land in the same
+bucket, and the buckets are then deduplicated and written one at a time.
+"""
+
+import math
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from .writer import DatasetWriter
+from ..loader import DataLoader
+from ..loader.data_loader import DATASET_COLUMN
+from ..profiling import StageProfiler, Hook
+
+# Columns identifying an observation
+DEDUP_KEYS = ['timestamp', 'latitude', 'longitude', 'depth', 'variable']
+
+# Decimals coordinates are rounded to before comparing keys, so that copies
+# written with different float precision still match
+DEFAULT_DECIMALS = {'latitude': 6, 'longitude': 6, 'depth': 3}
+
+# Decoded size of a bucket held in memory while deduplicating
+DEFAULT_BUCKET_BYTES = 256 * 1024 * 1024
+
+# Assumed ratio of decoded to on-disk size when choosing the number of buckets
+DECODED_RATIO = 4
+
+# Column of the spill files holding each row's priority rank
+PRIORITY_COLUMN = '_priority'
+
+class DatasetMerger:
+    """
+    Merge several datasets of a data directory into one deduplicated dataset.
+    """
+    
+    def __init__(self, data_dir: str, target_path: str,
+                 datasets: Optional[List[str]] = None,
+                 priority: Optional[List[str]] = None,
+                 decimals: Optional[Dict[str, int]] = None,
+                 n_buckets: Optional[int] = None,
+                 bucket_bytes: int = DEFAULT_BUCKET_BYTES,
+                 writer_options: Optional[Dict[str, Any]] = None,
+                 work_dir: Optional[str] = None):
+        """
+        Initialize the merger.
+        
+        Args:
+            data_dir: Directory containing the datasets
+            target_path: Path of the merged dataset; it may be inside
+                data_dir but must not be one of the merged datasets
+            datasets: Names of the datasets to merge (default: all in
+                data_dir, except the target)
+            priority: Dataset names, highest priority first, deciding which
+                copy of a duplicated observation is kept; unlisted datasets
+                follow in the order of datasets. Within a dataset the first
+                copy is kept
+            decimals: Decimals latitude, longitude and depth are rounded
+                to when comparing keys (default: DEFAULT_DECIMALS); rounding
+                only affects the comparison, not the written values
+            n_buckets: Number of hash buckets; by default enough for each
+                bucket to fit in bucket_bytes
+            bucket_bytes: Memory budget of a bucket in bytes
+            writer_options: Optional keyword arguments for DatasetWriter
+            work_dir: Directory of the temporary spill files (default: the
+                system temporary directory)
+        """
+        self.loader = DataLoader(data_dir, cache_bytes=0)
+        self.target_path = Path(target_path)
+        
+        if datasets is None:
+            datasets = [
+                name for name in sorted(self.loader.list_datasets())
+                if (self.loader.data_dir / f"{name}.parquet").resolve() != self.target_path.resolve()
+            ]
+        self.datasets = list(datasets)
+        for name in self.datasets:
+            if self.loader._dataset_path(name).resolve() == self.target_path.resolve():
+                raise ValueError(f"Target {target_path} is one of the merged datasets")
+        
+        priority = list(priority or [])
+        unknown = set(priority) - set(self.datasets)
+        if unknown:
+            raise ValueError(f"Priority lists datasets that are not merged: {sorted(unknown)}")
+        self.priority = priority + [name for name in self.datasets if name not in priority]
+        
+        self.decimals = dict(DEFAULT_DECIMALS if decimals is None else decimals)
+        self.n_buckets = n_buckets
+        self.bucket_bytes = bucket_bytes
+        self.writer_options = writer_options or {}
+        self.work_dir = work_dir
+        self.hooks: List[Hook] = []
+        self.last_report: Optional[Dict[str, Any]] = None
+    
+    def add_hook(self, hook: Hook) -> None:
+        """Register a callback receiving the stage events and the report of every merge."""
+        self.hooks.append(hook)
+    
+    def merge(self) -> Dict[str, Any]:
+        """
+        Write the deduplicated dataset.
+        
+        Returns:
+            Report of the merge: the profiler report (see
+            crocolake.profiling) with counters 'rows_read', 'rows_written'
+            and 'duplicates', plus 'buckets' and the number of rows dropped
+            from each dataset in 'duplicates'
+        """
+        profiler = StageProfiler(self.hooks).start()
+        n_buckets = self.n_buckets or self._default_buckets()
+        ranks = {name: rank for rank, name in enumerate(self.priority)}
+        dropped = {name: 0 for name in self.datasets}
+        
+        try:
+            with tempfile.TemporaryDirectory(dir=self.work_dir) as spill_dir:
+                spill_paths = self._partition(Path(spill_dir), n_buckets, ranks, profiler)
+                
+                with DatasetWriter(self.target_path, **self.writer_options) as writer:
+                    writer.profiler = profiler
+                    for path in spill_paths:
+                        if not path.exists():
+                            continue
+                        with profiler.stage('deduplicate') as counts:
+                            data = pq.read_table(path).to_pandas()
+                            kept = self._deduplicate(data)
+                            counts['rows'] = len(data)
+                        
+                        removed = data.loc[~data.index.isin(kept.index), DATASET_COLUMN]
+                        for name, count in removed.value_counts().items():
+                            dropped[name] += int(count)
+                        profiler.count('duplicates', len(data) - len(kept))
+                        
+                        kept = kept.drop(columns=[DATASET_COLUMN, PRIORITY_COLUMN])
+                        with profiler.stage('write') as counts:
+                            if len(kept):
+                                writer.write(kept.reset_index(drop=True))
+                            counts['rows'] = len(kept)
+                        profiler.count('rows_written', len(kept))
+        except BaseException:
+            profiler.cancel()
+            raise
+        
+        report = profiler.stop()
+        report.update(buckets=n_buckets, duplicates=dropped, target=str(self.target_path))
+        self.last_report = report
+        return report
+    
+    def _partition(self, spill_dir: Path, n_buckets: int, ranks: Dict[str, int],
+                   profiler: StageProfiler) -> List[Path]:
+        """Stream the datasets into one spill file per bucket of the key hash."""
+        paths = [spill_dir / f"bucket-{i}.parquet" for i in range(n_buckets)]
+        writers: Dict[int, pq.ParquetWriter] = {}
+        
+        try:
+            for batch in self.loader.query(self.datasets, stream=True):
+                with profiler.stage('partition') as counts:
+                    tags = batch.column(DATASET_COLUMN)
+                    rank = np.array(
+                        [ranks[name] for name in tags.dictionary.to_pylist()], dtype=np.int32
+                    )[tags.indices.to_numpy()]
+                    table = pa.Table.from_batches([batch])
+                    table = table.append_column(PRIORITY_COLUMN, pa.array(rank))
+                    
+                    buckets = (self._hash(table.select(DEDUP_KEYS).to_pandas()) % np.uint64(n_buckets)).astype(np.int64)
+                    order = np.argsort(buckets, kind='stable')
+                    bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1))
+                    table = table.take(order)
+                    
+                    for bucket in np.flatnonzero(np.diff(bounds)):
+                        part = table.slice(bounds[bucket], bounds[bucket + 1] - bounds[bucket])
+                        if bucket not in writers:
+                            writers[bucket] = pq.ParquetWriter(str(paths[bucket]), table.schema)
+                        writers[bucket].write_table(part)
+                    counts['rows'] = table.num_rows
+                profiler.count('rows_read', table.num_rows)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        
+        return paths
+    
+    def _deduplicate(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Keep the highest-priority row of each key of a bucket."""
+        keys = self._keys(data)
+        data = data.iloc[np.argsort(data[PRIORITY_COLUMN].to_numpy(), kind='stable')]
+        return data[~keys.loc[data.index].duplicated(keep='first')]
+    
+    def _hash(self, keys: pd.DataFrame) -> np.ndarray:
+        """64-bit hash of the rounded key of each row."""
+        return pd.util.hash_pandas_object(self._keys(keys), index=False).to_numpy()
+    
+    def _keys(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Key columns, with rounded coordinates."""
+        keys = data[DEDUP_KEYS].copy()
+        keys['variable'] = keys['variable'].astype(str)
+        for column, decimals in self.decimals.items():
+            # Adding 0.0 turns -0.0 into 0.0, which hashes differently
+            keys[column] = keys[column].round(decimals) + 0.0
+        return keys
+    
+    def _default_buckets(self) -> int:
+        """Number of buckets for each to fit in bucket_bytes once decoded."""
+        disk_bytes = 0
+        for name in self.datasets:
+            path = self.loader._dataset_path(name)
+            files = path.rglob('*.parquet') if path.is_dir() else [path]
+            disk_bytes += sum(item.stat().st_size for item in files if not item.name.startswith('_'))
+        return max(1, math.ceil(disk_bytes * DECODED_RATIO / self.bucket_bytes))
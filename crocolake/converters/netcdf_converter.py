@@ -1,7 +1,17 @@
+import itertools
+import math
 import pandas as pd
 import xarray as xr
-from typing import Dict, Any, List, Optional
-from .base import BaseConverter
+from typing import Dict, Any, List, Optional, Iterator, Union
+from .base import BaseConverter, constant_categorical, map_categorical
+from .reshape import stack_columns, wide_to_long
+
+# Blocks converted at a time: 'auto' sizes them to about DEFAULT_BLOCK_ROWS
+# rows, along the time dimension first
+DEFAULT_BLOCKS = 'auto'
+
+# Approximate number of long-format rows of an automatically sized block
+DEFAULT_BLOCK_ROWS = 1_000_000
 
 class NetCDFConverter(BaseConverter):
     """Converter for NetCDF format data files."""
@@ -9,7 +19,12 @@ class NetCDFConverter(BaseConverter):
     def __init__(self, source_path: str, target_path: str = None,
                  variable_mapping: Dict[str, str] = None,
                  dimension_mapping: Dict[str, str] = None,
-                 chunks: Optional[Dict[str, int]] = None):
+                 chunks: Optional[Dict[str, int]] = None,
+                 writer_options: Optional[Dict[str, Any]] = None,
+                 blocks: Union[str, Dict[str, int], None] = DEFAULT_BLOCKS,
+                 qc_variables: Optional[Dict[str, str]] = None,
+                 validation: Optional[Dict[str, Any]] = None,
+                 block_rows: int = DEFAULT_BLOCK_ROWS):
         """
         Initialize the NetCDF converter.
         
@@ -19,8 +34,20 @@ class NetCDFConverter(BaseConverter):
             variable_mapping: Dictionary mapping source variables to CrocoLake variables
             dimension_mapping: Dictionary mapping source dimensions to CrocoLake dimensions
             chunks: Dictionary specifying chunk sizes for dask arrays
+            writer_options: Optional keyword arguments for the dataset writer
+            blocks: Dictionary of block sizes along the renamed dimensions,
+                e.g. {'timestamp': 1, 'depth': 10}; convert() loads and
+                writes one block at a time. 'auto' takes as many time
+                steps (then steps of the other dimensions) as fit in
+                block_rows rows. None converts the whole dataset as a
+                single block
+            qc_variables: Optional mapping of source variable to its QC flag
+                variable, written to a 'qc' column
+            validation: Optional validation settings, see BaseConverter
+            block_rows: Approximate number of long-format rows of a block
+                when blocks is 'auto'
         """
-        super().__init__(source_path, target_path)
+        super().__init__(source_path, target_path, writer_options, validation)
         self.variable_mapping = variable_mapping or {}
         self.dimension_mapping = dimension_mapping or {
             'time': 'timestamp',
@@ -29,6 +56,11 @@ class NetCDFConverter(BaseConverter):
             'depth': 'depth'
         }
         self.chunks = chunks
+        if blocks == 'auto' and block_rows <= 0:
+            raise ValueError("block_rows must be positive")
+        self.blocks = blocks
+        self.block_rows = block_rows
+        self.qc_variables = qc_variables or {}
     
     def read_data(self) -> pd.DataFrame:
         """Read the NetCDF file into a pandas DataFrame."""
@@ -46,36 +78,116 @@ class NetCDFConverter(BaseConverter):
         
         return df
     
-    def transform_data(self, data: pd.DataFrame) -> pd.DataFrame:
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
         """
-        Transform the NetCDF data into CrocoLake's schema.
+        Yield the NetCDF data block by block, already in long format.
         
-        This method handles the variable mapping and any necessary
-        data transformations to match CrocoLake's schema.
+        Only one block of the dataset is loaded at a time, and cells whose
+        value is NaN (fill values, land points) are dropped.
+        """
+        with xr.open_dataset(self.source_path, chunks=self.chunks) as ds:
+            ds = ds.rename(self.dimension_mapping)
+            
+            blocks = self.auto_blocks(ds) if self.blocks == 'auto' else self.blocks
+            blocks = {
+                dim: size for dim, size in (blocks or {}).items()
+                if dim in ds.dims
+            }
+            starts = [range(0, ds.sizes[dim], size) for dim, size in blocks.items()]
+            
+            for block_start in itertools.product(*starts):
+                indexers = {
+                    dim: slice(start, start + blocks[dim])
+                    for dim, start in zip(blocks, block_start)
+                }
+                data = self._block_to_long(ds.isel(indexers))
+                if len(data):
+                    yield data
+    
+    def auto_blocks(self, ds: xr.Dataset) -> Dict[str, int]:
+        """
+        Block sizes giving about block_rows long-format rows per block.
+        
+        Blocks take whole steps of the time dimension (or of the first
+        dimension), and are only split along the next dimensions if a
+        single step has more than block_rows rows.
+        """
+        dims = sorted(ds.dims, key=lambda dim: dim != 'timestamp')
+        qc_names = set(self.qc_variables.values())
+        n_values = max(1, sum(name not in qc_names for name in ds.data_vars))
+        
+        blocks = {}
+        for i, dim in enumerate(dims):
+            inner = n_values * math.prod(ds.sizes[other] for other in dims[i + 1:])
+            if inner <= self.block_rows:
+                blocks[dim] = max(1, self.block_rows // inner)
+                break
+            blocks[dim] = 1
+        return blocks
+    
+    def _block_to_long(self, block: xr.Dataset) -> pd.DataFrame:
+        """
+        Convert a block of the dataset to long format.
+        
+        Every data variable and coordinate is broadcast over the block's
+        dimensions and raveled, then stacked with stack_columns, which
+        gives the same rows as to_dataframe() followed by melt() without
+        the intermediate frame.
         """
-        # Melt the dataframe to get variables in long format
+        with self.stage('read.load') as counts:
+            block = block.load()
+            counts['bytes'] = int(block.nbytes)
+        dims = list(block.dims)
         id_vars = ['timestamp', 'latitude', 'longitude', 'depth']
-        id_vars = [col for col in id_vars if col in data.columns]
+        id_vars = [col for col in id_vars if col in block.coords]
         
-        value_vars = [col for col in data.columns if col not in id_vars]
+        def ravel(name):
+            return block[name].broadcast_like(block).transpose(*dims).values.ravel()
         
-        df_long = data.melt(
-            id_vars=id_vars,
-            value_vars=value_vars,
-            var_name='variable',
-            value_name='value'
-        )
+        with self.stage('read.reshape') as counts:
+            qc_names = set(self.qc_variables.values())
+            values = {name: ravel(name) for name in block.data_vars if name not in qc_names}
+            qc = {
+                name: ravel(qc_name) for name, qc_name in self.qc_variables.items()
+                if name in values and qc_name in block.data_vars
+            } if self.qc_variables else None
+            
+            data = stack_columns({col: ravel(col) for col in id_vars}, values, qc=qc)
+            counts['rows'] = len(data)
+        
+        return data
+    
+    def transform_data(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Transform the NetCDF data into CrocoLake's schema.
+        
+        This method handles the variable mapping and any necessary
+        data transformations to match CrocoLake's schema. Data that is
+        already in long format, as yielded by iter_chunks, is not melted.
+        The variable, unit and source columns are returned as categoricals.
+        """
+        if {'variable', 'value'}.issubset(data.columns):
+            df_long = data
+        else:
+            # Reshape to long format, dropping missing values
+            id_vars = ['timestamp', 'latitude', 'longitude', 'depth']
+            id_vars = [col for col in id_vars if col in data.columns]
+            
+            with self.stage('transform.reshape'):
+                df_long = wide_to_long(
+                    data,
+                    id_vars=id_vars,
+                    qc_columns=self.qc_variables or None
+                )
         
         # Map variable names if mapping is provided
-        if self.variable_mapping:
-            df_long['variable'] = df_long['variable'].map(
-                self.variable_mapping).fillna(df_long['variable'])
+        df_long['variable'] = map_categorical(df_long['variable'], self.variable_mapping)
         
         # Add source column
-        df_long['source'] = self.source_path
+        df_long['source'] = constant_categorical(self.source_path, len(df_long))
         
         # Add unit column (should be extracted from NetCDF attributes in production)
-        df_long['unit'] = 'unknown'
+        df_long['unit'] = constant_categorical('unknown', len(df_long))
         
         return df_long
     
@@ -87,7 +199,9 @@ class NetCDFConverter(BaseConverter):
         Args:
             config: Dictionary containing configuration parameters
                    Must include 'source_path' and optionally 'target_path',
-                   'variable_mapping', 'dimension_mapping', and 'chunks'
+                   'variable_mapping', 'dimension_mapping', 'chunks',
+                   'writer_options', 'blocks', 'qc_variables', 'validation'
+                   and 'block_rows'
         
         Returns:
             Configured NetCDFConverter instance
@@ -97,11 +211,21 @@ class NetCDFConverter(BaseConverter):
         variable_mapping = config.pop('variable_mapping', None)
         dimension_mapping = config.pop('dimension_mapping', None)
         chunks = config.pop('chunks', None)
+        writer_options = config.pop('writer_options', None)
+        blocks = config.pop('blocks', DEFAULT_BLOCKS)
+        qc_variables = config.pop('qc_variables', None)
+        validation = config.pop('validation', None)
+        block_rows = config.pop('block_rows', DEFAULT_BLOCK_ROWS)
         
         return cls(
             source_path=source_path,
             target_path=target_path,
             variable_mapping=variable_mapping,
             dimension_mapping=dimension_mapping,
-            chunks=chunks
+            chunks=chunks,
+            writer_options=writer_options,
+            blocks=blocks,
+            qc_variables=qc_variables,
+            validation=validation,
+            block_rows=block_rows
         ) 
\ No newline at end of file
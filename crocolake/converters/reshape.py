@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from typing import Optional, List, Dict
+
+def stack_columns(ids: Dict[str, np.ndarray], values: Dict[str, np.ndarray],
+                  qc: Optional[Dict[str, np.ndarray]] = None,
+                  dropna: bool = True) -> pd.DataFrame:
+    """
+    Build a long-format table from column blocks.
+    
+    The value columns are stacked variable by variable, as DataFrame.melt
+    does, and the id columns are gathered with NumPy for the kept cells
+    only. Rows whose value is missing are dropped while stacking, so they
+    are never materialized.
+    
+    Args:
+        ids: Id columns (e.g. timestamp, latitude), all of the same length
+        values: Measurement columns by variable name, same length as ids
+        qc: Optional QC flag columns by variable name; variables without
+            a QC column get missing flags
+        dropna: Whether to drop rows whose value is missing
+    
+    Returns:
+        DataFrame with the id columns, a categorical 'variable' column, a
+        'value' column and, if qc is given, a 'qc' column
+    """
+    names = list(values)
+    n_rows = len(next(iter(values.values()))) if values else 0
+    
+    stacked = np.concatenate([np.asarray(values[name], dtype=float) for name in names]) \
+        if names else np.empty(0)
+    
+    # Positions of the kept cells in the stacked block; the id columns are
+    # gathered with them once instead of being tiled and then filtered
+    if dropna:
+        positions = np.flatnonzero(~np.isnan(stacked))
+    else:
+        positions = np.arange(len(stacked))
+    rows = positions % n_rows if n_rows else positions
+    codes = (positions // n_rows if n_rows else positions).astype(np.int32)
+    
+    data = {col: np.asarray(column)[rows] for col, column in ids.items()}
+    data['variable'] = pd.Categorical.from_codes(codes, categories=names)
+    data['value'] = stacked[positions]
+    
+    if qc is not None:
+        flags = [
+            np.asarray(qc[name]) if name in qc else np.full(n_rows, np.nan)
+            for name in names
+        ]
+        data['qc'] = np.concatenate(flags)[positions] if flags else np.empty(0)
+    
+    return pd.DataFrame(data)
+
+def wide_to_long(data: pd.DataFrame, id_vars: List[str],
+                 value_vars: Optional[List[str]] = None,
+                 qc_columns: Optional[Dict[str, str]] = None,
+                 dropna: bool = True) -> pd.DataFrame:
+    """
+    Reshape a wide DataFrame to CrocoLake's long format.
+    
+    Replacement for DataFrame.melt(id_vars, value_vars, var_name='variable',
+    value_name='value') that drops missing values during the reshape and
+    can carry a QC flag column paired with each variable.
+    
+    Args:
+        data: Wide DataFrame with one column per measured variable
+        id_vars: Columns repeated for every variable
+        value_vars: Measurement columns (default: all other columns,
+            except the QC columns)
+        qc_columns: Optional mapping of variable to its QC flag column
+        dropna: Whether to drop rows whose value is missing
+    
+    Returns:
+        Long-format DataFrame, see stack_columns
+    """
+    qc_columns = qc_columns or {}
+    if value_vars is None:
+        excluded = set(id_vars) | set(qc_columns.values())
+        value_vars = [col for col in data.columns if col not in excluded]
+    
+    ids = {col: data[col].to_numpy() for col in id_vars}
+    values = {
+        col: pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        for col in value_vars
+    }
+    qc = {
+        variable: data[column].to_numpy()
+        for variable, column in qc_columns.items()
+        if variable in values and column in data.columns
+    } if qc_columns else None
+    
+    return stack_columns(ids, values, qc=qc, dropna=dropna)
@@ -0,0 +1,376 @@
+import shutil
+import urllib.parse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Union, Tuple
+from ..schema import arrow_schema
+from ..stats import compute_stats, merge_stats, stats_path, write_stats
+from ..overviews import OverviewBuilder, overview_path
+from ..catalog import update_catalog
+from ..profiling import stage
+from ..spatial import CELL_COLUMN, CELL_RESOLUTION_KEY, cell_ids
+
+# Number of rows per parquet row group
+DEFAULT_ROW_GROUP_SIZE = 128 * 1024
+
+# Directory name of null partition values, as written by pyarrow
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+class DatasetWriter:
+    """
+    Writer for CrocoLake datasets.
+    
+    Data can be written as a single parquet file, or as a hive-style
+    directory partitioned by variable (and optionally by year/month of the
+    timestamp) whose partitions are sorted by timestamp and latitude.
+    Optionally a spatial cell column is added and used as the leading sort
+    key, so that row groups cover compact areas.
+    
+    Each writer writes one file per partition (or one file), whatever the
+    number of chunks: rows are buffered until they fill a row group of
+    row_group_size rows, and each row group is sorted before it is written.
+    
+    The CrocoLake columns are cast to the schema returned by
+    crocolake.schema.arrow_schema: variable, unit and source are stored
+    dictionary-encoded, and value/depth can be stored as float32.
+    The writer accepts several chunks, which are appended to the same dataset.
+    Statistics of the written data are stored in a JSON sidecar on close,
+    and optionally overview pyramids of binned statistics in a parquet one.
+    A complete dataset is also recorded in the catalog of its data
+    directory, see crocolake.catalog; appending writers, and writers of
+    files inside a larger dataset, leave that to whoever coordinates
+    them, e.g. BatchConverter.
+    """
+    
+    def __init__(self, target_path: str, partitioned: bool = False,
+                 time_partition: Optional[str] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 compression: str = 'snappy',
+                 basename: str = 'part',
+                 append: bool = False,
+                 spatial_index: Optional[float] = None,
+                 value_dtype: str = 'float64',
+                 depth_dtype: str = 'float64',
+                 overviews: Union[bool, List[Dict[str, Any]]] = False,
+                 catalog: bool = True):
+        """
+        Initialize the writer.
+        
+        Args:
+            target_path: Path of the parquet file or dataset directory
+            partitioned: Whether to write a hive-style partitioned directory
+            time_partition: Optional time partitioning, 'year' or 'month'
+            row_group_size: Number of rows per parquet row group
+            compression: Parquet compression codec
+            basename: Prefix of the files written in a partitioned directory
+            append: Add files to an existing partitioned directory instead
+                of replacing it; basename must then be unique per writer
+            spatial_index: Resolution in degrees of the lat/lon grid whose
+                cell ids are written to a 'cell' column; None disables it
+            value_dtype: Storage dtype of the value column, e.g. 'float32'
+            depth_dtype: Storage dtype of the depth column, e.g. 'float32'
+            overviews: Write overview pyramids, see crocolake.overviews;
+                True uses the default levels, a list of dicts gives the
+                bins of each level
+            catalog: Record the dataset in the catalog of its data
+                directory on close; ignored when appending
+        """
+        if time_partition not in (None, 'year', 'month'):
+            raise ValueError(f"Unsupported time partition: {time_partition}")
+        if time_partition and not partitioned:
+            raise ValueError("time_partition requires partitioned=True")
+        if append and not partitioned:
+            raise ValueError("append requires partitioned=True")
+        
+        self.target_path = Path(target_path)
+        self.partitioned = partitioned
+        self.time_partition = time_partition
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.basename = basename
+        self.append = append
+        self.spatial_index = spatial_index
+        self.value_dtype = value_dtype
+        self.depth_dtype = depth_dtype
+        self.overviews = overviews
+        self.catalog = catalog
+        self._writer: Optional['_RowGroupWriter'] = None
+        self._partitions: Dict[Tuple, '_RowGroupWriter'] = {}
+        self._files: List[Path] = []
+        self._schema = None
+        self._n_chunks = 0
+        self._stats = []
+        self._overviews = None
+        self._closed = False
+        self._prepared = False
+        # Optional crocolake.profiling.StageProfiler timing the write sub-stages
+        self.profiler = None
+        if overviews:
+            self._overviews = OverviewBuilder(None if overviews is True else overviews)
+    
+    @property
+    def partition_columns(self) -> List[str]:
+        """Columns used as hive partition keys."""
+        if not self.partitioned:
+            return []
+        columns = ['variable']
+        if self.time_partition in ('year', 'month'):
+            columns.append('year')
+        if self.time_partition == 'month':
+            columns.append('month')
+        return columns
+    
+    @property
+    def sort_columns(self) -> List[str]:
+        """Row order inside each partition."""
+        columns = list(self.partition_columns)
+        if self.spatial_index:
+            columns.append(CELL_COLUMN)
+        return columns + ['timestamp', 'latitude']
+    
+    @property
+    def stats_path(self) -> Path:
+        """Path of the statistics sidecar written by this writer."""
+        if self.partitioned:
+            return stats_path(self.target_path / f"{self.basename}.parquet")
+        return stats_path(self.target_path)
+    
+    @property
+    def overview_path(self) -> Path:
+        """Path of the overview sidecar written by this writer."""
+        if self.partitioned:
+            return overview_path(self.target_path / f"{self.basename}.parquet")
+        return overview_path(self.target_path)
+    
+    def prepare(self) -> None:
+        """
+        Remove the previous version of the dataset, unless appending, and
+        create the directory of a partitioned one.
+        
+        Called by the first write; callers placing side files inside the
+        target (e.g. quarantined rows) call it before writing them.
+        """
+        if self._prepared:
+            return
+        self._prepared = True
+        
+        if not self.append:
+            self._clear_target()
+        if self.partitioned:
+            self.target_path.mkdir(parents=True, exist_ok=True)
+    
+    def write(self, data: pd.DataFrame) -> None:
+        """Append a chunk of CrocoLake-formatted data to the dataset."""
+        self.prepare()
+        
+        with stage(self.profiler, 'write.stats'):
+            self._stats.append(compute_stats(data))
+            if self._overviews is not None:
+                self._overviews.add(data)
+        
+        with stage(self.profiler, 'write.prepare'):
+            data = self._prepare(data)
+        
+        with stage(self.profiler, 'write.encode'):
+            if self.partitioned:
+                self._write_partitioned(data)
+            else:
+                self._write_file(data)
+
+        self._n_chunks += 1
+    
+    def close(self) -> None:
+        """Flush and close the dataset, write its statistics and overviews and catalog it."""
+        with stage(self.profiler, 'write.encode'):
+            self._close_file(flush=True)
+        if self._closed:
+            return
+        self._closed = True
+        
+        stats = merge_stats(self._stats)
+        if stats is not None:
+            write_stats(self.stats_path, stats, self._files)
+        if self._overviews is not None:
+            self._overviews.write(self.overview_path)
+        
+        if self.catalog and not self.append and self._n_chunks:
+            with stage(self.profiler, 'write.catalog'):
+                update_catalog(self.target_path)
+    
+    def __enter__(self) -> 'DatasetWriter':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Statistics of an incomplete dataset are not written
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_file()
+    
+    def _close_file(self, flush: bool = False) -> None:
+        """Close the open files, writing their buffered rows if flush."""
+        writers = list(self._partitions.values())
+        if self._writer is not None:
+            writers.append(self._writer)
+        try:
+            for writer in writers:
+                writer.close(flush=flush)
+        finally:
+            self._writer = None
+            self._partitions.clear()
+    
+    def _prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Add the partitioning and cell columns and sort the chunk."""
+        if not self.partitioned and not self.spatial_index:
+            return data
+        
+        data = data.copy()
+        if self.time_partition:
+            timestamps = pd.to_datetime(data['timestamp'])
+            data['year'] = timestamps.dt.year.astype('int32')
+            if self.time_partition == 'month':
+                data['month'] = timestamps.dt.month.astype('int32')
+        
+        if self.spatial_index:
+            data[CELL_COLUMN] = cell_ids(
+                data['latitude'].to_numpy(), data['longitude'].to_numpy(), self.spatial_index
+            )
+        
+        return data.sort_values(self.sort_columns, kind='stable')
+    
+    def _to_table(self, data: pd.DataFrame) -> pa.Table:
+        """Convert a chunk to Arrow, enforcing the dataset schema."""
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        if self._schema is None:
+            self._schema = self._dataset_schema(table.schema)
+        if not table.schema.equals(self._schema, check_metadata=True):
+            table = table.cast(self._schema)
+        return table
+    
+    def _dataset_schema(self, schema: pa.Schema) -> pa.Schema:
+        """
+        Schema of the dataset, given the schema of its first chunk.
+        
+        CrocoLake columns get their canonical types; extra columns keep
+        the types of the first chunk. The pandas metadata is dropped, as it
+        no longer describes the stored types.
+        """
+        canonical = arrow_schema(self.value_dtype, self.depth_dtype)
+        fields = [
+            canonical.field(field.name) if field.name in canonical.names else field
+            for field in schema
+        ]
+        
+        metadata = {}
+        if self.spatial_index:
+            metadata[CELL_RESOLUTION_KEY] = str(self.spatial_index).encode()
+        
+        return pa.schema(fields, metadata=metadata or None)
+    
+    def _write_file(self, data: pd.DataFrame) -> None:
+        table = self._to_table(data)
+        if self._writer is None:
+            # Rows are only re-sorted if the writer sorts them
+            sort_columns = self.sort_columns if self.spatial_index else []
+            self._writer = self._row_group_writer(self.target_path, table.schema, sort_columns)
+        self._writer.add(table)
+    
+    def _write_partitioned(self, data: pd.DataFrame) -> None:
+        table = self._to_table(data)
+        columns = self.partition_columns
+        file_schema = pa.schema(
+            [field for field in table.schema if field.name not in columns],
+            metadata=table.schema.metadata
+        )
+        table = table.select(file_schema.names)
+        
+        groups = data.groupby(columns, sort=False, observed=True, dropna=False).indices
+        for key, positions in groups.items():
+            key = key if isinstance(key, tuple) else (key,)
+            writer = self._partitions.get(key)
+            if writer is None:
+                directory = self.target_path.joinpath(*(
+                    f"{column}={_partition_value(value)}" for column, value in zip(columns, key)
+                ))
+                directory.mkdir(parents=True, exist_ok=True)
+                writer = self._row_group_writer(
+                    directory / f"{self.basename}-0.parquet",
+                    file_schema,
+                    [column for column in self.sort_columns if column not in columns]
+                )
+                self._partitions[key] = writer
+            writer.add(table.take(positions))
+    
+    def _row_group_writer(self, path: Path, schema: pa.Schema,
+                          sort_columns: List[str]) -> '_RowGroupWriter':
+        self._files.append(path)
+        return _RowGroupWriter(path, schema, self.row_group_size, self.compression, sort_columns)
+    
+    def _clear_target(self) -> None:
+        """Remove a previous version of the dataset before writing."""
+        if self.target_path.is_dir():
+            shutil.rmtree(self.target_path)
+        elif self.target_path.exists():
+            self.target_path.unlink()
+        
+        for path in (self.stats_path, self.overview_path):
+            if path.exists():
+                path.unlink()
+
+class _RowGroupWriter:
+    """
+    Parquet file written in whole row groups.
+    
+    Added rows are buffered until they fill a row group; each row group is
+    sorted on sort_columns before it is written, so row groups written from
+    many small chunks still have tight statistics.
+    """
+    
+    def __init__(self, path: Path, schema: pa.Schema, row_group_size: int,
+                 compression: str, sort_columns: List[str]):
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.sort_columns = sort_columns
+        self._tables: List[pa.Table] = []
+        self._n_rows = 0
+        self._writer = pq.ParquetWriter(str(path), schema, compression=compression)
+    
+    def add(self, table: pa.Table) -> None:
+        """Buffer rows, writing the row groups they complete."""
+        self._tables.append(table)
+        self._n_rows += table.num_rows
+        if self._n_rows >= self.row_group_size:
+            self._flush(final=False)
+    
+    def close(self, flush: bool = True) -> None:
+        """Write the remaining rows as a last, smaller row group if flush, and close."""
+        try:
+            if flush:
+                self._flush(final=True)
+        finally:
+            self._writer.close()
+    
+    def _flush(self, final: bool) -> None:
+        if not self._n_rows:
+            return
+        
+        table = pa.concat_tables(self._tables)
+        if self.sort_columns:
+            table = table.sort_by([(column, 'ascending') for column in self.sort_columns])
+        
+        n_rows = table.num_rows if final else table.num_rows // self.row_group_size * self.row_group_size
+        self._writer.write_table(table.slice(0, n_rows), row_group_size=self.row_group_size)
+        
+        rest = table.slice(n_rows)
+        self._tables = [rest] if rest.num_rows else []
+        self._n_rows = rest.num_rows
+
+def _partition_value(value: Any) -> str:
+    """Directory name of a partition value, encoded like pyarrow's hive partitioning."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return NULL_PARTITION
+    return urllib.parse.quote(str(value), safe='')
@@ -3,5 +3,7 @@ CrocoLake data loader
 """
 
 from .data_loader import DataLoader
+from .cache import TableCache
+from .service import QueryService
 
-__all__ = ["DataLoader"] 
\ No newline at end of file
+__all__ = ["DataLoader", "TableCache", "QueryService"] 
\ No newline at end of file
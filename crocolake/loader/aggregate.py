@@ -0,0 +1,173 @@
+"""
+CrocoLake binned aggregation
+
+Observations are grouped into lat/lon cells, depth bins or time buckets and
+reduced to per-bin statistics one record batch at a time: each batch is
+reduced to partial sums, minima, maxima and counts, which are merged
+into the final statistics, so the raw rows are never held in memory.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import List, Sequence, Union
+
+from ..spatial import cell_ids, cell_centers
+
+# Binned dimensions accepted in addition to plain column names
+BINNED_KEYS = ('cell', 'depth', 'time')
+
+# Statistics computed per bin
+STATISTICS = ('mean', 'min', 'max', 'count')
+
+# Time bucket units, as accepted by pyarrow.compute.floor_temporal
+TIME_UNITS = ('year', 'quarter', 'month', 'week', 'day', 'hour', 'minute', 'second')
+
+def key_names(by: Sequence[str]) -> List[str]:
+    """Output columns of the group keys; a 'cell' key becomes a latitude/longitude pair."""
+    names = []
+    for key in by:
+        if key == 'cell':
+            names.extend(['latitude', 'longitude'])
+        elif key == 'time':
+            names.append('timestamp')
+        else:
+            names.append(key)
+    return names
+
+def source_columns(by: Sequence[str], value_column: str) -> List[str]:
+    """Columns to read for an aggregation."""
+    columns = []
+    for key in by:
+        if key == 'cell':
+            columns.extend(['latitude', 'longitude'])
+        elif key == 'time':
+            columns.append('timestamp')
+        else:
+            columns.append(key)
+    columns.append(value_column)
+    return list(dict.fromkeys(columns))
+
+def bin_batch(batch: pa.RecordBatch, by: Sequence[str], value_column: str,
+              resolution: float, depth_bins: Union[float, Sequence[float]],
+              time_bucket: str) -> pa.Table:
+    """
+    Replace the columns of a batch by its bin keys.
+    
+    Args:
+        batch: Record batch holding the source columns
+        by: Group keys; 'cell', 'depth' and 'time' are binned, any other
+            column is grouped on its values
+        value_column: Column the statistics are computed on
+        resolution: Cell size in degrees
+        depth_bins: Depth bin width, or a sorted sequence of bin edges;
+            depths outside the edges get a null bin
+        time_bucket: Unit timestamps are floored to, see TIME_UNITS
+    
+    Returns:
+        Table with one column per key name and the value column
+    """
+    arrays = bin_keys(batch, by, resolution, depth_bins, time_bucket)
+    arrays['value'] = batch.column(value_column).cast(pa.float64())
+    return pa.table(arrays)
+
+def rebin_partials(partials: pa.RecordBatch, by: Sequence[str], resolution: float,
+                   depth_bins: Union[float, Sequence[float]], time_bucket: str) -> pa.Table:
+    """
+    Move partial statistics to coarser bins.
+    
+    The key columns of the partials (as named by key_names) are binned
+    again like raw observations, which is exact when every bin of the
+    partials lies inside one of the new bins.
+    
+    Returns:
+        Partial statistics keyed by the new bins; bins that now coincide
+        are not merged yet, see merge_partials
+    """
+    arrays = bin_keys(partials, by, resolution, depth_bins, time_bucket)
+    for stat in ('sum', 'min', 'max', 'count'):
+        arrays[stat] = partials.column(stat)
+    return pa.table(arrays)
+
+def bin_keys(batch: pa.RecordBatch, by: Sequence[str], resolution: float,
+             depth_bins: Union[float, Sequence[float]], time_bucket: str) -> dict:
+    """Bin key arrays of a batch by key name, see bin_batch."""
+    arrays = {}
+    for key in by:
+        if key == 'cell':
+            ids = cell_ids(
+                batch.column('latitude').to_numpy(zero_copy_only=False),
+                batch.column('longitude').to_numpy(zero_copy_only=False),
+                resolution
+            )
+            latitude, longitude = cell_centers(ids, resolution)
+            arrays['latitude'] = pa.array(latitude, from_pandas=True)
+            arrays['longitude'] = pa.array(longitude, from_pandas=True)
+        elif key == 'depth':
+            arrays['depth'] = _depth_bins(batch.column('depth'), depth_bins)
+        elif key == 'time':
+            arrays['timestamp'] = pc.floor_temporal(batch.column('timestamp'), unit=time_bucket)
+        else:
+            column = batch.column(key)
+            if pa.types.is_dictionary(column.type):
+                column = column.cast(column.type.value_type)
+            arrays[key] = column
+    
+    return arrays
+
+def partial_stats(binned: pa.Table, keys: List[str]) -> pa.Table:
+    """Per-bin sum, minimum, maximum and count of a binned batch."""
+    result = binned.group_by(keys).aggregate([
+        ('value', 'sum'), ('value', 'min'), ('value', 'max'), ('value', 'count')
+    ])
+    return _rename(result, {
+        'value_sum': 'sum', 'value_min': 'min', 'value_max': 'max', 'value_count': 'count'
+    })
+
+def merge_partials(partials: List[pa.Table], keys: List[str]) -> pa.Table:
+    """Merge partial statistics that may share bins."""
+    table = pa.concat_tables(partials)
+    result = table.group_by(keys).aggregate([
+        ('sum', 'sum'), ('min', 'min'), ('max', 'max'), ('count', 'sum')
+    ])
+    return _rename(result, {
+        'sum_sum': 'sum', 'min_min': 'min', 'max_max': 'max', 'count_sum': 'count'
+    })
+
+def finalize(partials: List[pa.Table], keys: List[str]) -> pd.DataFrame:
+    """
+    Final statistics from partial statistics.
+    
+    Returns:
+        DataFrame with the key columns followed by mean, min, max and
+        count, sorted by the keys
+    """
+    if not partials:
+        return pd.DataFrame({col: [] for col in keys + list(STATISTICS)})
+    
+    df = merge_partials(partials, keys).to_pandas()
+    df['mean'] = df['sum'] / df['count'].where(df['count'] > 0)
+    df = df[keys + list(STATISTICS)]
+    
+    return df.sort_values(keys, na_position='last').reset_index(drop=True)
+
+def _depth_bins(depth: pa.Array, depth_bins: Union[float, Sequence[float]]) -> pa.Array:
+    """Lower edge of the depth bin of each observation."""
+    values = depth.to_numpy(zero_copy_only=False).astype(float)
+    
+    if np.isscalar(depth_bins):
+        lower = np.floor(values / depth_bins) * depth_bins
+    else:
+        edges = np.asarray(depth_bins, dtype=float)
+        index = np.searchsorted(edges, values, side='right') - 1
+        # The last edge closes the last bin
+        index = np.where(values == edges[-1], len(edges) - 2, index)
+        outside = (index < 0) | (index >= len(edges) - 1)
+        lower = np.where(outside, np.nan, edges[np.clip(index, 0, len(edges) - 1)])
+    
+    return pa.array(lower, from_pandas=True)
+
+def _rename(table: pa.Table, names: dict) -> pa.Table:
+    """Rename the aggregate columns of a group_by result."""
+    return table.rename_columns([names.get(name, name) for name in table.column_names])
@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Hashable
+
+import pyarrow as pa
+
+# Default memory budget of the DataLoader cache, in bytes
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+class TableCache:
+    """
+    LRU cache of Arrow tables with a memory budget.
+    
+    Every entry is stored with the version of the dataset it was read from;
+    an entry whose version no longer matches is dropped on lookup. When the
+    total size of the cached tables exceeds the budget, the least recently
+    used entries are evicted.
+    """
+    
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_bytes: Memory budget in bytes; 0 disables caching
+        """
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+    
+    def get(self, key: Hashable, version: Hashable, count: bool = True) -> Optional[pa.Table]:
+        """
+        Look up a table.
+        
+        Args:
+            key: Cache key
+            version: Current version of the dataset the table comes from
+            count: Whether the lookup is recorded in the hit/miss counters
+        
+        Returns:
+            The cached table, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != version:
+                self._remove(key)
+                self._counters['invalidations'] += 1
+                entry = None
+            
+            if entry is None:
+                if count:
+                    self._counters['misses'] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            if count:
+                self._counters['hits'] += 1
+            return entry[1]
+    
+    def put(self, key: Hashable, version: Hashable, table: pa.Table) -> None:
+        """Store a table, evicting least recently used entries if needed."""
+        nbytes = table.nbytes
+        if nbytes > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            
+            self._entries[key] = (version, table, nbytes)
+            self._bytes += nbytes
+            
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+    
+    def clear(self) -> None:
+        """Drop all entries; counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def info(self) -> Dict[str, Any]:
+        """Counters and current size of the cache."""
+        with self._lock:
+            return {
+                **self._counters,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+    
+    def _remove(self, key: Hashable) -> None:
+        _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
@@ -0,0 +1,275 @@
+"""
+CrocoLake collocation
+
+Targets (model grid points, satellite tracks, ...) are matched to the
+observations within a distance, time and depth tolerance. Observations are
+hashed into cubic cells of the 3-D unit sphere, twice as wide as the
+distance tolerance, and sorted by cell and time bin: the candidates of a
+target lie in the 2 x 2 x 2 block of cells nearest to it, as a few
+contiguous runs of the sorted observations found with binary searches on
+whole chunks of targets at once, and are then filtered exactly.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple, Any
+
+from ..spatial import unit_vectors, chord_length, great_circle_km
+
+# Number of targets matched at once per thread
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Bits of each cell coordinate in a packed cell key
+CELL_BITS = 21
+
+# Smallest cell width, so that the cell coordinates (and their neighbours)
+# fit in CELL_BITS; smaller tolerances only get more candidates per cell
+MIN_CELL = 2.0 / ((1 << CELL_BITS) - 4)
+
+# Cells of the block searched around a target: its own cell and, along
+# each selected axis, the neighbour on the side nearest to the target
+BLOCK = np.array(
+    [(dx, dy, dz) for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)],
+    dtype=np.int64
+)
+
+class CollocationIndex:
+    """
+    Spatial-temporal index of observations for collocation queries.
+    
+    The index is read-only once built, so it can be queried from several
+    threads.
+    """
+    
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, max_distance: float,
+                 timestamp: Optional[np.ndarray] = None, time_tolerance: Any = None,
+                 depth: Optional[np.ndarray] = None, depth_tolerance: Optional[float] = None):
+        """
+        Build the index.
+        
+        Args:
+            latitude, longitude: Coordinates of the observations in degrees
+            max_distance: Great-circle distance tolerance in kilometres
+            timestamp: Times of the observations, required with time_tolerance
+            time_tolerance: Optional maximum time difference, as a
+                pd.Timedelta or anything it accepts, e.g. '6h'
+            depth: Depths of the observations, required with depth_tolerance
+            depth_tolerance: Optional maximum depth difference in meters
+        """
+        if max_distance < 0:
+            raise ValueError("max_distance must not be negative")
+        
+        self.chord = float(chord_length(max_distance))
+        self.cell = max(2.0 * self.chord, MIN_CELL)
+        self.xyz = unit_vectors(latitude, longitude)
+        
+        self.time_tolerance = None
+        self.times = None
+        if time_tolerance is not None:
+            if timestamp is None:
+                raise ValueError("time_tolerance requires observation timestamps")
+            self.time_tolerance = pd.Timedelta(time_tolerance).value
+            self.times = _nanoseconds(timestamp)
+        
+        self.depth_tolerance = depth_tolerance
+        self.depth = None
+        if depth_tolerance is not None:
+            if depth is None:
+                raise ValueError("depth_tolerance requires observation depths")
+            self.depth = np.asarray(depth, dtype=float)
+        
+        # Observations with missing coordinates (or times) never match
+        valid = ~np.isnan(self.xyz).any(axis=1)
+        if self.times is not None:
+            valid &= self.times != np.iinfo(np.int64).min
+        positions = np.flatnonzero(valid)
+        
+        keys = _pack(np.floor((self.xyz[positions] + 1.0) / self.cell).astype(np.int64))
+        self.keys, ranks = np.unique(keys, return_inverse=True)
+        
+        # Time bins are at least as wide as the tolerance, so a target's
+        # window spans at most two of them; they are widened further if
+        # needed for the sort keys to fit in int64
+        self.time_origin = 0
+        self.time_bin = 1
+        self.span = 1
+        bins = np.zeros(len(positions), dtype=np.int64)
+        if self.times is not None and len(positions):
+            times = self.times[positions]
+            self.time_origin = int(times.min())
+            extent = int(times.max()) - self.time_origin + 1
+            self.time_bin = max(self.time_tolerance, 1, -(-extent * len(self.keys) // (1 << 62)))
+            bins = (times - self.time_origin) // self.time_bin
+            self.span = int(bins.max()) + 1
+        
+        sort_keys = ranks.astype(np.int64) * self.span + bins
+        order = np.argsort(sort_keys, kind='stable')
+        self.sort_keys = sort_keys[order]
+        self.positions = positions[order]
+    
+    def query(self, latitude: np.ndarray, longitude: np.ndarray,
+              timestamp: Optional[np.ndarray] = None,
+              depth: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All (target, observation) pairs within the tolerances.
+        
+        Args:
+            latitude, longitude: Coordinates of the targets in degrees
+            timestamp: Times of the targets, required if the index has a
+                time tolerance
+            depth: Depths of the targets, required if the index has a
+                depth tolerance
+        
+        Returns:
+            Tuple of target positions, observation positions and
+            great-circle distances in kilometres, sorted by target
+        """
+        xyz = unit_vectors(latitude, longitude)
+        times = self._target_times(timestamp, len(xyz))
+        
+        targets, observations = self._candidates(xyz, times)
+        
+        chords = np.linalg.norm(self.xyz[observations] - xyz[targets], axis=1)
+        keep = chords <= self.chord
+        if times is not None:
+            keep &= np.abs(self.times[observations] - times[targets]) <= self.time_tolerance
+        if self.depth is not None:
+            if depth is None:
+                raise ValueError("Target depths are required with a depth tolerance")
+            depth = np.asarray(depth, dtype=float)
+            keep &= np.abs(self.depth[observations] - depth[targets]) <= self.depth_tolerance
+        
+        targets, observations = targets[keep], observations[keep]
+        order = np.lexsort((observations, targets))
+        return targets[order], observations[order], great_circle_km(chords[keep][order])
+    
+    def _candidates(self, xyz: np.ndarray, times: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Target and observation positions sharing a neighbouring cell and time bin."""
+        valid = ~np.isnan(xyz).any(axis=1)
+        if times is not None:
+            valid &= times != np.iinfo(np.int64).min
+        targets = np.flatnonzero(valid)
+        scaled = (xyz[targets] + 1.0) / self.cell
+        cells = np.floor(scaled).astype(np.int64)
+        # A ball of radius cell / 2 only reaches the neighbour nearest to
+        # the target along each axis
+        sides = np.where(scaled - cells < 0.5, -1, 1)
+        
+        # Binary searches are much faster with sorted needles, so targets
+        # are searched in cell order
+        order = np.argsort(_pack(cells), kind='stable')
+        targets, cells, sides = targets[order], cells[order], sides[order]
+        
+        if times is not None:
+            low = (times[targets] - self.time_tolerance - self.time_origin) // self.time_bin
+            high = (times[targets] + self.time_tolerance - self.time_origin) // self.time_bin
+            low, high = np.maximum(low, 0), np.minimum(high, self.span - 1)
+        else:
+            low = high = np.zeros(len(targets), dtype=np.int64)
+        
+        target_runs, starts, stops = [], [], []
+        for offset in BLOCK:
+            keys = _pack(cells + sides * offset)
+            index = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+            found = (self.keys[index] == keys) & (low <= high) if len(self.keys) else keys < 0
+            ranks = index[found].astype(np.int64) * self.span
+            
+            target_runs.append(targets[found])
+            starts.append(np.searchsorted(self.sort_keys, ranks + low[found], side='left'))
+            stops.append(np.searchsorted(self.sort_keys, ranks + high[found], side='right'))
+        
+        target_runs = np.concatenate(target_runs)
+        starts, stops = np.concatenate(starts), np.concatenate(stops)
+        counts = stops - starts
+        
+        # Expand the runs [start, stop) into one entry per candidate
+        total = int(counts.sum())
+        run_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        sorted_positions = np.repeat(starts, counts) + np.arange(total) - run_offsets
+        return np.repeat(target_runs, counts), self.positions[sorted_positions]
+    
+    def _target_times(self, timestamp: Optional[np.ndarray], n_targets: int) -> Optional[np.ndarray]:
+        if self.times is None:
+            return None
+        if timestamp is None:
+            raise ValueError("Target timestamps are required with a time tolerance")
+        times = _nanoseconds(timestamp)
+        if len(times) != n_targets:
+            raise ValueError("Targets must have one timestamp each")
+        return times
+
+def match(index: CollocationIndex, targets: pd.DataFrame, nearest: bool = False,
+          chunk_size: int = DEFAULT_CHUNK_SIZE,
+          max_workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Query an index with many targets, in chunks on a thread pool.
+    
+    Args:
+        index: Index of the observations
+        targets: DataFrame with 'latitude' and 'longitude' columns, and
+            'timestamp' and 'depth' if the index has those tolerances
+        nearest: Keep only the closest observation of each target; ties
+            are broken by time difference, then observation order
+        chunk_size: Number of targets per query, which bounds the memory
+            used by the candidates
+        max_workers: Number of chunks queried concurrently
+    
+    Returns:
+        Tuple of target positions, observation positions and distances in
+        kilometres, sorted by target
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    
+    latitude = targets['latitude'].to_numpy(dtype=float)
+    longitude = targets['longitude'].to_numpy(dtype=float)
+    timestamp = targets['timestamp'] if index.times is not None else None
+    depth = targets['depth'].to_numpy(dtype=float) if index.depth is not None else None
+    
+    def query(start: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        stop = start + chunk_size
+        target, observation, distance = index.query(
+            latitude[start:stop],
+            longitude[start:stop],
+            None if timestamp is None else timestamp.iloc[start:stop],
+            None if depth is None else depth[start:stop]
+        )
+        if nearest:
+            keep = _nearest(index, target, observation, distance, timestamp, start)
+            target, observation, distance = target[keep], observation[keep], distance[keep]
+        return target + start, observation, distance
+    
+    starts = range(0, len(targets), chunk_size)
+    max_workers = max_workers or min(len(starts), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(query, starts))
+    
+    if not results:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=float)
+    return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+def _nearest(index: CollocationIndex, target: np.ndarray, observation: np.ndarray,
+             distance: np.ndarray, timestamp: Optional[pd.Series], start: int) -> np.ndarray:
+    """Positions of the closest match of each target in a chunk's matches."""
+    keys: List[np.ndarray] = [observation]
+    if timestamp is not None:
+        target_times = _nanoseconds(timestamp.iloc[start + target])
+        keys.append(np.abs(index.times[observation] - target_times))
+    keys += [distance, target]
+    
+    order = np.lexsort(keys)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = target[order][1:] != target[order][:-1]
+    return np.sort(order[first])
+
+def _nanoseconds(timestamp: Any) -> np.ndarray:
+    """Timestamps as int64 nanoseconds, NaT as the int64 minimum."""
+    return pd.to_datetime(pd.Series(timestamp)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+def _pack(cells: np.ndarray) -> np.ndarray:
+    """Single int64 key of each row of (x, y, z) cell coordinates."""
+    cells = cells + 1
+    return (cells[:, 0] << (2 * CELL_BITS)) | (cells[:, 1] << CELL_BITS) | cells[:, 2]
@@ -1,18 +1,67 @@
+import os
+from collections import deque
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Dict, Any
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Union, Iterator
 from pathlib import Path
+from .cache import TableCache, DEFAULT_CACHE_BYTES
+from . import aggregate as binning
+from . import collocate as collocation
+from ..schema import COLUMNS, DERIVED_COLUMNS, CATEGORICAL_TYPE, arrow_schema
+from ..spatial import CELL_COLUMN, CELL_RESOLUTION_KEY, EARTH_RADIUS_KM, cover_bbox
+from .. import compaction, overviews
+from ..catalog import CATALOG_NAME, DatasetCatalog, candidate_files, dataset_version, open_index
+from ..profiling import StageProfiler, Hook, stage
+from ..stats import compute_stats, dataset_stats, merge_stats, metadata_stats
+
+# Return types of load_dataset
+OUTPUTS = ('pandas', 'pandas_arrow', 'arrow', 'polars')
+
+# Column tagging the rows of a multi-dataset query with their dataset
+DATASET_COLUMN = 'dataset'
+
+# Maximum number of rows per batch yielded by iter_batches
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+# Number of row groups iter_batches reads ahead of the consumer
+DEFAULT_PREFETCH = 2
+
+# Number of per-batch partial aggregates merged at once by aggregate
+MERGE_PARTIALS = 32
 
 class DataLoader:
     """Unified interface for loading CrocoLake datasets."""
     
-    def __init__(self, data_dir: Optional[str] = None):
+    def __init__(self, data_dir: Optional[str] = None,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES):
         """
         Initialize the data loader.
         
         Args:
             data_dir: Optional root directory containing the datasets
+            cache_bytes: Memory budget of the query cache in bytes;
+                0 disables caching
         """
         self.data_dir = Path(data_dir) if data_dir else Path.cwd()
+        self._cache = TableCache(cache_bytes)
+        # Opened datasets, with their footers once read, by name:
+        # (version, dataset, file index or None)
+        self._datasets: Dict[str, Tuple[Tuple, ds.FileSystemDataset, Optional[pa.Table]]] = {}
+        self._catalog: Optional[DatasetCatalog] = None
+        self._catalog_mtime: Optional[int] = None
+        self.hooks: List[Hook] = []
+        self.last_query_report: Optional[Dict[str, Any]] = None
+    
+    def add_hook(self, hook: Hook) -> None:
+        """
+        Register a callback receiving the stage events and the report of
+        every load_dataset and query call, see crocolake.profiling.
+        """
+        self.hooks.append(hook)
     
     def load_dataset(
         self,
@@ -20,111 +69,1117 @@ class DataLoader:
         variables: Optional[List[str]] = None,
         time_range: Optional[tuple] = None,
         bbox: Optional[Dict[str, float]] = None,
-        depth_range: Optional[tuple] = None
-    ) -> pd.DataFrame:
+        depth_range: Optional[tuple] = None,
+        columns: Optional[List[str]] = None,
+        output: str = 'pandas'
+    ) -> Union[pd.DataFrame, pa.Table, Any]:
         """
         Load a dataset with optional filtering.
         
+        Filters are pushed down to the parquet reader: row groups whose
+        min/max statistics cannot match are skipped, and only the requested
+        columns are decoded. Datasets can be single parquet files or
+        hive-partitioned directories, in which case whole partitions are
+        skipped as well.
+        
+        Results are cached per query. Unfiltered reads are also reused to
+        answer later filtered queries on the same columns in memory. Cached
+        entries are dropped when the dataset changes on disk.
+        
+        The report of the query (stage timings, cache use, files and row
+        groups scanned or skipped, bytes read and rows returned) is stored
+        in last_query_report and sent to the hooks.
+        
         Args:
             dataset_name: Name of the dataset to load
             variables: Optional list of variables to load
             time_range: Optional tuple of (start_time, end_time)
-            bbox: Optional dict with keys 'min_lat', 'max_lat', 'min_lon', 'max_lon'
+            bbox: Optional dict with keys 'min_lat', 'max_lat', 'min_lon', 'max_lon';
+                min_lon > max_lon selects a box crossing the antimeridian
             depth_range: Optional tuple of (min_depth, max_depth)
+            columns: Optional list of columns to return (default: all)
+            output: Type of the result:
+                'pandas' - pandas DataFrame with NumPy dtypes
+                'pandas_arrow' - pandas DataFrame backed by Arrow dtypes,
+                    with categoricals for the string columns
+                'arrow' - pyarrow Table, without any conversion or copy
+                'polars' - Polars DataFrame (requires polars)
         
         Returns:
-            DataFrame containing the requested data
+            The requested data, as the type selected by output
         """
-        # Construct path to dataset
-        dataset_path = self.data_dir / f"{dataset_name}.parquet"
+        self._check_output(output)
         
-        if not dataset_path.exists():
-            raise FileNotFoundError(f"Dataset {dataset_name} not found at {dataset_path}")
+        filters = dict(
+            variables=variables,
+            time_range=time_range,
+            bbox=bbox,
+            depth_range=depth_range
+        )
+        profiler = StageProfiler(self.hooks).start()
+        table = self._load_table(dataset_name, columns, filters, profiler)
+        
+        return self._finish_query(profiler, table, output, [dataset_name])
+    
+    def query(
+        self,
+        datasets: Optional[List[str]] = None,
+        variables: Optional[List[str]] = None,
+        time_range: Optional[tuple] = None,
+        bbox: Optional[Dict[str, float]] = None,
+        depth_range: Optional[tuple] = None,
+        columns: Optional[List[str]] = None,
+        output: str = 'pandas',
+        stream: bool = False,
+        max_workers: Optional[int] = None
+    ) -> Union[pd.DataFrame, pa.Table, Iterator[pa.RecordBatch], Any]:
+        """
+        Query several datasets as one.
+        
+        The filters are pushed down to each dataset as in load_dataset, and
+        the datasets are read in parallel. The results are cast to a common
+        schema (canonical CrocoLake types, other columns promoted or filled
+        with nulls where missing) and tagged with a 'dataset' column.
+        
+        Args:
+            datasets: Names of the datasets to query (default: all)
+            variables, time_range, bbox, depth_range, columns: As in load_dataset
+            output: Type of the result, as in load_dataset; ignored if stream
+            stream: Return an iterator of record batches instead of a
+                combined result, without holding whole datasets in memory
+            max_workers: Number of datasets read concurrently
+        
+        Returns:
+            Combined result of all datasets, or an iterator of record batches
+        """
+        self._check_output(output)
+        
+        datasets = self.list_datasets() if datasets is None else list(datasets)
+        filters = dict(
+            variables=variables,
+            time_range=time_range,
+            bbox=bbox,
+            depth_range=depth_range
+        )
+        
+        schemas = [self._open_dataset(name).schema for name in datasets]
+        projections = [
+            [col for col in columns if col in schema.names] if columns
+            else self._default_columns(schema)
+            for schema in schemas
+        ]
+        schema = self._unify_schemas([
+            pa.schema([s.field(col) for col in projection])
+            for s, projection in zip(schemas, projections)
+        ], columns)
+        
+        if stream:
+            return self._stream_query(datasets, projections, filters, schema)
+        
+        profiler = StageProfiler(self.hooks).start()
+        
+        def load(item):
+            name, projection = item
+            table = self._load_table(name, projection, filters, profiler)
+            return self._tag_table(table, name, schema)
+        
+        max_workers = max_workers or min(len(datasets), os.cpu_count() or 1) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tables = list(executor.map(load, zip(datasets, projections)))
+        
+        if not tables:
+            table = schema.empty_table()
+        else:
+            table = pa.concat_tables(tables)
+        
+        return self._finish_query(profiler, table, output, datasets)
+    
+    def iter_batches(
+        self,
+        dataset_name: str,
+        variables: Optional[List[str]] = None,
+        time_range: Optional[tuple] = None,
+        bbox: Optional[Dict[str, float]] = None,
+        depth_range: Optional[tuple] = None,
+        columns: Optional[List[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        output: str = 'arrow',
+        prefetch: int = DEFAULT_PREFETCH
+    ) -> Iterator[Union[pa.RecordBatch, pd.DataFrame]]:
+        """
+        Iterate over the filtered rows of a dataset in batches.
+        
+        The dataset is read one row group at a time, with the same filter
+        pushdown and row-group pruning as load_dataset, so memory use is
+        bounded by a few row groups whatever the size of the dataset. Row
+        groups are read ahead of the consumer on a thread pool. Batches
+        bypass the query cache.
+        
+        Args:
+            dataset_name: Name of the dataset to load
+            variables, time_range, bbox, depth_range, columns: As in load_dataset
+            batch_size: Maximum number of rows per batch
+            output: 'arrow' for pyarrow RecordBatches, 'pandas' for DataFrames
+            prefetch: Number of row groups read ahead; 0 reads synchronously
+        
+        Returns:
+            Iterator of record batches or DataFrames
+        """
+        if output not in ('arrow', 'pandas'):
+            raise ValueError(f"Unsupported output {output!r}, expected 'arrow' or 'pandas'")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        
+        dataset, index = self._open_indexed(dataset_name)
+        filters = dict(
+            variables=variables,
+            time_range=time_range,
+            bbox=bbox,
+            depth_range=depth_range
+        )
+        expression = self._build_filter(dataset.schema, **filters)
+        if expression is not None:
+            dataset = self._prune_files(dataset, index, filters)
+        # Fragments of one row group each, also without filters, so that
+        # no read decodes more than a row group
+        dataset = self._prune_row_groups(dataset, expression)
+        
+        if columns is None:
+            columns = self._default_columns(dataset.schema)
+        
+        def read(fragment):
+            return fragment.to_table(
+                schema=dataset.schema, columns=columns, filter=expression
+            )
         
-        # Read the parquet file
-        df = pd.read_parquet(dataset_path)
+        for table in self._prefetch(read, dataset.get_fragments(), prefetch):
+            for batch in table.to_batches(max_chunksize=batch_size):
+                if batch.num_rows == 0:
+                    continue
+                yield batch.to_pandas() if output == 'pandas' else batch
+    
+    def aggregate(
+        self,
+        dataset_name: str,
+        by: List[str],
+        variables: Optional[List[str]] = None,
+        time_range: Optional[tuple] = None,
+        bbox: Optional[Dict[str, float]] = None,
+        depth_range: Optional[tuple] = None,
+        resolution: float = 1.0,
+        depth_bins: Union[float, List[float]] = 10.0,
+        time_bucket: str = 'day',
+        value_column: str = 'value',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        use_overviews: bool = True
+    ) -> pd.DataFrame:
+        """
+        Compute binned statistics of a dataset during the scan.
+        
+        The filtered rows are streamed with iter_batches and reduced batch by
+        batch to the mean, minimum, maximum and count of the value per bin,
+        so only the statistics are ever held in memory.
+        
+        If the dataset was written with overviews, the coarsest overview
+        level whose bins and edges fit the requested bins and filters is
+        aggregated instead, without reading the data.
+        
+        Args:
+            dataset_name: Name of the dataset to aggregate
+            by: Group keys, any of:
+                'cell' - lat/lon grid cell of size resolution, returned as
+                    the latitude/longitude of the cell centre
+                'depth' - depth bin, returned as its lower edge
+                'time' - time bucket, returned as its start in 'timestamp'
+                any other column, e.g. 'variable', grouped on its values
+            variables, time_range, bbox, depth_range: Filters, as in load_dataset
+            resolution: Cell size in degrees
+            depth_bins: Depth bin width, or sorted bin edges
+            time_bucket: One of 'year', 'quarter', 'month', 'week', 'day',
+                'hour', 'minute', 'second'
+            value_column: Column the statistics are computed on
+            batch_size: Maximum number of rows reduced at once
+            use_overviews: Whether overviews may be used
+        
+        Returns:
+            DataFrame with the key columns and mean, min, max and count,
+            one row per non-empty bin
+        """
+        if not by:
+            raise ValueError("At least one group key is required")
+        if time_bucket not in binning.TIME_UNITS:
+            raise ValueError(
+                f"Unsupported time bucket {time_bucket!r}, expected one of {binning.TIME_UNITS}"
+            )
         
-        # Apply filters
-        df = self._apply_filters(
-            df,
+        keys = binning.key_names(by)
+        filters = dict(
             variables=variables,
             time_range=time_range,
             bbox=bbox,
             depth_range=depth_range
         )
         
-        return df
+        if use_overviews and value_column == 'value':
+            partials = self._overview_partials(
+                dataset_name, by, filters, resolution, depth_bins, time_bucket
+            )
+            if partials is not None:
+                return binning.finalize(partials, keys)
+        
+        partials = []
+        batches = self.iter_batches(
+            dataset_name,
+            columns=binning.source_columns(by, value_column),
+            batch_size=batch_size,
+            **filters
+        )
+        
+        for batch in batches:
+            binned = binning.bin_batch(
+                batch, by, value_column, resolution, depth_bins, time_bucket
+            )
+            partials.append(binning.partial_stats(binned, keys))
+            if len(partials) >= MERGE_PARTIALS:
+                partials = [binning.merge_partials(partials, keys)]
+        
+        return binning.finalize(partials, keys)
+    
+    def collocate(
+        self,
+        dataset_name: str,
+        targets: pd.DataFrame,
+        max_distance: float,
+        time_tolerance: Any = None,
+        depth_tolerance: Optional[float] = None,
+        variables: Optional[List[str]] = None,
+        columns: Optional[List[str]] = None,
+        nearest: bool = False,
+        chunk_size: int = collocation.DEFAULT_CHUNK_SIZE,
+        max_workers: Optional[int] = None
+    ) -> pd.DataFrame:
+        """
+        Match target points to the observations of a dataset.
+        
+        The observations are loaded with filters covering the targets
+        widened by the tolerances, indexed on the unit sphere and in time
+        (see crocolake.loader.collocate), and queried with chunks of
+        targets on a thread pool.
+        
+        Args:
+            dataset_name: Name of the dataset to match against
+            targets: DataFrame with 'latitude' and 'longitude' columns, plus
+                'timestamp' with a time_tolerance and 'depth' with a
+                depth_tolerance
+            max_distance: Maximum great-circle distance in kilometres
+            time_tolerance: Optional maximum time difference, e.g. '6h'
+            depth_tolerance: Optional maximum depth difference in meters
+            variables: Optional list of variables to match
+            columns: Optional observation columns to return (default: all)
+            nearest: Return only the closest observation of each target
+            chunk_size: Number of targets queried at once per thread
+            max_workers: Number of chunks queried concurrently
+        
+        Returns:
+            DataFrame with one row per matched pair, sorted by target: the
+            target's position in targets ('target'), the observation's
+            columns, the 'distance' in kilometres and, with the tolerances,
+            'time_delta' and 'depth_delta' (observation minus target)
+        """
+        required = ['latitude', 'longitude']
+        if time_tolerance is not None:
+            required.append('timestamp')
+        if depth_tolerance is not None:
+            required.append('depth')
+        missing = [col for col in required if col not in targets.columns]
+        if missing:
+            raise ValueError(f"Targets are missing columns: {missing}")
+        
+        observations = self.load_dataset(
+            dataset_name,
+            variables=variables,
+            columns=None if columns is None else list(dict.fromkeys(columns + required)),
+            **self._collocation_filters(targets, max_distance, time_tolerance, depth_tolerance)
+        )
+        
+        index = collocation.CollocationIndex(
+            observations['latitude'].to_numpy(dtype=float),
+            observations['longitude'].to_numpy(dtype=float),
+            max_distance,
+            timestamp=observations['timestamp'] if time_tolerance is not None else None,
+            time_tolerance=time_tolerance,
+            depth=observations['depth'].to_numpy(dtype=float) if depth_tolerance is not None else None,
+            depth_tolerance=depth_tolerance
+        )
+        target, observation, distance = collocation.match(
+            index, targets, nearest=nearest, chunk_size=chunk_size, max_workers=max_workers
+        )
+        
+        result = observations.iloc[observation].reset_index(drop=True)
+        if columns is not None:
+            result = result[columns]
+        result.insert(0, 'target', target)
+        result['distance'] = distance
+        if time_tolerance is not None:
+            result['time_delta'] = (
+                observations['timestamp'].to_numpy()[observation]
+                - targets['timestamp'].to_numpy(dtype='datetime64[ns]')[target]
+            )
+        if depth_tolerance is not None:
+            result['depth_delta'] = (
+                observations['depth'].to_numpy(dtype=float)[observation]
+                - targets['depth'].to_numpy(dtype=float)[target]
+            )
+        return result
+    
+    @staticmethod
+    def _collocation_filters(targets: pd.DataFrame, max_distance: float,
+                             time_tolerance: Any, depth_tolerance: Optional[float]) -> Dict[str, Any]:
+        """load_dataset filters covering the targets widened by the tolerances."""
+        if targets.empty:
+            return {}
+        filters = {}
+        
+        if time_tolerance is not None:
+            tolerance = pd.Timedelta(time_tolerance)
+            times = pd.to_datetime(targets['timestamp'])
+            filters['time_range'] = (times.min() - tolerance, times.max() + tolerance)
+        
+        if depth_tolerance is not None:
+            filters['depth_range'] = (
+                targets['depth'].min() - depth_tolerance, targets['depth'].max() + depth_tolerance
+            )
+        
+        # Degrees of latitude spanned by max_distance; longitude degrees
+        # shrink with the cosine of the latitude
+        margin = np.degrees(max_distance / EARTH_RADIUS_KM)
+        min_lat = targets['latitude'].min() - margin
+        max_lat = targets['latitude'].max() + margin
+        if min_lat <= -90.0 or max_lat >= 90.0:
+            return filters
+        
+        lon_margin = margin / np.cos(np.radians(max(abs(min_lat), abs(max_lat))))
+        min_lon = targets['longitude'].min() - lon_margin
+        max_lon = targets['longitude'].max() + lon_margin
+        if max_lon - min_lon >= 360.0:
+            min_lon, max_lon = -180.0, 180.0
+        elif min_lon < -180.0:
+            min_lon += 360.0
+        elif max_lon > 180.0:
+            max_lon -= 360.0
+        
+        filters['bbox'] = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+        return filters
+    
+    def _overview_partials(
+        self,
+        dataset_name: str,
+        by: List[str],
+        filters: Dict[str, Any],
+        resolution: float,
+        depth_bins: Union[float, List[float]],
+        time_bucket: str
+    ) -> Optional[List[pa.Table]]:
+        """
+        Partial statistics of an aggregate from the dataset's overviews, or
+        None if it has none that answer the aggregate exactly.
+        """
+        paths = self._overview_paths(dataset_name)
+        levels = overviews.read_levels(paths) if paths else None
+        if not levels:
+            return None
+        
+        # Overviews are written with the statistics, and are stale if those are
+        stats = self._read_stats(dataset_name)
+        if stats is None:
+            return None
+        extents = stats['extents']
+        level = overviews.select_level(
+            levels, by, filters, extents, resolution, depth_bins, time_bucket
+        )
+        if level is None:
+            return None
+        
+        table = overviews.read_overview(paths, level, filters, extents)
+        return [
+            binning.rebin_partials(batch, by, resolution, depth_bins, time_bucket)
+            for batch in table.to_batches()
+        ]
+    
+    def _load_table(
+        self,
+        dataset_name: str,
+        columns: Optional[List[str]],
+        filters: Dict[str, Any],
+        profiler: Optional[StageProfiler] = None
+    ) -> pa.Table:
+        """Load a query through the cache, see load_dataset."""
+        version = self._dataset_version(dataset_name)
+        table_key = ('table', dataset_name, None if columns is None else tuple(columns))
+        
+        if not any(filters.values()):
+            key = table_key
+        else:
+            key = ('query', dataset_name, self._query_key(columns=columns, **filters))
+        
+        table = self._cache.get(key, version)
+        if table is not None:
+            self._count(profiler, 'cache_hits')
+            return table
+        
+        if key != table_key:
+            with stage(profiler, 'filter_cached'):
+                table = self._filter_cached_table(dataset_name, version, columns, filters)
+        if table is not None:
+            self._count(profiler, 'cache_filtered')
+        else:
+            self._count(profiler, 'cache_misses')
+            table = self._read_table(dataset_name, columns, filters, profiler)
+        self._cache.put(key, version, table)
+        
+        return table
+    
+    def _finish_query(
+        self,
+        profiler: StageProfiler,
+        table: pa.Table,
+        output: str,
+        datasets: List[str]
+    ) -> Union[pd.DataFrame, pa.Table, Any]:
+        """Convert a query result and report the query."""
+        with profiler.stage('convert') as counts:
+            result = self._convert_output(table, output)
+            counts['rows'] = table.num_rows
+        
+        profiler.count('rows_returned', table.num_rows)
+        report = profiler.stop()
+        report['datasets'] = datasets
+        self.last_query_report = report
+        
+        return result
+    
+    @staticmethod
+    def _count(profiler: Optional[StageProfiler], name: str, value: int = 1) -> None:
+        if profiler is not None:
+            profiler.count(name, value)
+    
+    def cache_info(self) -> Dict[str, Any]:
+        """
+        Statistics of the query cache.
+        
+        Returns:
+            Dictionary with hit/miss/eviction/invalidation counters, the
+            number of entries and the cached and maximum bytes
+        """
+        return self._cache.info()
+    
+    def clear_cache(self) -> None:
+        """Drop all cached tables and opened datasets."""
+        self._cache.clear()
+        self._datasets.clear()
     
     def list_datasets(self) -> List[str]:
         """List available datasets in the data directory."""
         return [
             p.stem for p in self.data_dir.glob("*.parquet")
+            if not p.name.startswith('_')
         ]
     
     def get_dataset_info(self, dataset_name: str) -> Dict[str, Any]:
         """
         Get metadata about a dataset.
         
+        The statistics written alongside the dataset are used when present,
+        from the catalog if it is current, so no data is read. Otherwise
+        extents are taken from the parquet row-group statistics and only the
+        variable, unit and source columns are scanned.
+        
         Args:
             dataset_name: Name of the dataset
         
         Returns:
             Dictionary containing dataset metadata
         """
-        dataset_path = self.data_dir / f"{dataset_name}.parquet"
-        
-        if not dataset_path.exists():
-            raise FileNotFoundError(f"Dataset {dataset_name} not found")
+        stats = self._read_stats(dataset_name)
+        if stats is None:
+            stats = self._stats_from_metadata(self._open_dataset(dataset_name))
         
-        # Read a small sample to get metadata
-        df = pd.read_parquet(dataset_path)
+        extents = stats['extents']
+        time_min, time_max = extents['timestamp']
         
         return {
-            'variables': df['variable'].unique().tolist(),
-            'time_range': (df['timestamp'].min(), df['timestamp'].max()),
+            'variables': list(stats['variables']),
+            'time_range': (pd.Timestamp(time_min), pd.Timestamp(time_max)),
             'spatial_coverage': {
-                'min_lat': df['latitude'].min(),
-                'max_lat': df['latitude'].max(),
-                'min_lon': df['longitude'].min(),
-                'max_lon': df['longitude'].max(),
+                'min_lat': extents['latitude'][0],
+                'max_lat': extents['latitude'][1],
+                'min_lon': extents['longitude'][0],
+                'max_lon': extents['longitude'][1],
+            },
+            'depth_range': tuple(extents['depth']),
+            'n_observations': stats['n_observations'],
+            'sources': stats['sources'],
+            'variable_counts': {
+                variable: entry['count'] for variable, entry in stats['variables'].items()
             },
-            'depth_range': (df['depth'].min(), df['depth'].max()),
-            'n_observations': len(df),
-            'sources': df['source'].unique().tolist()
+            'units': {
+                variable: entry['units'] for variable, entry in stats['variables'].items()
+            }
         }
     
-    def _apply_filters(
+    def _dataset_path(self, dataset_name: str) -> Path:
+        """Resolve the path of a dataset, raising if it does not exist."""
+        dataset_path = self.data_dir / f"{dataset_name}.parquet"
+        
+        if not dataset_path.exists():
+            raise FileNotFoundError(f"Dataset {dataset_name} not found at {dataset_path}")
+        
+        return dataset_path
+    
+    def _stream_query(
         self,
-        df: pd.DataFrame,
+        datasets: List[str],
+        projections: List[List[str]],
+        filters: Dict[str, Any],
+        schema: pa.Schema
+    ) -> Iterator[pa.RecordBatch]:
+        """Yield the batches of a multi-dataset query, one dataset after the other."""
+        for name, projection in zip(datasets, projections):
+            for batch in self.iter_batches(name, columns=projection, **filters):
+                table = self._tag_table(pa.Table.from_batches([batch]), name, schema)
+                yield from table.to_batches()
+    
+    @staticmethod
+    def _prefetch(func, items, prefetch: int) -> Iterator[Any]:
+        """
+        Map func over items in order, computing up to prefetch results
+        ahead of the consumer on a thread pool.
+        """
+        if prefetch <= 0:
+            for item in items:
+                yield func(item)
+            return
+        
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+    
+    @staticmethod
+    def _unify_schemas(schemas: List[pa.Schema], columns: Optional[List[str]] = None) -> pa.Schema:
+        """
+        Common schema of the results of several datasets.
+        
+        CrocoLake columns get their canonical type, other columns are
+        promoted to a type holding all of their variants. The columns are
+        in the requested or canonical order, followed by the dataset tag.
+        """
+        canonical = arrow_schema()
+        fields = {}
+        for schema in schemas:
+            for field in schema:
+                if field.name in canonical.names:
+                    fields[field.name] = canonical.field(field.name)
+                elif field.name in fields and fields[field.name].type != field.type:
+                    fields[field.name] = pa.unify_schemas(
+                        [pa.schema([fields[field.name]]), pa.schema([field])],
+                        promote_options='permissive'
+                    ).field(field.name)
+                else:
+                    fields.setdefault(field.name, field)
+        
+        if columns:
+            names = [col for col in columns if col in fields]
+        else:
+            names = [col for col in COLUMNS if col in fields]
+            names += [col for col in fields if col not in COLUMNS]
+        
+        return pa.schema(
+            [fields[name] for name in names] + [pa.field(DATASET_COLUMN, CATEGORICAL_TYPE)]
+        )
+    
+    @staticmethod
+    def _tag_table(table: pa.Table, dataset_name: str, schema: pa.Schema) -> pa.Table:
+        """Cast a dataset's result to the common schema and add its dataset tag."""
+        arrays = []
+        for field in schema:
+            if field.name == DATASET_COLUMN:
+                array = pa.DictionaryArray.from_arrays(
+                    pa.array([0] * table.num_rows, type=pa.int32()),
+                    pa.array([dataset_name])
+                )
+            elif field.name in table.column_names:
+                array = table.column(field.name).cast(field.type)
+            else:
+                array = pa.nulls(table.num_rows, type=field.type)
+            arrays.append(array)
+        
+        return pa.Table.from_arrays(arrays, schema=schema)
+    
+    @staticmethod
+    def _check_output(output: str) -> None:
+        """Raise if output is not a supported return type."""
+        if output not in OUTPUTS:
+            raise ValueError(f"Unsupported output {output!r}, expected one of {OUTPUTS}")
+    
+    @staticmethod
+    def _convert_output(table: pa.Table, output: str) -> Union[pd.DataFrame, pa.Table, Any]:
+        """Convert a result table to the requested output type."""
+        if output == 'arrow':
+            return table
+        
+        if output == 'polars':
+            try:
+                import polars as pl
+            except ImportError as e:
+                raise ImportError("output='polars' requires the polars package") from e
+            return pl.from_arrow(table)
+        
+        if output == 'pandas_arrow':
+            # Dictionary-encode the strings so they become categoricals
+            for i, field in enumerate(table.schema):
+                if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                    table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+            return table.to_pandas(
+                types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t)
+            )
+        
+        return table.to_pandas()
+    
+    def _read_table(
+        self,
+        dataset_name: str,
+        columns: Optional[List[str]],
+        filters: Dict[str, Any],
+        profiler: Optional[StageProfiler] = None
+    ) -> pa.Table:
+        """Read a query from disk, pushing the filters down to the reader."""
+        with stage(profiler, 'plan'):
+            dataset, index = self._open_indexed(dataset_name)
+            expression = self._build_filter(dataset.schema, **filters)
+            n_files = len(dataset.files)
+            
+            # Only scan the files and row groups that survive the statistics check
+            if expression is not None:
+                dataset = self._prune_files(dataset, index, filters)
+                dataset = self._prune_row_groups(dataset, expression)
+            
+            if columns is None:
+                columns = self._default_columns(dataset.schema)
+            
+            if profiler is not None:
+                self._count_scan(profiler, dataset, n_files, columns, filters)
+        
+        with stage(profiler, 'scan') as counts:
+            table = dataset.to_table(columns=columns, filter=expression)
+            counts['rows'] = table.num_rows
+            counts['bytes'] = table.nbytes
+        
+        return table
+    
+    @staticmethod
+    def _count_scan(
+        profiler: StageProfiler,
+        dataset: ds.FileSystemDataset,
+        n_files: int,
+        columns: List[str],
+        filters: Dict[str, Any]
+    ) -> None:
+        """
+        Count the files and row groups a scan reads or skips, and the
+        compressed bytes of the column chunks it reads.
+        """
+        read_columns = set(columns)
+        if filters['variables']:
+            read_columns.add('variable')
+        if filters['time_range']:
+            read_columns.add('timestamp')
+        if filters['bbox']:
+            read_columns.update(['latitude', 'longitude', CELL_COLUMN])
+        if filters['depth_range']:
+            read_columns.add('depth')
+        
+        files = {}
+        row_groups = rows = nbytes = 0
+        for fragment in dataset.get_fragments():
+            metadata = fragment.metadata
+            files[fragment.path] = metadata.num_row_groups
+            for row_group in fragment.row_groups:
+                chunk = metadata.row_group(row_group.id)
+                row_groups += 1
+                rows += chunk.num_rows
+                nbytes += sum(
+                    chunk.column(i).total_compressed_size
+                    for i in range(chunk.num_columns)
+                    if chunk.column(i).path_in_schema in read_columns
+                )
+        
+        profiler.count('files_scanned', len(files))
+        profiler.count('files_skipped', n_files - len(files))
+        profiler.count('row_groups_scanned', row_groups)
+        profiler.count('row_groups_skipped', sum(files.values()) - row_groups)
+        profiler.count('rows_scanned', rows)
+        profiler.count('bytes_read', nbytes)
+    
+    def _filter_cached_table(
+        self,
+        dataset_name: str,
+        version: Tuple,
+        columns: Optional[List[str]],
+        filters: Dict[str, Any]
+    ) -> Optional[pa.Table]:
+        """
+        Answer a filtered query from a cached unfiltered table, if one holds
+        all the columns the query returns and filters on.
+        """
+        needed = set(columns or [])
+        if filters['variables']:
+            needed.add('variable')
+        if filters['time_range']:
+            needed.add('timestamp')
+        if filters['bbox']:
+            needed.update(['latitude', 'longitude'])
+        if filters['depth_range']:
+            needed.add('depth')
+        
+        for table_columns in (None if columns is None else tuple(columns), None):
+            table = self._cache.get(('table', dataset_name, table_columns), version, count=False)
+            if table is not None and needed.issubset(table.column_names):
+                expression = self._build_filter(table.schema, **filters)
+                return ds.dataset(table).to_table(
+                    columns=table.column_names if columns is None else columns, filter=expression
+                )
+        
+        return None
+    
+    @staticmethod
+    def _query_key(
+        columns: Optional[List[str]] = None,
         variables: Optional[List[str]] = None,
         time_range: Optional[tuple] = None,
         bbox: Optional[Dict[str, float]] = None,
         depth_range: Optional[tuple] = None
-    ) -> pd.DataFrame:
-        """Apply filters to the DataFrame."""
+    ) -> Tuple:
+        """Normalize the query arguments into a hashable cache key."""
+        return (
+            None if columns is None else tuple(columns),
+            tuple(sorted(set(variables))) if variables else None,
+            tuple(pd.Timestamp(t).isoformat() for t in time_range) if time_range else None,
+            tuple(float(bbox[k]) for k in ('min_lat', 'max_lat', 'min_lon', 'max_lon'))
+            if bbox else None,
+            tuple(float(d) for d in depth_range) if depth_range else None
+        )
+    
+    def _dataset_version(self, dataset_name: str) -> Tuple:
+        """Token that changes whenever a dataset is rewritten, see crocolake.catalog."""
+        return dataset_version(self._dataset_path(dataset_name))
+    
+    def _catalog_entry(self, dataset_name: str, version: Optional[Tuple] = None) -> Optional[Dict[str, Any]]:
+        """
+        Catalog entry of a dataset, if the catalog describes its current
+        version. The catalog is only re-read when its file changes.
+        """
+        path = self.data_dir / CATALOG_NAME
+        mtime = path.stat().st_mtime_ns if path.exists() else None
+        if mtime != self._catalog_mtime:
+            self._catalog = DatasetCatalog.load(self.data_dir) if mtime else None
+            self._catalog_mtime = mtime
+        
+        catalog = self._catalog
+        if catalog is None:
+            return None
+        return catalog.entry(dataset_name, version or self._dataset_version(dataset_name))
+    
+    def _overview_paths(self, dataset_name: str) -> List[Path]:
+        """Overview sidecars of a dataset."""
+        dataset_path = self._dataset_path(dataset_name)
+        
+        if dataset_path.is_dir():
+            return sorted(dataset_path.glob(f"_*{overviews.OVERVIEW_SUFFIX}"))
+        path = overviews.overview_path(dataset_path)
+        return [path] if path.exists() else []
+    
+    def _read_stats(self, dataset_name: str) -> Optional[Dict[str, Any]]:
+        """Merged statistics sidecars of a dataset, if any, from the catalog if current."""
+        entry = self._catalog_entry(dataset_name)
+        if entry is not None:
+            return entry['stats']
+        dataset_path = self._dataset_path(dataset_name)
+        return dataset_stats(dataset_path, compaction.hidden_files(dataset_path))
+    
+    @staticmethod
+    def _stats_from_metadata(dataset: ds.FileSystemDataset) -> Dict[str, Any]:
+        """Derive dataset statistics from parquet footers and the label columns."""
+        labels = dataset.to_table(columns=['variable', 'unit', 'source']).to_pandas()
+        
+        stats = [compute_stats(labels)]
+        stats.extend(metadata_stats(fragment.metadata) for fragment in dataset.get_fragments())
+        
+        return merge_stats(stats)
+    
+    def _open_dataset(self, dataset_name: str) -> ds.FileSystemDataset:
+        """
+        Open a dataset as a pyarrow dataset without reading any data.
+        
+        Both single parquet files and hive-partitioned directories are
+        supported; partition keys are exposed as regular columns, string
+        keys dictionary-encoded like the categorical columns in the files.
+        Files are memory-mapped, so uncompressed column chunks are not copied.
+        Files hidden by an ongoing or recent compaction are skipped.
+        
+        Directories with a current catalog entry are opened from their
+        file index, without listing their files. Opened datasets are kept
+        until the dataset changes, so the footers read while planning a
+        query are parsed only once.
+        """
+        return self._open_indexed(dataset_name)[0]
+    
+    def _open_indexed(self, dataset_name: str) -> Tuple[ds.FileSystemDataset, Optional[pa.Table]]:
+        """Open a dataset like _open_dataset, with its file index if current."""
+        dataset_path = self._dataset_path(dataset_name).resolve()
+        version = self._dataset_version(dataset_name)
+        cached = self._datasets.get(dataset_name)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        
+        filesystem = pafs.LocalFileSystem(use_mmap=True)
+        entry = self._catalog_entry(dataset_name, version)
+        if entry is not None and entry['index']:
+            dataset, index = open_index(dataset_path, filesystem)
+        else:
+            index = None
+            dataset = self._discover_dataset(dataset_path, dict(
+                partitioning=ds.HivePartitioning.discover(infer_dictionary=True),
+                filesystem=filesystem
+            ))
+        
+        dataset = self._order_partition_keys(dataset)
+        self._datasets[dataset_name] = (version, dataset, index)
+        return dataset, index
+    
+    @staticmethod
+    def _order_partition_keys(dataset: ds.FileSystemDataset) -> ds.FileSystemDataset:
+        """
+        Move partition keys that are data columns back to their canonical place.
+        
+        Discovery appends partition keys after the file columns, so 'variable'
+        of a partitioned dataset would otherwise come last. Flat files keep
+        their own column order.
+        """
+        fragment = next(iter(dataset.get_fragments()), None)
+        if fragment is None:
+            return dataset
+        keys = [
+            name for name in ds.get_partition_keys(fragment.partition_expression)
+            if name in COLUMNS
+        ]
+        if not keys:
+            return dataset
+        
+        fields = [field for field in dataset.schema if field.name not in keys]
+        for key in sorted(keys, key=COLUMNS.index):
+            rank = COLUMNS.index(key)
+            position = next(
+                (i for i, field in enumerate(fields)
+                 if field.name in COLUMNS and COLUMNS.index(field.name) > rank),
+                None
+            )
+            if position is None:
+                position = max(
+                    (i + 1 for i, field in enumerate(fields) if field.name in COLUMNS),
+                    default=0
+                )
+            fields.insert(position, dataset.schema.field(key))
+        return dataset.replace_schema(pa.schema(fields, metadata=dataset.schema.metadata))
+    
+    @staticmethod
+    def _discover_dataset(dataset_path: Path, options: Dict[str, Any]) -> ds.FileSystemDataset:
+        """Open a dataset by listing its files."""
+        # The log is read before listing the files: a compaction committing
+        # in between only hides files that are still on disk
+        hidden = compaction.hidden_files(dataset_path) if dataset_path.is_dir() else set()
+        dataset = ds.dataset(str(dataset_path), format='parquet', **options)
+        if not hidden:
+            return dataset
+        
+        files = [
+            path for path in dataset.files
+            if Path(path).relative_to(dataset_path).as_posix() not in hidden
+        ]
+        return ds.dataset(files, format='parquet', partition_base_dir=str(dataset_path), **options)
+    
+    @staticmethod
+    def _default_columns(schema: pa.Schema) -> List[str]:
+        """Schema columns in file order, without partitioning helpers."""
+        return [col for col in schema.names if col not in DERIVED_COLUMNS]
+    
+    def _build_filter(
+        self,
+        schema: pa.Schema,
+        variables: Optional[List[str]] = None,
+        time_range: Optional[tuple] = None,
+        bbox: Optional[Dict[str, float]] = None,
+        depth_range: Optional[tuple] = None
+    ) -> Optional[ds.Expression]:
+        """
+        Translate the query arguments into a pyarrow filter expression.
+        
+        Returns:
+            Combined expression, or None if no filter was requested
+        """
+        conditions = []
+        
         if variables:
-            df = df[df['variable'].isin(variables)]
+            conditions.append(ds.field('variable').isin(list(variables)))
         
         if time_range:
             start_time, end_time = time_range
-            df = df[
-                (df['timestamp'] >= start_time) &
-                (df['timestamp'] <= end_time)
-            ]
+            timestamp_type = schema.field('timestamp').type
+            conditions.append(
+                (ds.field('timestamp') >= self._timestamp_scalar(start_time, timestamp_type)) &
+                (ds.field('timestamp') <= self._timestamp_scalar(end_time, timestamp_type))
+            )
+            if 'year' in schema.names:
+                conditions.append(self._time_partition_filter(schema, start_time, end_time))
         
         if bbox:
-            df = df[
-                (df['latitude'] >= bbox['min_lat']) &
-                (df['latitude'] <= bbox['max_lat']) &
-                (df['longitude'] >= bbox['min_lon']) &
-                (df['longitude'] <= bbox['max_lon'])
-            ]
+            conditions.append(self._bbox_filter(schema, bbox))
         
         if depth_range:
             min_depth, max_depth = depth_range
-            df = df[
-                (df['depth'] >= min_depth) &
-                (df['depth'] <= max_depth)
+            conditions.append(
+                (ds.field('depth') >= min_depth) &
+                (ds.field('depth') <= max_depth)
+            )
+        
+        if not conditions:
+            return None
+        
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+        
+        return expression
+    
+    @staticmethod
+    def _bbox_filter(schema: pa.Schema, bbox: Dict[str, float]) -> ds.Expression:
+        """
+        Filter on a bounding box, possibly crossing the antimeridian.
+        
+        If the dataset has a spatial cell column, the cell ranges covering
+        the box are added so that row groups of other cells are skipped.
+        """
+        expression = (
+            (ds.field('latitude') >= bbox['min_lat']) &
+            (ds.field('latitude') <= bbox['max_lat'])
+        )
+        
+        east_of_min = ds.field('longitude') >= bbox['min_lon']
+        west_of_max = ds.field('longitude') <= bbox['max_lon']
+        if bbox['min_lon'] <= bbox['max_lon']:
+            expression = expression & east_of_min & west_of_max
+        else:
+            expression = expression & (east_of_min | west_of_max)
+        
+        metadata = schema.metadata or {}
+        if CELL_COLUMN in schema.names and CELL_RESOLUTION_KEY in metadata:
+            resolution = float(metadata[CELL_RESOLUTION_KEY])
+            cell = ds.field(CELL_COLUMN)
+            ranges = [
+                (cell >= first) & (cell <= last)
+                for first, last in cover_bbox(bbox, resolution)
             ]
+            # An empty box (min_lat > max_lat) is covered by no cell
+            cell_expression = ranges[0] if ranges else ds.scalar(False)
+            for condition in ranges[1:]:
+                cell_expression = cell_expression | condition
+            expression = expression & cell_expression
+        
+        return expression
+    
+    @staticmethod
+    def _time_partition_filter(schema: pa.Schema, start_time: Any, end_time: Any) -> ds.Expression:
+        """
+        Filter on the year/month partition keys matching a time range.
+        
+        The condition is implied by the timestamp filter, but lets whole
+        partitions be skipped without opening their files.
+        """
+        start, end = pd.Timestamp(start_time), pd.Timestamp(end_time)
+        year = ds.field('year')
+        
+        if 'month' not in schema.names:
+            return (year >= start.year) & (year <= end.year)
+        
+        month = ds.field('month')
+        after_start = (year > start.year) | ((year == start.year) & (month >= start.month))
+        before_end = (year < end.year) | ((year == end.year) & (month <= end.month))
+        return after_start & before_end
+    
+    @staticmethod
+    def _timestamp_scalar(value: Any, timestamp_type: pa.DataType) -> pa.Scalar:
+        """Convert a user supplied time bound to the dataset's timestamp type."""
+        return pa.scalar(pd.Timestamp(value)).cast(timestamp_type, safe=False)
+    
+    @staticmethod
+    def _prune_files(
+        dataset: ds.FileSystemDataset,
+        index: Optional[pa.Table],
+        filters: Dict[str, Any]
+    ) -> ds.FileSystemDataset:
+        """
+        Drop the files whose value ranges in the file index cannot satisfy
+        the filters, without opening them.
+        
+        Returns:
+            Dataset restricted to the candidate files
+        """
+        if index is None:
+            return dataset
+        
+        keep = candidate_files(
+            index,
+            time_range=filters.get('time_range'),
+            bbox=filters.get('bbox'),
+            depth_range=filters.get('depth_range')
+        )
+        if keep.all():
+            return dataset
+        
+        fragments = [
+            fragment for fragment, candidate in zip(dataset.get_fragments(), keep) if candidate
+        ]
+        return ds.FileSystemDataset(
+            fragments, dataset.schema, dataset.format, dataset.filesystem
+        )
+    
+    @staticmethod
+    def _prune_row_groups(
+        dataset: ds.FileSystemDataset,
+        expression: Optional[ds.Expression]
+    ) -> ds.FileSystemDataset:
+        """
+        Drop row groups whose parquet min/max statistics cannot satisfy the filter.
+        
+        Returns:
+            Dataset of one fragment per candidate row group; without an
+            expression, every row group is a candidate
+        """
+        fragments = [
+            row_group
+            for fragment in dataset.get_fragments(filter=expression)
+            for row_group in fragment.split_by_row_group(expression, schema=dataset.schema)
+        ]
         
-        return df 
\ No newline at end of file
+        return ds.FileSystemDataset(
+            fragments, dataset.schema, dataset.format, dataset.filesystem
+        )
\ No newline at end of file
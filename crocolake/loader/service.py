@@ -0,0 +1,282 @@
+"""
+CrocoLake query service
+
+Several clients (assimilation jobs, notebooks, the explorer) can share one
+DataLoader through a QueryService: requests run concurrently on a worker
+pool, share the loader's query cache and opened datasets, and identical
+requests arriving while one is running wait for its result instead of
+reading the data again.
+
+The service is used in-process, from threads or asyncio, or over HTTP on
+localhost, with results streamed back as Arrow IPC:
+
+    crocolake-serve data/processed --port 8750
+
+    table = fetch('http://127.0.0.1:8750', 'load_dataset',
+                  dataset_name='argo', variables=['temp'])
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+import pyarrow as pa
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any
+
+from .data_loader import DataLoader, DEFAULT_BATCH_SIZE
+from .cache import DEFAULT_CACHE_BYTES
+
+# Loader methods a service runs
+METHODS = ('load_dataset', 'query', 'aggregate')
+
+# Number of requests run at once
+DEFAULT_WORKERS = 4
+
+# Port of the HTTP server
+DEFAULT_PORT = 8750
+
+# Media type of Arrow IPC streams
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+
+class QueryService:
+    """
+    Run DataLoader requests concurrently on a worker pool.
+    
+    Results are always pyarrow Tables; a result shared by coalesced requests
+    is the same immutable table. The loader's last_query_report holds the
+    report of whichever request finished last.
+    """
+    
+    def __init__(self, loader: DataLoader, max_workers: int = DEFAULT_WORKERS):
+        """
+        Initialize the service.
+        
+        Args:
+            loader: Loader whose cache and opened datasets all requests share
+            max_workers: Number of requests run at once
+        """
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        
+        self.loader = loader
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='crocolake-query')
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'errors': 0
+        }
+    
+    def submit(self, method: str, **params: Any) -> Future:
+        """
+        Schedule a request.
+        
+        A request identical to one still running (same method and
+        parameters) gets the future of that one.
+        
+        Args:
+            method: One of METHODS
+            params: Keyword arguments of the loader method; output is
+                always 'arrow' and query cannot stream
+        
+        Returns:
+            Future of the result table
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unsupported method {method!r}, expected one of {METHODS}")
+        if params.get('output', 'arrow') != 'arrow' or params.get('stream'):
+            raise ValueError("The query service only returns Arrow tables")
+        
+        key = request_key(method, params)
+        with self._lock:
+            self._counters['requests'] += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._counters['coalesced'] += 1
+                return future
+            
+            future = self._executor.submit(self._run, method, params)
+            self._in_flight[key] = future
+            self._counters['executed'] += 1
+        
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+    
+    def run(self, method: str, **params: Any) -> pa.Table:
+        """Run a request and wait for its result, see submit."""
+        return self.submit(method, **params).result()
+    
+    async def run_async(self, method: str, **params: Any) -> pa.Table:
+        """Run a request without blocking the event loop, see submit."""
+        return await asyncio.wrap_future(self.submit(method, **params))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Request counters, the number of requests running and the cache counters."""
+        with self._lock:
+            return {
+                **self._counters,
+                'in_flight': len(self._in_flight),
+                'cache': self.loader.cache_info()
+            }
+    
+    def close(self) -> None:
+        """Wait for the running requests and stop the workers."""
+        self._executor.shutdown(wait=True)
+    
+    def __enter__(self) -> 'QueryService':
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+    
+    def _run(self, method: str, params: Dict[str, Any]) -> pa.Table:
+        if method == 'aggregate':
+            return pa.Table.from_pandas(self.loader.aggregate(**params), preserve_index=False)
+        return getattr(self.loader, method)(**{**params, 'output': 'arrow'})
+    
+    def _finish(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            if future.exception() is not None:
+                self._counters['errors'] += 1
+
+def request_key(method: str, params: Dict[str, Any]) -> str:
+    """Key identifying identical requests; tuples and lists compare equal."""
+    return json.dumps({'method': method, 'params': params}, sort_keys=True, default=str)
+
+def serve(service: QueryService, host: str = '127.0.0.1',
+          port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    HTTP server of a service, started with serve_forever.
+    
+    POST /<method> with the JSON parameters as body returns the result as
+    an Arrow IPC stream; GET /datasets and GET /stats return JSON. Errors
+    are returned as JSON {'error': message}, with status 404 for missing
+    datasets and 400 for invalid requests.
+    
+    Args:
+        service: Service running the requests
+        host: Interface to listen on; the default only accepts local clients
+        port: Port to listen on; 0 picks a free one (see server_address)
+    """
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+def fetch(url: str, method: str, timeout: Optional[float] = None, **params: Any) -> pa.Table:
+    """
+    Run a request on a service over HTTP.
+    
+    Args:
+        url: Base URL of the server, e.g. 'http://127.0.0.1:8750'
+        method: One of METHODS
+        timeout: Optional timeout in seconds
+        params: Keyword arguments of the loader method
+    
+    Returns:
+        The result table
+    """
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/{method}",
+        data=json.dumps(params, default=str).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as error:
+        message = json.loads(error.read() or b'{}').get('error', str(error))
+        if error.code == 404:
+            raise FileNotFoundError(message) from error
+        raise ValueError(message) from error
+    
+    with response:
+        return pa.ipc.open_stream(response).read_all()
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Requests of the server created by serve."""
+    
+    def do_GET(self) -> None:
+        service = self.server.service
+        if self.path == '/datasets':
+            self._send_json(200, sorted(service.loader.list_datasets()))
+        elif self.path == '/stats':
+            self._send_json(200, service.stats())
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+    
+    def do_POST(self) -> None:
+        method = self.path.strip('/')
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(params, dict):
+                raise ValueError("The request body must be a JSON object")
+            table = self.server.service.run(method, **params)
+        except FileNotFoundError as error:
+            self._send_json(404, {'error': str(error)})
+            return
+        except (ValueError, TypeError, KeyError) as error:
+            self._send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            self._send_json(500, {'error': f"{type(error).__name__}: {error}"})
+            return
+        
+        # The stream is written batch by batch and ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', ARROW_STREAM_TYPE)
+        self.end_headers()
+        with pa.ipc.new_stream(self.wfile, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=DEFAULT_BATCH_SIZE):
+                writer.write_batch(batch)
+    
+    def log_message(self, format: str, *args: Any) -> None:
+        # Requests are reported by the loader's hooks, not on stderr
+        pass
+    
+    def _send_json(self, status: int, body: Any) -> None:
+        content = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point serving a data directory."""
+    parser = argparse.ArgumentParser(
+        description="Serve CrocoLake queries on a data directory over HTTP."
+    )
+    parser.add_argument('data_dir', help="Data directory")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="Number of requests run at once")
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_CACHE_BYTES / 2**20,
+                        help="Memory budget of the query cache in MiB")
+    args = parser.parse_args(argv)
+    
+    loader = DataLoader(args.data_dir, cache_bytes=int(args.cache_mb * 2**20))
+    with QueryService(loader, max_workers=args.workers) as service:
+        server = serve(service, args.host, args.port)
+        print(f"Serving {args.data_dir} on http://{args.host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
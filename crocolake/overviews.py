@@ -0,0 +1,278 @@
+"""
+CrocoLake overview pyramids
+
+Overviews are binned partial statistics (sum, min, max and count of the
+value per variable, time bucket, depth bin and lat/lon cell) computed when
+a dataset is written, at a few increasingly coarse levels. They are stored
+in a parquet sidecar next to the data, so that aggregates over large
+datasets can be answered from a few thousand rows instead of a full scan.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Sequence, Union
+
+from .loader import aggregate as binning
+
+# Suffix of overview sidecar files; like the statistics sidecars, the name
+# always starts with an underscore
+OVERVIEW_SUFFIX = '.overviews.parquet'
+
+# Schema metadata key storing the levels of an overview file as JSON
+OVERVIEW_LEVELS_KEY = b'crocolake.overview_levels'
+
+# Bins of each level, from finest to coarsest
+DEFAULT_LEVELS = [
+    {'resolution': 1.0, 'time_bucket': 'day', 'depth_bins': 10.0},
+    {'resolution': 5.0, 'time_bucket': 'month', 'depth_bins': 100.0}
+]
+
+# Group keys of every overview level
+OVERVIEW_BY = ['variable', 'time', 'depth', 'cell']
+
+# Number of chunk partials merged at once while building
+MERGE_PARTIALS = 32
+
+class OverviewBuilder:
+    """
+    Accumulate the overview levels of a dataset chunk by chunk.
+    """
+    
+    def __init__(self, levels: Optional[List[Dict[str, Any]]] = None):
+        """
+        Initialize the builder.
+        
+        Args:
+            levels: Bins of each level, dicts with keys 'resolution' (cell
+                size in degrees), 'time_bucket' and 'depth_bins' (bin
+                width in meters); default: DEFAULT_LEVELS
+        """
+        self.levels = [dict(level) for level in (levels or DEFAULT_LEVELS)]
+        for level in self.levels:
+            if level['time_bucket'] not in binning.TIME_UNITS:
+                raise ValueError(f"Unsupported time bucket: {level['time_bucket']}")
+        self._keys = binning.key_names(OVERVIEW_BY)
+        self._partials = [[] for _ in self.levels]
+    
+    def add(self, data: pd.DataFrame) -> None:
+        """Add a chunk of CrocoLake-formatted data."""
+        columns = binning.source_columns(OVERVIEW_BY, 'value')
+        table = pa.Table.from_pandas(data[columns], preserve_index=False)
+        
+        for level, partials in zip(self.levels, self._partials):
+            for batch in table.to_batches():
+                binned = binning.bin_batch(
+                    batch, OVERVIEW_BY, 'value',
+                    level['resolution'], level['depth_bins'], level['time_bucket']
+                )
+                partials.append(binning.partial_stats(binned, self._keys))
+            if len(partials) >= MERGE_PARTIALS:
+                partials[:] = [binning.merge_partials(partials, self._keys)]
+    
+    def to_table(self) -> Optional[pa.Table]:
+        """
+        All levels in one table, with a 'level' column, or None if no
+        data was added.
+        """
+        tables = []
+        levels = []
+        for i, (level, partials) in enumerate(zip(self.levels, self._partials)):
+            if not partials:
+                continue
+            table = binning.merge_partials(partials, self._keys)
+            table = table.select(self._keys + ['sum', 'min', 'max', 'count'])
+            tables.append(table.append_column('level', pa.array([i] * table.num_rows, pa.int32())))
+            levels.append(dict(level, rows=table.num_rows))
+        
+        if not tables:
+            return None
+        
+        table = pa.concat_tables(tables)
+        return table.replace_schema_metadata({OVERVIEW_LEVELS_KEY: json.dumps(levels)})
+    
+    def write(self, path: str) -> None:
+        """Atomically write the overviews, if any data was added."""
+        table = self.to_table()
+        if table is None:
+            return
+        
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+def overview_path(data_path: str) -> Path:
+    """Path of the overview sidecar of a parquet file."""
+    data_path = Path(data_path)
+    return data_path.parent / f"_{data_path.stem}{OVERVIEW_SUFFIX}"
+
+def read_levels(paths: List[Path]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Levels shared by several overview files, with their total row counts.
+    
+    Returns:
+        List of levels, or None if the files were built with different levels
+    """
+    levels = None
+    for path in paths:
+        metadata = pq.read_schema(path).metadata or {}
+        file_levels = json.loads(metadata.get(OVERVIEW_LEVELS_KEY, b'[]'))
+        if levels is None:
+            levels = file_levels
+            continue
+        
+        if [_bins(level) for level in file_levels] != [_bins(level) for level in levels]:
+            return None
+        for level, file_level in zip(levels, file_levels):
+            level['rows'] += file_level['rows']
+    
+    return levels
+
+def select_level(levels: List[Dict[str, Any]], by: Sequence[str],
+                 filters: Dict[str, Any], extents: Dict[str, list],
+                 resolution: float, depth_bins: Union[float, Sequence[float]],
+                 time_bucket: str) -> Optional[int]:
+    """
+    Coarsest overview level that answers an aggregate exactly.
+    
+    A level qualifies if each requested bin is a union of its bins and
+    each filter bound either falls on one of its bin edges or lies outside
+    the dataset extents. Upper depth and bbox bounds are inclusive for raw
+    rows, so they only qualify outside the extents; the end of a time range
+    qualifies when it is a bucket edge minus up to one microsecond, as in
+    ranges ending at 23:59:59.999999.
+    
+    Args:
+        levels: Levels of the overviews, see read_levels
+        by, resolution, depth_bins, time_bucket: As in DataLoader.aggregate
+        filters: Dict with keys 'variables', 'time_range', 'bbox', 'depth_range'
+        extents: Extents of the dataset, from its statistics
+    
+    Returns:
+        Index of the level with the fewest rows among those qualifying, or None
+    """
+    if not set(by) <= set(OVERVIEW_BY):
+        return None
+    
+    candidates = [
+        i for i, level in enumerate(levels)
+        if _answers(level, by, filters, extents, resolution, depth_bins, time_bucket)
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda i: levels[i]['rows'])
+
+def read_overview(paths: List[Path], level: int, filters: Dict[str, Any],
+                  extents: Dict[str, list]) -> pa.Table:
+    """
+    Read the bins of one level inside the filters of a query.
+    
+    The filters must have been checked with select_level.
+    """
+    expression = pc.field('level') == level
+    
+    if filters.get('variables'):
+        expression &= pc.field('variable').isin(list(filters['variables']))
+    
+    if filters.get('time_range'):
+        start, end = [pd.Timestamp(value) for value in filters['time_range']]
+        if not _outside(start, extents.get('timestamp'), low=True):
+            expression &= pc.field('timestamp') >= pa.scalar(start.value, pa.timestamp('ns'))
+        if not _outside(end, extents.get('timestamp'), low=False):
+            expression &= pc.field('timestamp') <= pa.scalar(end.value, pa.timestamp('ns'))
+    
+    if filters.get('depth_range'):
+        low, _ = filters['depth_range']
+        if not _outside(low, extents.get('depth'), low=True):
+            expression &= pc.field('depth') >= low
+    
+    if filters.get('bbox'):
+        bbox = filters['bbox']
+        if not _outside(bbox['min_lat'], extents.get('latitude'), low=True):
+            expression &= pc.field('latitude') >= bbox['min_lat']
+        if not _outside(bbox['min_lon'], extents.get('longitude'), low=True):
+            expression &= pc.field('longitude') >= bbox['min_lon']
+    
+    return ds.dataset([str(path) for path in paths], format='parquet').to_table(filter=expression)
+
+def _answers(level: Dict[str, Any], by: Sequence[str], filters: Dict[str, Any],
+             extents: Dict[str, list], resolution: float,
+             depth_bins: Union[float, Sequence[float]], time_bucket: str) -> bool:
+    """Whether a level answers an aggregate exactly, see select_level."""
+    width = level['depth_bins']
+    
+    if 'cell' in by and not _multiple(resolution, level['resolution']):
+        return False
+    if 'depth' in by:
+        edges = [depth_bins] if np.isscalar(depth_bins) else depth_bins
+        if not all(_multiple(edge, width, allow_zero=not np.isscalar(depth_bins)) for edge in edges):
+            return False
+    if 'time' in by and not _nests(time_bucket, level['time_bucket']):
+        return False
+    
+    if filters.get('time_range'):
+        start, end = [pd.Timestamp(value) for value in filters['time_range']]
+        unit = level['time_bucket']
+        if not (_outside(start, extents.get('timestamp'), low=True) or _on_edge(start, unit)):
+            return False
+        if not (_outside(end, extents.get('timestamp'), low=False)
+                or _on_edge(end + pd.Timedelta(microseconds=1), unit)
+                or _on_edge(end + pd.Timedelta(nanoseconds=1), unit)):
+            return False
+    
+    if filters.get('depth_range'):
+        low, high = filters['depth_range']
+        if not (_outside(low, extents.get('depth'), low=True) or _multiple(low, width, allow_zero=True)):
+            return False
+        if not _outside(high, extents.get('depth'), low=False):
+            return False
+    
+    if filters.get('bbox'):
+        bbox = filters['bbox']
+        if bbox['min_lon'] > bbox['max_lon']:
+            return False
+        for key, origin, extent in (('lat', -90.0, 'latitude'), ('lon', -180.0, 'longitude')):
+            low, high = bbox[f'min_{key}'], bbox[f'max_{key}']
+            if not (_outside(low, extents.get(extent), low=True)
+                    or _multiple(low - origin, level['resolution'], allow_zero=True)):
+                return False
+            if not _outside(high, extents.get(extent), low=False):
+                return False
+    
+    return True
+
+def _bins(level: Dict[str, Any]) -> tuple:
+    return level['resolution'], level['time_bucket'], level['depth_bins']
+
+def _multiple(value: float, step: float, allow_zero: bool = False) -> bool:
+    """Whether value is a whole multiple of step."""
+    ratio = value / step
+    return abs(ratio - round(ratio)) < 1e-9 and (round(ratio) >= 1 or (allow_zero and round(ratio) >= 0))
+
+def _nests(bucket: str, level_bucket: str) -> bool:
+    """Whether every bucket of the level lies inside one requested bucket."""
+    units = binning.TIME_UNITS
+    if units.index(level_bucket) < units.index(bucket):
+        return False
+    # Weeks do not nest in months, quarters or years
+    return level_bucket != 'week' or bucket == 'week'
+
+def _on_edge(value: pd.Timestamp, unit: str) -> bool:
+    """Whether a timestamp is the start of a time bucket."""
+    array = pa.array([value.value], pa.timestamp('ns'))
+    return pc.floor_temporal(array, unit=unit).cast(pa.int64())[0].as_py() == value.value
+
+def _outside(value: Any, extent: Optional[list], low: bool) -> bool:
+    """Whether a lower (upper) bound lies below (above) the whole dataset."""
+    if not extent or extent[0] is None or extent[1] is None:
+        return False
+    if isinstance(extent[0], str):
+        value, extent = pd.Timestamp(value), [pd.Timestamp(bound) for bound in extent]
+    return value <= extent[0] if low else value >= extent[1]
@@ -0,0 +1,224 @@
+"""
+CrocoLake pipeline instrumentation
+
+A StageProfiler times the stages of a conversion or query, counts the rows
+and bytes they handle, tracks the Arrow memory they allocate, and reports
+them to hook callbacks and as a structured run report. It can optionally
+capture a cProfile profile or the traced Python memory of the stages and
+of the whole run.
+"""
+
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import pyarrow as pa
+from contextlib import contextmanager, nullcontext
+from typing import Optional, List, Dict, Any, Callable, Iterator, ContextManager, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Capture modes of a StageProfiler
+PROFILE_MODES = (None, 'cprofile', 'tracemalloc')
+
+# Number of functions / allocation sites listed in a captured profile
+PROFILE_TOP = 25
+
+# A hook is called with an event dict: {'event': 'stage', 'stage': name,
+# 'seconds': ..., 'rows': ..., 'bytes': ..., 'arrow_bytes': ...,
+# 'arrow_peak_bytes': ...} after each stage (see memory_usage), and
+# {'event': 'report', 'report': ...} at the end of a run
+Hook = Callable[[Dict[str, Any]], None]
+
+class StageProfiler:
+    """
+    Per-stage timings and counters of one conversion or query.
+    
+    Stages may run several times (e.g. once per chunk) and from several
+    threads; their times, calls, rows, bytes and net allocations are
+    summed, and their peak allocations are the largest of any call. The
+    allocations of stages running at the same time overlap.
+    """
+    
+    def __init__(self, hooks: Optional[List[Hook]] = None, mode: Optional[str] = None):
+        """
+        Initialize the profiler.
+        
+        Args:
+            hooks: Callbacks receiving an event after each stage and the
+                report at the end of the run
+            mode: Optional capture over the whole run:
+                'cprofile' - cProfile statistics of the slowest functions
+                'tracemalloc' - peak traced memory and top allocation sites
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode {mode!r}, expected one of {PROFILE_MODES}")
+        
+        self.hooks = list(hooks or [])
+        self.mode = mode
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._start = None
+        self._seconds = None
+        self._profile = None
+        self._capture = None
+        self._marks = None
+        self._memory: Dict[str, int] = {}
+    
+    def start(self) -> 'StageProfiler':
+        """Start the run, and the capture if any."""
+        self._start = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == 'tracemalloc':
+            tracemalloc.start()
+        self._marks = memory_marks()
+        return self
+    
+    def stop(self) -> Dict[str, Any]:
+        """End the run and send its report to the hooks."""
+        self._seconds = time.perf_counter() - self._start
+        self._memory = memory_usage(self._marks, memory_marks())
+        
+        if self.mode == 'cprofile':
+            self._profile.disable()
+            output = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=output)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            self._capture = {'cprofile': output.getvalue()}
+        elif self.mode == 'tracemalloc':
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._capture = {
+                'peak_traced_bytes': peak,
+                'top_allocations': [
+                    str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP]
+                ]
+            }
+        
+        report = self.report()
+        self._emit({'event': 'report', 'report': report})
+        return report
+    
+    def cancel(self) -> None:
+        """End a failed run without reporting it."""
+        if self.mode == 'cprofile' and self._profile is not None:
+            self._profile.disable()
+        elif self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, int]]:
+        """
+        Time a stage.
+        
+        Yields a dict in which the stage can record the 'rows' and 'bytes'
+        it handled.
+        """
+        counts = {'rows': 0, 'bytes': 0}
+        marks = memory_marks()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            usage = memory_usage(marks, memory_marks())
+            with self._lock:
+                entry = self.stages.setdefault(
+                    name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes': 0}
+                )
+                entry['seconds'] += seconds
+                entry['calls'] += 1
+                entry['rows'] += counts['rows']
+                entry['bytes'] += counts['bytes']
+                for key, value in usage.items():
+                    if key.endswith('_peak_bytes'):
+                        entry[key] = max(entry.get(key, 0), value)
+                    else:
+                        entry[key] = entry.get(key, 0) + value
+            self._emit({'event': 'stage', 'stage': name, 'seconds': seconds, **counts, **usage})
+    
+    def count(self, name: str, value: int = 1) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def report(self) -> Dict[str, Any]:
+        """
+        Structured report of the run.
+        
+        Returns:
+            Dictionary with the total 'seconds', the per-stage 'stages'
+            (seconds, calls, rows, bytes and the memory_usage keys), the
+            'counters', the memory_usage of the whole run, the process'
+            'max_rss_bytes' and, with a capture mode, the 'profile'
+        """
+        with self._lock:
+            report = {
+                'seconds': self._seconds,
+                'stages': {name: dict(entry) for name, entry in self.stages.items()},
+                'counters': dict(self.counters),
+                **self._memory,
+                'max_rss_bytes': max_rss_bytes()
+            }
+        if self._capture is not None:
+            report['profile'] = self._capture
+        return report
+    
+    def _emit(self, event: Dict[str, Any]) -> None:
+        for hook in self.hooks:
+            hook(event)
+
+def stage(profiler: Optional[StageProfiler], name: str) -> ContextManager[Dict[str, int]]:
+    """Time a stage with profiler, or do nothing if it is None."""
+    if profiler is None:
+        return nullcontext({'rows': 0, 'bytes': 0})
+    return profiler.stage(name)
+
+def memory_marks() -> Dict[str, Tuple[int, int]]:
+    """Current and peak allocated bytes of the Arrow pool and, while traced, of Python."""
+    pool = pa.default_memory_pool()
+    marks = {'arrow': (pool.bytes_allocated(), pool.max_memory())}
+    if tracemalloc.is_tracing():
+        marks['traced'] = tracemalloc.get_traced_memory()
+    return marks
+
+def memory_usage(start: Dict[str, Tuple[int, int]],
+                 end: Dict[str, Tuple[int, int]]) -> Dict[str, int]:
+    """
+    Allocations between two memory_marks.
+    
+    Peaks are high-water marks of the whole process and cannot be reset:
+    a span raising one reports it above the allocation at its start, a span
+    staying below an earlier peak reports the larger of its start and end.
+    
+    Returns:
+        '<source>_bytes' net and '<source>_peak_bytes' peak allocation for
+        the sources ('arrow', 'traced') present in both marks
+    """
+    usage = {}
+    for source, (current, peak) in start.items():
+        if source not in end:
+            continue
+        end_current, end_peak = end[source]
+        top = end_peak if end_peak > peak else max(current, end_current)
+        usage[f'{source}_bytes'] = end_current - current
+        usage[f'{source}_peak_bytes'] = top - current
+    return usage
+
+def max_rss_bytes() -> Optional[int]:
+    """Peak resident set size of the process so far, if available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,119 @@
+"""
+CrocoLake common schema
+"""
+
+import dataclasses
+import numpy as np
+import pyarrow as pa
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any
+
+# Columns of every CrocoLake dataset, in canonical order
+COLUMNS = [
+    'timestamp', 'latitude', 'longitude', 'depth',
+    'variable', 'value', 'unit', 'source'
+]
+
+# Helper columns written for partitioning and indexing; not part of the
+# user facing schema
+DERIVED_COLUMNS = ['year', 'month', 'cell']
+
+# String columns with few distinct values, stored dictionary-encoded
+CATEGORICAL_COLUMNS = ['variable', 'unit', 'source']
+
+# Arrow type of the categorical columns
+CATEGORICAL_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+def arrow_schema(value_dtype: str = 'float64', depth_dtype: str = 'float64') -> pa.Schema:
+    """
+    Arrow schema of CrocoLake datasets.
+    
+    Args:
+        value_dtype: NumPy dtype of the value column, e.g. 'float32'
+        depth_dtype: NumPy dtype of the depth column, e.g. 'float32'
+    
+    Returns:
+        Schema of the COLUMNS, with dictionary-encoded categorical columns
+    """
+    return pa.schema([
+        ('timestamp', pa.timestamp('ns')),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('depth', pa.from_numpy_dtype(np.dtype(depth_dtype))),
+        ('variable', CATEGORICAL_TYPE),
+        ('value', pa.from_numpy_dtype(np.dtype(value_dtype))),
+        ('unit', CATEGORICAL_TYPE),
+        ('source', CATEGORICAL_TYPE)
+    ])
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """
+    Expected type and values of a column.
+    
+    Attributes:
+        kind: 'datetime', 'float' or 'string'
+        nullable: Whether missing values are allowed
+        min: Optional smallest valid value (inclusive)
+        max: Optional largest valid value (inclusive)
+    """
+    kind: str
+    nullable: bool = False
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+def _default_columns() -> Dict[str, ColumnSpec]:
+    return {
+        'timestamp': ColumnSpec('datetime'),
+        'latitude': ColumnSpec('float', min=-90.0, max=90.0),
+        'longitude': ColumnSpec('float', min=-180.0, max=180.0),
+        # Positive downwards; a little above the surface for shipboard sensors
+        'depth': ColumnSpec('float', min=-10.0, max=11000.0),
+        'variable': ColumnSpec('string'),
+        'value': ColumnSpec('float'),
+        'unit': ColumnSpec('string'),
+        'source': ColumnSpec('string')
+    }
+
+@dataclass(frozen=True)
+class CrocoLakeSchema:
+    """
+    Declarative description of valid CrocoLake data, used to coerce and
+    validate converted data (see crocolake.validation).
+    
+    Attributes:
+        columns: Specification of each required column, by name
+        timestamp_format: strptime format of timestamps given as strings,
+            e.g. '%Y-%m-%d %H:%M:%S' or 'ISO8601'; None infers it
+        timezone: Timezone of timestamps without one, e.g. 'Europe/Paris';
+            None means UTC. Timestamps are stored as naive UTC
+    """
+    columns: Dict[str, ColumnSpec] = field(default_factory=_default_columns)
+    timestamp_format: Optional[str] = None
+    timezone: Optional[str] = None
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'CrocoLakeSchema':
+        """
+        Create a schema from a configuration dictionary.
+        
+        Args:
+            config: Optional keys 'timestamp_format', 'timezone' and
+                'ranges', a mapping of column to [min, max] replacing the
+                default ranges (None leaves a side open)
+        
+        Returns:
+            The default schema with the given settings
+        """
+        columns = _default_columns()
+        for name, (low, high) in config.get('ranges', {}).items():
+            columns[name] = dataclasses.replace(columns.get(name, ColumnSpec('float')), min=low, max=high)
+        
+        return cls(
+            columns=columns,
+            timestamp_format=config.get('timestamp_format'),
+            timezone=config.get('timezone')
+        )
+
+# Schema converted data is validated against by default
+DEFAULT_SCHEMA = CrocoLakeSchema()
@@ -0,0 +1,141 @@
+"""
+CrocoLake spatial index
+
+Observations can be tagged with the id of the cell of a regular lat/lon
+grid they fall in. Cell ids are numbered row by row from the south-west
+corner, so sorting by cell keeps nearby points together and a bounding box
+is covered by a few contiguous id ranges.
+"""
+
+import numpy as np
+from typing import List, Tuple, Dict, Union
+
+# Name of the cell id column
+CELL_COLUMN = 'cell'
+
+# Schema metadata key storing the grid resolution in degrees
+CELL_RESOLUTION_KEY = b'crocolake.cell_resolution'
+
+# Maximum number of id ranges used to cover a bounding box
+MAX_CELL_RANGES = 64
+
+# Mean Earth radius in kilometres
+EARTH_RADIUS_KM = 6371.0088
+
+def grid_shape(resolution: float) -> Tuple[int, int]:
+    """Number of grid rows (latitude) and columns (longitude)."""
+    return int(np.ceil(180.0 / resolution)), int(np.ceil(360.0 / resolution))
+
+def cell_ids(latitude: np.ndarray, longitude: np.ndarray, resolution: float) -> np.ndarray:
+    """
+    Cell ids of points on a regular grid.
+    
+    Args:
+        latitude: Latitudes in decimal degrees
+        longitude: Longitudes in decimal degrees, in [-180, 180]
+        resolution: Grid spacing in degrees
+    
+    Returns:
+        Array of int64 cell ids, -1 where a coordinate is missing
+    """
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    n_rows, n_cols = grid_shape(resolution)
+    
+    missing = np.isnan(latitude) | np.isnan(longitude)
+    rows = _index(np.where(missing, 0.0, latitude), -90.0, resolution, n_rows)
+    cols = _index(np.where(missing, 0.0, longitude), -180.0, resolution, n_cols)
+    
+    return np.where(missing, -1, rows * n_cols + cols)
+
+def cover_bbox(bbox: Dict[str, float], resolution: float,
+               max_ranges: int = MAX_CELL_RANGES) -> List[Tuple[int, int]]:
+    """
+    Cell id ranges covering a bounding box.
+    
+    A box with min_lon > max_lon crosses the antimeridian and is covered
+    from min_lon eastwards to 180 and from -180 to max_lon.
+    
+    Args:
+        bbox: Dict with keys 'min_lat', 'max_lat', 'min_lon', 'max_lon'
+        resolution: Grid spacing in degrees
+        max_ranges: Ranges separated by the smallest gaps are merged until
+            at most this many remain, which keeps filters on large boxes short
+    
+    Returns:
+        Sorted, non-overlapping list of inclusive (first, last) id ranges
+    """
+    n_rows, n_cols = grid_shape(resolution)
+    row_min, row_max = _index(np.array([bbox['min_lat'], bbox['max_lat']]), -90.0, resolution, n_rows).tolist()
+    col_min, col_max = _index(np.array([bbox['min_lon'], bbox['max_lon']]), -180.0, resolution, n_cols).tolist()
+    
+    if bbox['min_lon'] <= bbox['max_lon']:
+        col_ranges = [(col_min, col_max)]
+    else:
+        col_ranges = [(0, col_max), (col_min, n_cols - 1)]
+    
+    ranges = []
+    for row in range(row_min, row_max + 1):
+        for first, last in col_ranges:
+            first, last = row * n_cols + first, row * n_cols + last
+            if ranges and ranges[-1][1] + 1 >= first:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+            else:
+                ranges.append((first, last))
+    
+    if len(ranges) > max_ranges:
+        gaps = sorted(range(1, len(ranges)), key=lambda i: ranges[i][0] - ranges[i - 1][1])
+        starts = sorted(gaps[len(ranges) - max_ranges:])
+        ranges = [
+            (ranges[start][0], ranges[end - 1][1])
+            for start, end in zip([0] + starts, starts + [len(ranges)])
+        ]
+    
+    return ranges
+
+def _index(values: np.ndarray, origin: float, resolution: float, size: int) -> np.ndarray:
+    """Grid index along one axis, clipped to the grid."""
+    index = np.floor((values - origin) / resolution).astype(np.int64)
+    return np.clip(index, 0, size - 1)
+
+def cell_centers(ids: np.ndarray, resolution: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Latitude and longitude of the centres of grid cells.
+    
+    Args:
+        ids: Cell ids, as returned by cell_ids
+        resolution: Grid spacing in degrees
+    
+    Returns:
+        Tuple of (latitude, longitude) arrays, NaN where the id is -1
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    _, n_cols = grid_shape(resolution)
+    
+    latitude = -90.0 + (ids // n_cols + 0.5) * resolution
+    longitude = -180.0 + (ids % n_cols + 0.5) * resolution
+    missing = ids < 0
+    
+    return np.where(missing, np.nan, latitude), np.where(missing, np.nan, longitude)
+
+def unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Points on the unit sphere, where straight-line (chord) distances
+    increase monotonically with great-circle distances.
+    
+    Returns:
+        Array of shape (n, 3) of x, y, z coordinates
+    """
+    latitude = np.radians(np.asarray(latitude, dtype=float))
+    longitude = np.radians(np.asarray(longitude, dtype=float))
+    cos_lat = np.cos(latitude)
+    return np.column_stack([cos_lat * np.cos(longitude), cos_lat * np.sin(longitude), np.sin(latitude)])
+
+def chord_length(distance_km: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """Chord length on the unit sphere of a great-circle distance."""
+    angle = np.minimum(np.asarray(distance_km, dtype=float) / EARTH_RADIUS_KM, np.pi)
+    return 2.0 * np.sin(angle / 2.0)
+
+def great_circle_km(chord: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """Great-circle distance of a chord length on the unit sphere."""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=float) / 2.0, 0.0, 1.0))
@@ -0,0 +1,269 @@
+"""
+CrocoLake dataset statistics
+
+Statistics are computed when a dataset is written and stored in a JSON
+sidecar next to the data, so that a dataset can be described without
+scanning it. A sidecar records the mtime and size of the files it
+describes, and is only trusted while the dataset still has exactly those
+files.
+"""
+
+import json
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Set
+
+# Suffix of statistics sidecar files; the name always starts with an
+# underscore so pyarrow's dataset discovery ignores it
+STATS_SUFFIX = '.stats.json'
+
+# Columns whose min/max extent is recorded
+EXTENT_COLUMNS = ['timestamp', 'latitude', 'longitude', 'depth']
+
+def compute_stats(data: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Compute the statistics of a chunk of CrocoLake-formatted data.
+    
+    Returns:
+        Dictionary with the number of observations, per-variable counts and
+        units, min/max extents and sources
+    """
+    counts = data.groupby('variable', observed=True).size()
+    units = data.groupby('variable', observed=True)['unit'].unique()
+    
+    extents = {}
+    for col in EXTENT_COLUMNS:
+        if col not in data.columns:
+            continue
+        values = data[col]
+        if col == 'timestamp':
+            values = pd.to_datetime(values)
+        extents[col] = [_json_value(values.min()), _json_value(values.max())]
+    
+    return {
+        'n_observations': len(data),
+        'variables': {
+            str(variable): {
+                'count': int(counts[variable]),
+                'units': sorted(str(unit) for unit in units[variable])
+            }
+            for variable in counts.index
+        },
+        'extents': extents,
+        'sources': sorted(str(source) for source in data['source'].unique())
+    }
+
+def merge_stats(stats: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Combine the statistics of several chunks or files of a dataset."""
+    if not stats:
+        return None
+    
+    merged = {
+        'n_observations': 0,
+        'variables': {},
+        'extents': {col: [None, None] for col in EXTENT_COLUMNS},
+        'sources': set()
+    }
+    
+    for item in stats:
+        merged['n_observations'] += item['n_observations']
+        
+        for variable, variable_stats in item['variables'].items():
+            entry = merged['variables'].setdefault(variable, {'count': 0, 'units': set()})
+            entry['count'] += variable_stats['count']
+            entry['units'].update(variable_stats['units'])
+        
+        for col, (low, high) in item['extents'].items():
+            current = merged['extents'].setdefault(col, [None, None])
+            current[0] = _extreme(min, current[0], low)
+            current[1] = _extreme(max, current[1], high)
+        
+        merged['sources'].update(item['sources'])
+    
+    for entry in merged['variables'].values():
+        entry['units'] = sorted(entry['units'])
+    merged['sources'] = sorted(merged['sources'])
+    
+    return merged
+
+def metadata_stats(metadata: pq.FileMetaData) -> Dict[str, Any]:
+    """
+    Min/max extents from the row-group statistics of a parquet file.
+    
+    Only the extents are filled in; counts, variables and sources cannot be
+    derived from the footer and are left empty.
+    """
+    extents = {col: [None, None] for col in EXTENT_COLUMNS}
+    
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            statistics = column.statistics
+            if column.path_in_schema not in extents or statistics is None:
+                continue
+            if not statistics.has_min_max:
+                continue
+            
+            low, high = statistics.min, statistics.max
+            if column.path_in_schema == 'timestamp':
+                low, high = pd.Timestamp(low), pd.Timestamp(high)
+            
+            current = extents[column.path_in_schema]
+            current[0] = _extreme(min, current[0], _json_value(low))
+            current[1] = _extreme(max, current[1], _json_value(high))
+    
+    return {'n_observations': 0, 'variables': {}, 'extents': extents, 'sources': []}
+
+def dataset_stats(dataset_path: str, hidden: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Read and merge the statistics sidecars of a dataset, if any are current.
+    
+    A dataset directory has one sidecar per writer at its top level, a
+    single parquet file one next to it. Sidecars are current if the files
+    they describe, together, are the dataset's files at the same mtime and
+    size; a dataset rewritten or appended to since by another writer has
+    none. Compaction updates the sidecars, see replace_files.
+    
+    Args:
+        dataset_path: Path of the parquet file or dataset directory
+        hidden: Files of a directory hidden by compaction, relative to it
+    """
+    dataset_path = Path(dataset_path)
+    
+    if dataset_path.is_dir():
+        paths = sorted(dataset_path.glob(f"_*{STATS_SUFFIX}"))
+    else:
+        paths = [stats_path(dataset_path)]
+    paths = [path for path in paths if path.exists()]
+    
+    if not paths:
+        return None
+    
+    stats = [read_stats(path) for path in paths]
+    described = {}
+    for item in stats:
+        if 'files' not in item:
+            return None
+        described.update(item['files'])
+    
+    if dataset_path.is_dir():
+        current = data_files(dataset_path, set(hidden))
+    else:
+        current = file_versions(dataset_path.parent, [dataset_path])
+    if described != current:
+        return None
+    return merge_stats(stats)
+
+def file_versions(root: str, paths: Iterable[str]) -> Dict[str, List[int]]:
+    """mtime (ns) and size of files, by path relative to root."""
+    root = Path(root)
+    versions = {}
+    for path in paths:
+        stat = Path(path).stat()
+        versions[Path(path).relative_to(root).as_posix()] = [stat.st_mtime_ns, stat.st_size]
+    return versions
+
+def data_files(dataset_path: str, hidden: Set[str] = frozenset()) -> Dict[str, List[int]]:
+    """
+    file_versions of the parquet files of a dataset directory.
+    
+    Like pyarrow's discovery, paths with a component starting with '_' or
+    '.' (sidecars, temporary files) are skipped, as are hidden files.
+    """
+    dataset_path = Path(dataset_path)
+    paths = []
+    for path in dataset_path.rglob('*.parquet'):
+        relative = path.relative_to(dataset_path)
+        if any(part.startswith(('_', '.')) for part in relative.parts):
+            continue
+        if relative.as_posix() not in hidden:
+            paths.append(path)
+    return file_versions(dataset_path, paths)
+
+def stats_path(data_path: str) -> Path:
+    """Path of the statistics sidecar of a parquet file."""
+    data_path = Path(data_path)
+    return data_path.parent / f"_{data_path.stem}{STATS_SUFFIX}"
+
+def write_stats(path: str, stats: Dict[str, Any], data_paths: Iterable[str]) -> None:
+    """
+    Atomically write a statistics sidecar.
+    
+    Args:
+        path: Path of the sidecar, see stats_path
+        stats: Statistics of the data
+        data_paths: Parquet files the statistics describe, recorded with
+            their mtime and size relative to the sidecar's directory
+    """
+    path = Path(path)
+    _write_json(path, {**stats, 'files': file_versions(path.parent, data_paths)})
+
+def replace_files(dataset_path: str, old: List[str], new: List[str]) -> None:
+    """
+    Record in the statistics sidecars of a dataset directory that files
+    were replaced by new files holding the same rows, e.g. by compaction.
+    
+    Only sidecars whose recorded versions of the old files are still
+    current are updated; the new files are added to the first of them.
+    
+    Args:
+        dataset_path: Path of the dataset directory
+        old: Replaced files, relative to the dataset
+        new: Replacing files, relative to the dataset
+    """
+    dataset_path = Path(dataset_path)
+    new_versions = file_versions(dataset_path, [dataset_path / relative for relative in new])
+    
+    for path in sorted(dataset_path.glob(f"_*{STATS_SUFFIX}")):
+        stats = read_stats(path)
+        files = stats.get('files')
+        replaced = [relative for relative in old if relative in (files or {})]
+        if not replaced:
+            continue
+        
+        current = file_versions(dataset_path, [
+            dataset_path / relative for relative in replaced
+            if (dataset_path / relative).exists()
+        ])
+        if current != {relative: files[relative] for relative in replaced}:
+            continue
+        
+        stats['files'] = {
+            relative: version for relative, version in files.items() if relative not in replaced
+        }
+        stats['files'].update(new_versions)
+        new_versions = {}
+        _write_json(path, stats)
+
+def read_stats(path: str) -> Dict[str, Any]:
+    """Read a statistics sidecar."""
+    with open(path) as f:
+        return json.load(f)
+
+def _write_json(path: Path, content: Dict[str, Any]) -> None:
+    """Atomically write a JSON file."""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _json_value(value: Any) -> Any:
+    """Convert a pandas/numpy scalar to a JSON serializable value."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return float(value)
+
+def _extreme(func, current: Any, value: Any) -> Any:
+    """min/max of two values that may be None."""
+    if value is None:
+        return current
+    if current is None:
+        return value
+    if isinstance(value, str):
+        return func(current, value, key=pd.Timestamp)
+    return func(current, value)
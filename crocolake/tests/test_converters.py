@@ -4,8 +4,17 @@ import numpy as np
 from pathlib import Path
 import tempfile
 import os
+import json
+import gzip
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xarray as xr
 
-from crocolake.converters import CSVConverter, NetCDFConverter
+from crocolake.converters import CSVConverter, NetCDFConverter, BatchConverter, DatasetMerger, DatasetWriter
+from crocolake.converters.batch import main as batch_main
+from crocolake.converters.reshape import wide_to_long
+from crocolake.loader import DataLoader
+from crocolake.compaction import Compactor
 
 @pytest.fixture
 def sample_csv_data():
@@ -29,6 +38,27 @@ def csv_mapping():
         'salinity': 'sal'
     }
 
+@pytest.fixture
+def sample_netcdf_data(tmp_path):
+    """Create a small 4-D NetCDF file with a masked (NaN) land cell."""
+    temp = np.arange(3 * 2 * 2 * 2, dtype=float).reshape(3, 2, 2, 2)
+    temp[:, :, 0, 0] = np.nan
+    ds = xr.Dataset(
+        {
+            'temperature': (('time', 'depth', 'lat', 'lon'), temp),
+            'ssh': (('time', 'lat', 'lon'), np.ones((3, 2, 2)))
+        },
+        coords={
+            'time': pd.date_range('2023-01-01', periods=3, freq='D'),
+            'depth': [0.0, 10.0],
+            'lat': [45.0, 46.0],
+            'lon': [-125.0, -124.0]
+        }
+    )
+    path = tmp_path / 'sample.nc'
+    ds.to_netcdf(path)
+    return str(path)
+
 def test_csv_converter(sample_csv_data, csv_mapping):
     """Test CSV converter functionality."""
     # Create a temporary output file
@@ -55,6 +85,76 @@ def test_csv_converter(sample_csv_data, csv_mapping):
     os.unlink(sample_csv_data)
     os.unlink(output_path)
 
+def test_csv_converter_chunked(sample_csv_data, csv_mapping, tmp_path):
+    """Test that chunks are buffered into whole row groups of the output."""
+    output_path = tmp_path / 'chunked.parquet'
+    
+    converter = CSVConverter(
+        source_path=sample_csv_data,
+        target_path=str(output_path),
+        mapping=csv_mapping,
+        writer_options={'row_group_size': 4},
+        chunksize=1
+    )
+    converter.convert()
+    
+    metadata = pq.ParquetFile(output_path).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [4, 2]
+    
+    df = pd.read_parquet(output_path)
+    assert len(df) == 6
+    assert df['timestamp'].notna().all()
+    assert set(df['unit'].unique()) == {'°C', 'PSU'}
+    
+    os.unlink(sample_csv_data)
+
+def test_csv_converter_schema(sample_csv_data, csv_mapping, tmp_path):
+    """Test dictionary-encoded and float32 columns in the output."""
+    output_path = tmp_path / 'typed.parquet'
+    
+    converter = CSVConverter(
+        source_path=sample_csv_data,
+        target_path=str(output_path),
+        mapping=csv_mapping,
+        writer_options={'value_dtype': 'float32', 'depth_dtype': 'float32'}
+    )
+    transformed = converter.transform_data(converter.read_data())
+    assert all(transformed[col].dtype == 'category' for col in ['variable', 'unit', 'source'])
+    
+    converter.convert()
+    
+    schema = pq.read_schema(output_path)
+    assert pa.types.is_dictionary(schema.field('source').type)
+    assert schema.field('value').type == pa.float32()
+    assert schema.field('depth').type == pa.float32()
+    
+    df = DataLoader(str(tmp_path)).load_dataset('typed')
+    assert df['unit'].dtype == 'category'
+    assert list(df['source'].cat.categories) == [sample_csv_data]
+    
+    os.unlink(sample_csv_data)
+
+def test_csv_converter_partitioned(sample_csv_data, csv_mapping, tmp_path):
+    """Test writing a hive-partitioned, sorted dataset."""
+    output_path = tmp_path / 'partitioned.parquet'
+    
+    converter = CSVConverter(
+        source_path=sample_csv_data,
+        target_path=str(output_path),
+        mapping=csv_mapping,
+        writer_options={'partitioned': True, 'time_partition': 'year'}
+    )
+    converter.convert()
+    
+    assert (output_path / 'variable=temp' / 'year=2023').is_dir()
+    assert (output_path / 'variable=sal' / 'year=2023').is_dir()
+    
+    df = pd.read_parquet(output_path / 'variable=temp')
+    assert len(df) == 3
+    assert df['latitude'].is_monotonic_increasing
+    
+    os.unlink(sample_csv_data)
+
 def test_csv_converter_from_config(sample_csv_data, csv_mapping):
     """Test CSV converter creation from config."""
     config = {
@@ -68,4 +168,502 @@ def test_csv_converter_from_config(sample_csv_data, csv_mapping):
     assert converter.mapping == csv_mapping
     
     # Clean up
-    os.unlink(sample_csv_data) 
\ No newline at end of file
+    os.unlink(sample_csv_data) 
+
+@pytest.mark.parametrize('profile', [None, 'cprofile', 'tracemalloc'])
+def test_convert_report(sample_csv_data, csv_mapping, tmp_path, profile):
+    """Conversions report per-stage timings and counts to hooks and callers."""
+    converter = CSVConverter(
+        source_path=sample_csv_data,
+        target_path=str(tmp_path / 'output.parquet'),
+        mapping=csv_mapping,
+        chunksize=2
+    )
+    events = []
+    converter.add_hook(events.append)
+    
+    report = converter.convert(profile=profile)
+    
+    assert report is converter.last_report
+    stages = report['stages']
+    assert {'read', 'transform', 'transform.reshape', 'validate', 'write',
+            'write.encode', 'close'} <= set(stages)
+    assert stages['read']['calls'] == 3  # two chunks and the end of the source
+    assert stages['read']['rows'] == 3
+    assert stages['write']['rows'] == 6
+    assert report['counters']['bytes_written'] == (tmp_path / 'output.parquet').stat().st_size
+    assert stages['write.encode']['arrow_peak_bytes'] > 0
+    assert report['arrow_peak_bytes'] >= stages['write.encode']['arrow_peak_bytes']
+    assert ('traced_peak_bytes' in stages['read']) == (profile == 'tracemalloc')
+    assert [event['stage'] for event in events if event['event'] == 'stage'].count('write') == 2
+    assert events[-1] == {'event': 'report', 'report': report}
+    assert ('profile' in report) == (profile is not None)
+    
+    os.unlink(sample_csv_data)
+
+def test_netcdf_converter_blocks(sample_netcdf_data, tmp_path):
+    """Test block-wise conversion against the in-memory melt."""
+    output_path = tmp_path / 'blocks.parquet'
+    
+    converter = NetCDFConverter(
+        source_path=sample_netcdf_data,
+        target_path=str(output_path),
+        variable_mapping={'temperature': 'temp'},
+        writer_options={'row_group_size': 10},
+        blocks={'timestamp': 1, 'depth': 1}
+    )
+    converter.convert()
+    
+    # Blocks of at most 8 rows are combined into row groups of 10
+    assert pq.ParquetFile(output_path).metadata.num_row_groups == 5
+    
+    sort_columns = ['variable', 'timestamp', 'depth', 'latitude', 'longitude']
+    df = pd.read_parquet(output_path).sort_values(sort_columns).reset_index(drop=True)
+    expected = converter.transform_data(converter.read_data()).dropna(subset=['value'])
+    expected = expected.sort_values(sort_columns).reset_index(drop=True)
+    
+    assert len(df) == 3 * 2 * 3 + 3 * 2 * 2 * 2
+    assert set(df['variable'].unique()) == {'temp', 'ssh'}
+    pd.testing.assert_frame_equal(df, expected[df.columns], check_dtype=False)
+    
+    # Automatic blocks hold about block_rows rows: 16 rows per time step
+    with xr.open_dataset(sample_netcdf_data) as source:
+        source = source.rename(converter.dimension_mapping)
+        converter.block_rows = 40
+        assert converter.auto_blocks(source) == {'timestamp': 2}
+        converter.block_rows = 5
+        assert converter.auto_blocks(source) == {'timestamp': 1, 'depth': 1, 'latitude': 1}
+
+def test_writer_partitioned_chunks(tmp_path):
+    """Chunks of a partitioned dataset go to one file per partition, in full, sorted row groups."""
+    target_path = tmp_path / 'chunks.parquet'
+    rng = np.random.default_rng(0)
+    
+    with DatasetWriter(target_path, partitioned=True, row_group_size=100) as writer:
+        for chunk in range(10):
+            writer.write(pd.DataFrame({
+                'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 1000, 50), unit='h'),
+                'latitude': rng.uniform(-90, 90, 50),
+                'longitude': 0.0,
+                'depth': 0.0,
+                'variable': np.tile(['temp', 'sal'], 25),
+                'value': float(chunk),
+                'unit': 'unknown',
+                'source': 'synthetic.csv'
+            }))
+    
+    files = sorted(target_path.rglob('*.parquet'))
+    assert [path.relative_to(target_path).as_posix() for path in files] == [
+        'variable=sal/part-0.parquet', 'variable=temp/part-0.parquet'
+    ]
+    for path in files:
+        parquet_file = pq.ParquetFile(path)
+        sizes = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+        assert sizes == [100, 100, 50]
+        for i in range(parquet_file.num_row_groups):
+            timestamps = parquet_file.read_row_group(i).column('timestamp').to_pandas()
+            assert timestamps.is_monotonic_increasing
+    
+    df = DataLoader(str(tmp_path)).load_dataset('chunks')
+    assert len(df) == 500
+    assert df.groupby('variable', observed=True)['value'].sum().to_dict() == {'sal': 1125.0, 'temp': 1125.0}
+
+@pytest.fixture
+def csv_sources(tmp_path, sample_csv_data):
+    """Several copies of the sample CSV file, one per day."""
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    content = Path(sample_csv_data).read_text()
+    for day in range(1, 4):
+        (raw_dir / f'cruise_{day}.csv').write_text(content.replace('01-01', f'01-0{day}'))
+    os.unlink(sample_csv_data)
+    return raw_dir
+
+@pytest.mark.parametrize('writer_options', [{}, {'partitioned': True}])
+def test_batch_converter(csv_sources, csv_mapping, tmp_path, writer_options):
+    """Test that a batch of sources lands in one combined dataset."""
+    target_path = tmp_path / 'processed' / 'cruises.parquet'
+    
+    batch = BatchConverter(
+        str(csv_sources / '*.csv'),
+        str(target_path),
+        config={'mapping': csv_mapping, 'writer_options': writer_options},
+        n_workers=2
+    )
+    reports = batch.convert()
+    
+    assert [report['status'] for report in reports] == ['ok'] * 3
+    
+    df = DataLoader(str(tmp_path / 'processed')).load_dataset('cruises')
+    assert len(df) == 3 * 6
+    assert df['timestamp'].dt.day.nunique() == 3
+
+def test_batch_converter_reports_errors(csv_sources, csv_mapping, tmp_path):
+    """Test that a failing source is retried and reported."""
+    manifest = tmp_path / 'manifest.txt'
+    sources = sorted(str(path) for path in csv_sources.glob('*.csv'))
+    manifest.write_text('\n'.join(sources + [str(csv_sources / 'missing.csv')]))
+    
+    batch = BatchConverter(
+        str(manifest),
+        str(tmp_path / 'cruises.parquet'),
+        config={'mapping': csv_mapping},
+        n_workers=1,
+        max_retries=1,
+        retry_delay=0
+    )
+    reports = batch.convert()
+    
+    assert [report['status'] for report in reports] == ['ok', 'ok', 'ok', 'failed']
+    assert reports[-1]['attempts'] == 2
+    assert 'FileNotFoundError' in reports[-1]['error']
+    assert len(list((tmp_path / 'cruises.parquet').glob('*.parquet'))) == 3
+
+def test_batch_converter_catalog(csv_sources, csv_mapping, tmp_path):
+    """Per-source files are not catalogued; the combined dataset is, once."""
+    target_path = tmp_path / 'processed' / 'cruises'
+    batch = BatchConverter(
+        str(csv_sources / '*.csv'),
+        str(target_path),
+        config={'mapping': csv_mapping},
+        n_workers=2
+    )
+    assert [report['status'] for report in batch.convert()] == ['ok'] * 3
+    assert not (target_path / '_catalog.json').exists()
+    
+    batch.target_path = tmp_path / 'processed' / 'cruises.parquet'
+    batch.convert()
+    with open(tmp_path / 'processed' / '_catalog.json') as f:
+        assert list(json.load(f)['datasets']) == ['cruises']
+
+@pytest.mark.parametrize('writer_options', [{}, {'partitioned': True, 'time_partition': 'month'}])
+def test_batch_converter_incremental(csv_sources, csv_mapping, tmp_path, writer_options):
+    """Test that re-runs only convert new or modified sources."""
+    target_path = tmp_path / 'processed' / 'cruises.parquet'
+    loader = DataLoader(str(tmp_path / 'processed'))
+    
+    def run():
+        batch = BatchConverter(
+            str(csv_sources / '*.csv'),
+            str(target_path),
+            config={'mapping': csv_mapping, 'writer_options': writer_options},
+            n_workers=1,
+            incremental=True
+        )
+        return {Path(report['source']).name: report['status'] for report in batch.convert()}
+    
+    assert set(run().values()) == {'ok'}
+    assert (target_path / '_manifest.json').exists()
+    assert set(run().values()) == {'skipped'}
+    
+    # Modified source is reconverted and replaces its previous output
+    modified = csv_sources / 'cruise_2.csv'
+    modified.write_text(modified.read_text().replace('15.2', '16.2'))
+    assert run() == {'cruise_1.csv': 'skipped', 'cruise_2.csv': 'ok', 'cruise_3.csv': 'skipped'}
+    df = loader.load_dataset('cruises')
+    assert len(df) == 3 * 6
+    assert 16.2 in df['value'].tolist()
+    
+    # Deleted source has its output dropped
+    os.unlink(csv_sources / 'cruise_3.csv')
+    assert run() == {'cruise_1.csv': 'skipped', 'cruise_2.csv': 'skipped', 'cruise_3.csv': 'removed'}
+    df = loader.load_dataset('cruises')
+    assert len(df) == 2 * 6
+    assert df['timestamp'].dt.day.nunique() == 2
+
+@pytest.mark.parametrize('writer_options', [{}, {'partitioned': True, 'time_partition': 'month'}])
+def test_batch_converter_after_compaction(csv_sources, csv_mapping, tmp_path, writer_options):
+    """Test that re-converted and removed sources replace their compacted rows."""
+    target_path = tmp_path / 'processed' / 'cruises.parquet'
+    loader = DataLoader(str(tmp_path / 'processed'))
+    
+    def run():
+        BatchConverter(
+            str(csv_sources / '*.csv'),
+            str(target_path),
+            config={'mapping': csv_mapping, 'writer_options': writer_options},
+            n_workers=1,
+            incremental=True
+        ).convert()
+        return loader.load_dataset('cruises')
+    
+    run()
+    report = Compactor(target_path).compact()
+    assert report['files_compacted'] > report['files_written'] > 0
+    
+    modified = csv_sources / 'cruise_2.csv'
+    modified.write_text(modified.read_text().replace('15.2', '16.2'))
+    df = run()
+    assert len(df) == 3 * 6
+    assert 16.2 in df['value'].tolist()
+    
+    os.unlink(csv_sources / 'cruise_3.csv')
+    df = run()
+    assert len(df) == 2 * 6
+    assert df['timestamp'].dt.day.nunique() == 2
+
+def test_batch_cli(csv_sources, csv_mapping, tmp_path):
+    """Test the batch conversion command line interface."""
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps({'mapping': csv_mapping}))
+    target_path = tmp_path / 'cruises.parquet'
+    
+    status = batch_main([
+        str(csv_sources / '*.csv'), str(target_path),
+        '--config', str(config_path), '--workers', '1', '--time-partition', 'month',
+        '--overviews'
+    ])
+    
+    assert status == 0
+    assert (target_path / 'variable=temp' / 'year=2023' / 'month=1').is_dir()
+    assert len(list(target_path.glob('_*.overviews.parquet'))) == len(list(csv_sources.glob('*.csv')))
+
+def test_wide_to_long_matches_melt():
+    """Test the reshape engine against DataFrame.melt followed by dropna."""
+    wide = pd.DataFrame({
+        'timestamp': pd.date_range('2023-01-01', periods=4, freq='h'),
+        'depth': [0.0, 10.0, 20.0, 30.0],
+        'temp': [15.0, np.nan, 14.0, 13.5],
+        'sal': [33.0, 33.1, np.nan, np.nan]
+    })
+    
+    result = wide_to_long(wide, id_vars=['timestamp', 'depth'])
+    expected = wide.melt(
+        id_vars=['timestamp', 'depth'], var_name='variable', value_name='value'
+    ).dropna(subset=['value']).reset_index(drop=True)
+    
+    assert result['variable'].dtype == 'category'
+    pd.testing.assert_frame_equal(
+        result.astype({'variable': str}), expected.astype({'variable': str})
+    )
+
+def test_wide_to_long_qc():
+    """Test that QC flags follow their variable through the reshape."""
+    wide = pd.DataFrame({
+        'depth': [0.0, 10.0, 20.0],
+        'temp': [15.0, np.nan, 14.0],
+        'temp_qc': [1, 4, 3],
+        'sal': [33.0, 33.1, 33.2]
+    })
+    
+    result = wide_to_long(wide, id_vars=['depth'], qc_columns={'temp': 'temp_qc'})
+    
+    assert list(result['variable']) == ['temp', 'temp', 'sal', 'sal', 'sal']
+    assert result['qc'].tolist()[:2] == [1, 3]
+    assert result['qc'].iloc[2:].isna().all()
+
+def test_csv_converter_qc(tmp_path):
+    """Test QC flag columns in the CSV converter."""
+    source = tmp_path / 'qc.csv'
+    source.write_text("""time,lat,lon,depth,temperature,temperature_qc
+2023-01-01 00:00:00,45.5,-125.5,0,15.2,1
+2023-01-01 00:00:00,45.5,-125.5,10,,9
+""")
+    converter = CSVConverter(
+        source_path=str(source),
+        mapping={'time': 'timestamp', 'lat': 'latitude', 'lon': 'longitude',
+                 'temperature': 'temp'},
+        qc_columns={'temp': 'temperature_qc'}
+    )
+    
+    df = converter.transform_data(converter.read_data())
+    
+    assert len(df) == 1
+    assert df['qc'].tolist() == [1]
+    assert 'temperature_qc' not in set(df['variable'])
+
+@pytest.fixture
+def invalid_csv_data(tmp_path):
+    """CSV file with an out-of-range latitude and an unparseable value."""
+    source = tmp_path / 'invalid.csv'
+    source.write_text("""time,lat,lon,depth,temperature
+2023-01-01 00:00:00,45.5,-125.5,0,15.2
+2023-01-01 00:00:00,95.0,-125.5,10,14.8
+2023-01-01 00:00:00,45.6,-125.4,0,n/a?
+""")
+    return str(source)
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+@pytest.mark.parametrize('on_invalid', ['raise', 'drop', 'quarantine'])
+def test_csv_converter_validation(invalid_csv_data, csv_mapping, tmp_path, on_invalid, engine):
+    """Rows violating the schema are rejected, dropped or quarantined."""
+    converter = CSVConverter(
+        source_path=invalid_csv_data,
+        target_path=str(tmp_path / 'output.parquet'),
+        mapping=csv_mapping,
+        validation={'on_invalid': on_invalid},
+        engine=engine
+    )
+    quarantine = tmp_path / '_output.quarantine.parquet'
+    assert converter.quarantine_path == quarantine
+    
+    if on_invalid == 'raise':
+        with pytest.raises(ValueError, match='could not be parsed'):
+            converter.convert()
+        return
+    
+    report = converter.convert()
+    
+    df = pd.read_parquet(tmp_path / 'output.parquet')
+    assert len(df) == 1
+    assert df['latitude'].tolist() == [45.5]
+    assert report['validation'] == {
+        'temp:unparseable': 1, 'latitude:max': 1, 'rows_invalid': 1
+    }
+    
+    assert quarantine.exists() == (on_invalid == 'quarantine')
+    if on_invalid == 'quarantine':
+        rejected = pd.read_parquet(quarantine)
+        assert rejected['latitude'].tolist() == [95.0]
+        assert rejected['violations'].tolist() == ['latitude:max']
+
+def test_csv_converter_quarantine_partitioned(invalid_csv_data, csv_mapping, tmp_path):
+    """Rows quarantined into a partitioned target survive, on a new and an existing target."""
+    target = tmp_path / 'output.parquet'
+    converter = CSVConverter(
+        source_path=invalid_csv_data,
+        target_path=str(target),
+        mapping=csv_mapping,
+        validation={'on_invalid': 'quarantine'},
+        writer_options={'partitioned': True}
+    )
+    assert converter.quarantine_path == target / '_part.quarantine.parquet'
+    
+    for _ in range(2):
+        report = converter.convert()
+        
+        assert report['validation']['rows_invalid'] == 1
+        assert len(pd.read_parquet(target)) == 1
+        rejected = pd.read_parquet(converter.quarantine_path)
+        assert rejected['latitude'].tolist() == [95.0]
+
+def test_csv_converter_validation_samples(invalid_csv_data, csv_mapping, tmp_path):
+    """Schema errors report counts per rule and the violating rows."""
+    converter = CSVConverter(
+        source_path=invalid_csv_data,
+        target_path=str(tmp_path / 'output.parquet'),
+        mapping=csv_mapping,
+        validation={'ranges': {'latitude': (40.0, 90.0)}}
+    )
+    
+    long = converter.transform_data(converter.read_data().iloc[:2])
+    with pytest.raises(ValueError, match=r'1 of 2 rows invalid \(latitude:max: 1\)') as excinfo:
+        converter.validate_data(long)
+    assert '95.0' in str(excinfo.value)
+    assert not converter.validate_schema(long)
+    assert converter.validate_schema(long.iloc[:1])
+
+def test_csv_converter_timestamp_format(tmp_path, csv_mapping):
+    """Timestamps are parsed with the configured format and timezone."""
+    source = tmp_path / 'local.csv'
+    source.write_text("""time,lat,lon,depth,temperature
+01/02/2023 09:30,45.5,-125.5,0,15.2
+""")
+    converter = CSVConverter(
+        source_path=str(source),
+        mapping=csv_mapping,
+        validation={'timestamp_format': '%d/%m/%Y %H:%M', 'timezone': 'America/Los_Angeles'}
+    )
+    
+    df = converter.transform_data(converter.read_data())
+    
+    assert df['timestamp'].tolist() == [pd.Timestamp('2023-02-01 17:30:00')]
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_csv_converter_timestamp_offsets(csv_mapping, tmp_path, chunksize):
+    """Both engines convert timestamps with a zone offset to naive UTC."""
+    source = tmp_path / 'offsets.csv'
+    source.write_text("""time,lat,lon,depth,temperature
+2023-01-01T00:00:00Z,45.5,-125.5,0,15.2
+2023-01-01T02:00:00+02:00,45.6,-125.4,0,15.0
+2023-01-01T03:00:00+02:00,45.7,-125.3,0,14.8
+""")
+    
+    outputs = {}
+    for engine in ('pandas', 'pyarrow'):
+        CSVConverter(
+            source_path=str(source),
+            target_path=str(tmp_path / f'{engine}.parquet'),
+            mapping=csv_mapping,
+            chunksize=chunksize,
+            engine=engine
+        ).convert()
+        outputs[engine] = pd.read_parquet(tmp_path / f'{engine}.parquet')
+    
+    pd.testing.assert_frame_equal(outputs['pyarrow'], outputs['pandas'])
+    assert outputs['pyarrow']['timestamp'].tolist() == [
+        pd.Timestamp('2023-01-01 00:00:00'), pd.Timestamp('2023-01-01 00:00:00'),
+        pd.Timestamp('2023-01-01 01:00:00')
+    ]
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_csv_converter_pyarrow(sample_csv_data, csv_mapping, tmp_path, chunksize):
+    """The pyarrow engine streams compressed files and matches the pandas engine."""
+    source = tmp_path / 'sample.csv.gz'
+    with open(sample_csv_data, 'rb') as f, gzip.open(source, 'wb') as g:
+        g.write(f.read())
+    
+    outputs = {}
+    for engine in ('pandas', 'pyarrow'):
+        converter = CSVConverter(
+            source_path=str(source),
+            target_path=str(tmp_path / f'{engine}.parquet'),
+            mapping=csv_mapping,
+            chunksize=chunksize,
+            engine=engine
+        )
+        if engine == 'pyarrow':
+            assert converter.column_types(['time', 'lat', 'temperature']) == {
+                'time': pa.timestamp('ns'), 'lat': pa.float64(), 'temperature': pa.float64()
+            }
+            assert [len(chunk) for chunk in converter.iter_chunks()] == ([3] if chunksize is None else [2, 1])
+        converter.convert()
+        outputs[engine] = pd.read_parquet(tmp_path / f'{engine}.parquet')
+    
+    pd.testing.assert_frame_equal(outputs['pyarrow'], outputs['pandas'])
+    
+    with pytest.raises(ValueError, match='not supported by the pyarrow engine'):
+        CSVConverter(str(source), engine='pyarrow', skiprows=1)
+    
+    os.unlink(sample_csv_data)
+
+@pytest.mark.parametrize('n_buckets', [1, 3])
+def test_dataset_merger(tmp_path, n_buckets):
+    """Duplicated observations are kept once, from the highest-priority dataset."""
+    n = 40
+    realtime = pd.DataFrame({
+        'timestamp': pd.date_range('2023-01-01', periods=n, freq='h'),
+        'latitude': np.linspace(40.0, 50.0, n),
+        'longitude': np.linspace(-130.0, -120.0, n),
+        'depth': np.tile([0.0, 10.0], n // 2),
+        'variable': np.repeat(['temp', 'sal'], n // 2),
+        'value': np.arange(n, dtype=float),
+        'unit': 'unknown',
+        'source': 'realtime.csv'
+    })
+    delayed = realtime.iloc[::2].copy()
+    delayed['value'] += 0.5
+    delayed['latitude'] += 1e-9  # below the default key precision
+    delayed['source'] = 'delayed.csv'
+    with DatasetWriter(tmp_path / 'realtime.parquet') as writer:
+        writer.write(pd.concat([realtime, realtime.iloc[:1]]))
+    with DatasetWriter(tmp_path / 'delayed.parquet', partitioned=True) as writer:
+        writer.write(delayed)
+    
+    merger = DatasetMerger(
+        str(tmp_path), str(tmp_path / 'merged.parquet'),
+        priority=['delayed'], n_buckets=n_buckets
+    )
+    assert merger.datasets == ['delayed', 'realtime']
+    report = merger.merge()
+    
+    merged = pd.read_parquet(tmp_path / 'merged.parquet').sort_values('timestamp', ignore_index=True)
+    assert len(merged) == n
+    assert merged['value'].tolist() == [i + 0.5 if i % 2 == 0 else float(i) for i in range(n)]
+    assert report['counters'] == {'rows_read': n // 2 + n + 1, 'duplicates': n // 2 + 1, 'rows_written': n}
+    assert report['duplicates'] == {'delayed': 0, 'realtime': n // 2 + 1}
+    
+    # The merged dataset is not an input of later merges, nor a valid target
+    assert DatasetMerger(str(tmp_path), str(tmp_path / 'merged.parquet')).datasets == ['delayed', 'realtime']
+    with pytest.raises(ValueError, match='one of the merged datasets'):
+        DatasetMerger(str(tmp_path), str(tmp_path / 'realtime.parquet'), datasets=['realtime'])
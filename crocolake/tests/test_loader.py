@@ -0,0 +1,788 @@
+import shutil
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from crocolake.loader import DataLoader, QueryService
+from crocolake.loader.service import serve, fetch
+from crocolake.converters import DatasetWriter
+from crocolake.spatial import cover_bbox
+from crocolake.compaction import Compactor, CompactionLog
+from crocolake.catalog import DatasetCatalog, update_catalog
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Create a small CrocoLake dataset split over several row groups."""
+    n = 200
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2023-01-01', periods=n, freq='h'),
+        'latitude': np.linspace(40.0, 50.0, n),
+        'longitude': np.linspace(-130.0, -120.0, n),
+        'depth': np.tile([0.0, 10.0, 20.0, 50.0], n // 4),
+        'variable': np.repeat(['temp', 'sal'], n // 2),
+        'value': np.arange(n, dtype=float),
+        'unit': np.repeat(['°C', 'PSU'], n // 2),
+        'source': 'synthetic.csv'
+    })
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, tmp_path / 'ocean.parquet', row_group_size=25)
+    
+    # Same data as a hive-partitioned directory
+    with DatasetWriter(tmp_path / 'ocean_partitioned.parquet', partitioned=True,
+                       time_partition='month', row_group_size=25) as writer:
+        writer.write(df)
+    return tmp_path
+
+def test_load_dataset_pushdown_matches_pandas(data_dir):
+    """Pushed-down filters return the same rows as in-memory masking."""
+    loader = DataLoader(str(data_dir))
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    
+    result = loader.load_dataset(
+        'ocean',
+        variables=['sal'],
+        time_range=('2023-01-05', '2023-01-07'),
+        bbox={'min_lat': 44.0, 'max_lat': 49.0, 'min_lon': -130.0, 'max_lon': -120.0},
+        depth_range=(0, 20)
+    )
+    
+    expected = df[
+        (df['variable'] == 'sal') &
+        (df['timestamp'] >= '2023-01-05') & (df['timestamp'] <= '2023-01-07') &
+        (df['latitude'] >= 44.0) & (df['latitude'] <= 49.0) &
+        (df['depth'] >= 0) & (df['depth'] <= 20)
+    ].reset_index(drop=True)
+    
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_load_dataset_columns(data_dir):
+    """Only the projected columns are returned, even when filtering on others."""
+    loader = DataLoader(str(data_dir))
+    
+    result = loader.load_dataset('ocean', variables=['temp'], columns=['timestamp', 'value'])
+    
+    assert list(result.columns) == ['timestamp', 'value']
+    assert len(result) == 100
+
+def test_load_dataset_keeps_file_column_order(data_dir):
+    """Flat files keep their own column order, like the processed baseline files."""
+    baseline = ['timestamp', 'latitude', 'longitude', 'depth', 'variable', 'value', 'source', 'unit']
+    df = pd.read_parquet(data_dir / 'ocean.parquet')[baseline]
+    df.to_parquet(data_dir / 'baseline.parquet', index=False)
+    loader = DataLoader(str(data_dir))
+    
+    assert list(loader.load_dataset('baseline').columns) == baseline
+    assert list(loader.load_dataset('baseline', variables=['temp']).columns) == baseline
+    
+    # Partition keys are moved back to their canonical place
+    partitioned = loader.load_dataset('ocean_partitioned')
+    assert list(partitioned.columns) == list(loader.load_dataset('ocean').columns)
+    assert partitioned.columns.get_loc('variable') == 4
+
+def test_prune_row_groups(data_dir):
+    """Row groups outside the filter are skipped using parquet statistics."""
+    loader = DataLoader(str(data_dir))
+    dataset = loader._open_dataset('ocean')
+    expression = loader._build_filter(dataset.schema, depth_range=None, variables=['temp'])
+    
+    pruned = loader._prune_row_groups(dataset, expression)
+    
+    assert len(list(pruned.get_fragments())) == 4
+
+def test_query_report(data_dir):
+    """Queries report the row groups they scan and skip, and the cache use."""
+    loader = DataLoader(str(data_dir))
+    events = []
+    loader.add_hook(events.append)
+    
+    df = loader.load_dataset('ocean', variables=['temp'])
+    report = loader.last_query_report
+    
+    counters = report['counters']
+    assert counters['row_groups_scanned'] == 4
+    assert counters['row_groups_skipped'] == 4
+    assert counters['rows_scanned'] == 100
+    assert counters['rows_returned'] == len(df) == 100
+    assert 0 < counters['bytes_read'] < (data_dir / 'ocean.parquet').stat().st_size
+    assert counters['cache_misses'] == 1
+    assert {'plan', 'scan', 'convert'} <= set(report['stages'])
+    assert events[-1]['report'] is report
+    
+    loader.load_dataset('ocean', variables=['temp'])
+    assert loader.last_query_report['counters'] == {'cache_hits': 1, 'rows_returned': 100}
+
+def test_load_partitioned_dataset(data_dir):
+    """A partitioned directory is read as one dataset with the file's schema."""
+    loader = DataLoader(str(data_dir))
+    
+    assert sorted(loader.list_datasets()) == ['ocean', 'ocean_partitioned']
+    
+    query = dict(
+        variables=['temp'],
+        time_range=('2023-01-02', '2023-01-03 12:00'),
+        depth_range=(0, 10)
+    )
+    result = loader.load_dataset('ocean_partitioned', **query)
+    expected = loader.load_dataset('ocean', **query)
+    
+    assert list(result.columns) == list(expected.columns)
+    assert len(result) > 0
+    assert isinstance(result['variable'].dtype, pd.CategoricalDtype)
+    
+    result = result.astype({'variable': str, 'unit': str, 'source': str})
+    pd.testing.assert_frame_equal(
+        result.sort_values('timestamp').reset_index(drop=True),
+        expected,
+        check_dtype=False
+    )
+
+def test_partition_pruning(data_dir):
+    """Partitions of other variables are skipped before reading any file."""
+    loader = DataLoader(str(data_dir))
+    dataset = loader._open_dataset('ocean_partitioned')
+    expression = loader._build_filter(dataset.schema, variables=['sal'])
+    
+    fragments = list(dataset.get_fragments(filter=expression))
+    
+    assert len(fragments) == 1
+    assert 'variable=sal' in fragments[0].path
+
+def test_catalog(data_dir):
+    """Catalogued datasets are opened and pruned from their file index."""
+    target = data_dir / 'ocean_partitioned.parquet'
+    entry = DatasetCatalog.load(data_dir).datasets['ocean_partitioned']
+    assert (entry['rows'], entry['index']) == (200, '_catalog.arrow')
+    assert entry['partitions'] == {'variable': ['sal', 'temp'], 'year': [2023], 'month': [1]}
+    
+    loader = DataLoader(str(data_dir))
+    dataset, index = loader._open_indexed('ocean_partitioned')
+    assert index is not None
+    assert loader._open_dataset('ocean_partitioned') is dataset
+    assert dataset.schema == loader._order_partition_keys(loader._discover_dataset(
+        target.resolve(), dict(partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+    )).schema
+    
+    # Opening and pruning files read the index, not the directory or the files
+    path = Path(next(path for path in dataset.files if 'variable=temp' in path))
+    moved = path.with_name('_moved.parquet')
+    path.rename(moved)
+    loader.clear_cache()
+    assert str(path) in loader._open_dataset('ocean_partitioned').files
+    assert len(loader.load_dataset('ocean_partitioned', depth_range=(100, 200))) == 0
+    moved.rename(path)
+    
+    filters = {'depth_range': (0, 10)}
+    assert len(loader._prune_files(dataset, index, filters).files) == len(dataset.files)
+    filters = {'time_range': ('2024-01-01', '2024-12-31')}
+    assert len(loader._prune_files(dataset, index, filters).files) == 0
+    filters = {'bbox': {'min_lat': 40, 'max_lat': 50, 'min_lon': 170, 'max_lon': -170}}
+    assert len(loader._prune_files(dataset, index, filters).files) == 0
+    
+    # Rows appended without updating the catalog are still found
+    df = pd.read_parquet(data_dir / 'ocean.parquet').iloc[:10]
+    with DatasetWriter(target, partitioned=True, time_partition='month',
+                       append=True, basename='extra') as writer:
+        writer.write(df)
+    assert loader._catalog_entry('ocean_partitioned') is None
+    assert len(loader.load_dataset('ocean_partitioned')) == 210
+    
+    assert update_catalog(target)['rows'] == 210
+    assert loader._catalog_entry('ocean_partitioned') is not None
+    assert loader.get_dataset_info('ocean_partitioned')['n_observations'] == 210
+    assert len(loader.load_dataset('ocean_partitioned', variables=['temp'])) == 110
+
+def test_catalog_in_place_rewrite(data_dir):
+    """Files rewritten in place are seen once the catalog is updated."""
+    target = data_dir / 'ocean_partitioned.parquet'
+    loader = DataLoader(str(data_dir))
+    assert len(loader.load_dataset('ocean_partitioned')) == 200
+    
+    path = next(target.glob('variable=temp/**/*.parquet'))
+    table = pq.read_table(path)
+    pq.write_table(table.slice(0, 10), path)
+    update_catalog(target)
+    
+    assert len(loader.load_dataset('ocean_partitioned')) == 110
+
+def test_catalog_concurrent_updates(data_dir):
+    """Concurrent writers all end up in the catalog; failures do not raise."""
+    names = [f"copy_{i}" for i in range(8)]
+    for name in names:
+        shutil.copy(data_dir / 'ocean.parquet', data_dir / f"{name}.parquet")
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        entries = list(executor.map(update_catalog, [data_dir / f"{name}.parquet" for name in names]))
+    
+    assert all(entry is not None for entry in entries)
+    assert set(names) <= set(DatasetCatalog.load(data_dir).datasets)
+    assert not list(data_dir.glob('*.tmp'))
+    
+    (data_dir / '_catalog.json').unlink()
+    (data_dir / '_catalog.json').mkdir()
+    assert update_catalog(data_dir / 'ocean.parquet') is None
+
+@pytest.mark.parametrize('dataset_name', ['ocean', 'ocean_partitioned'])
+def test_get_dataset_info(data_dir, dataset_name):
+    """Info from the stats sidecar and from parquet statistics match the data."""
+    loader = DataLoader(str(data_dir))
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    
+    info = loader.get_dataset_info(dataset_name)
+    
+    assert sorted(info['variables']) == ['sal', 'temp']
+    assert info['time_range'] == (df['timestamp'].min(), df['timestamp'].max())
+    assert info['spatial_coverage'] == {
+        'min_lat': 40.0, 'max_lat': 50.0, 'min_lon': -130.0, 'max_lon': -120.0
+    }
+    assert info['depth_range'] == (0.0, 50.0)
+    assert info['n_observations'] == 200
+    assert info['sources'] == ['synthetic.csv']
+    assert info['variable_counts'] == {'sal': 100, 'temp': 100}
+    assert info['units'] == {'sal': ['PSU'], 'temp': ['°C']}
+
+def test_get_dataset_info_uses_sidecar(data_dir):
+    """The sidecar written with the dataset is read instead of the data."""
+    loader = DataLoader(str(data_dir))
+    assert (data_dir / 'ocean_partitioned.parquet' / '_part.stats.json').exists()
+    
+    for path in (data_dir / 'ocean_partitioned.parquet').rglob('*.parquet'):
+        path.write_bytes(b'')
+    
+    assert loader.get_dataset_info('ocean_partitioned')['n_observations'] == 200
+
+def test_get_dataset_info_stale_sidecar(data_dir):
+    """Sidecars of datasets rewritten or added to since are not trusted."""
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    with DatasetWriter(data_dir / 'flat.parquet', catalog=False) as writer:
+        writer.write(df)
+    target = data_dir / 'parts.parquet'
+    with DatasetWriter(target, partitioned=True, catalog=False) as writer:
+        writer.write(df)
+    loader = DataLoader(str(data_dir))
+    assert loader._read_stats('flat') is not None
+    assert loader._read_stats('parts') is not None
+    
+    pq.write_table(pa.Table.from_pandas(df.iloc[:50], preserve_index=False), data_dir / 'flat.parquet')
+    extra = df[df['variable'] == 'temp'].iloc[:10].drop(columns='variable')
+    pq.write_table(pa.Table.from_pandas(extra, preserve_index=False),
+                   target / 'variable=temp' / 'extra.parquet')
+    
+    assert loader._read_stats('flat') is None
+    assert loader.get_dataset_info('flat')['n_observations'] == 50
+    assert loader._read_stats('parts') is None
+    assert loader.get_dataset_info('parts')['variable_counts'] == {'sal': 100, 'temp': 110}
+
+@pytest.fixture
+def global_data_dir(tmp_path):
+    """Create a dataset of random points over the globe with a spatial index."""
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 1000, n), unit='h'),
+        'latitude': rng.uniform(-90, 90, n),
+        'longitude': rng.uniform(-180, 180, n),
+        'depth': 0.0,
+        'variable': 'temp',
+        'value': np.arange(n, dtype=float),
+        'unit': '°C',
+        'source': 'synthetic.csv'
+    })
+    with DatasetWriter(tmp_path / 'globe.parquet', spatial_index=5.0, row_group_size=100) as writer:
+        writer.write(df)
+    return tmp_path, df
+
+@pytest.mark.parametrize('bbox', [
+    {'min_lat': -10.0, 'max_lat': 30.0, 'min_lon': 20.0, 'max_lon': 60.0},
+    {'min_lat': -20.0, 'max_lat': 20.0, 'min_lon': 150.0, 'max_lon': -160.0}
+])
+def test_load_dataset_spatial_index(global_data_dir, bbox):
+    """Bbox queries on an indexed dataset, including across the antimeridian."""
+    data_dir, df = global_data_dir
+    loader = DataLoader(str(data_dir))
+    
+    result = loader.load_dataset('globe', bbox=bbox)
+    
+    if bbox['min_lon'] <= bbox['max_lon']:
+        in_lon = (df['longitude'] >= bbox['min_lon']) & (df['longitude'] <= bbox['max_lon'])
+    else:
+        in_lon = (df['longitude'] >= bbox['min_lon']) | (df['longitude'] <= bbox['max_lon'])
+    in_lat = (df['latitude'] >= bbox['min_lat']) & (df['latitude'] <= bbox['max_lat'])
+    expected = df[in_lat & in_lon]
+    
+    assert 'cell' not in result.columns
+    assert len(result) > 0
+    assert sorted(result['value']) == sorted(expected['value'])
+    
+    # Row groups are ordered by cell, so most of them are skipped
+    dataset = loader._open_dataset('globe')
+    expression = loader._build_filter(dataset.schema, bbox=bbox)
+    pruned = loader._prune_row_groups(dataset, expression)
+    assert len(list(pruned.get_fragments())) < 20 / 2
+
+def test_load_dataset_spatial_index_empty_bbox(global_data_dir):
+    """A box with min_lat above max_lat covers no cell and returns no rows."""
+    data_dir, _ = global_data_dir
+    loader = DataLoader(str(data_dir))
+    
+    result = loader.load_dataset('globe', bbox={'min_lat': 30.0, 'max_lat': -10.0,
+                                               'min_lon': 20.0, 'max_lon': 60.0})
+    
+    assert len(result) == 0
+
+def test_cover_bbox_antimeridian():
+    """A box crossing the antimeridian covers both edges of the grid."""
+    ranges = cover_bbox({'min_lat': 0.0, 'max_lat': 1.0, 'min_lon': 179.5, 'max_lon': -179.5}, 1.0)
+    
+    # Row 90 spans ids 32400..32759; row 91 spans 32760..33119
+    assert ranges == [(32400, 32400), (32759, 32760), (33119, 33119)]
+
+@pytest.mark.parametrize('time_tolerance', [None, '2D'])
+def test_collocate_matches_brute_force(global_data_dir, time_tolerance):
+    """Collocated pairs match a pairwise search, including across the antimeridian."""
+    data_dir, df = global_data_dir
+    loader = DataLoader(str(data_dir))
+    rng = np.random.default_rng(1)
+    targets = pd.DataFrame({
+        'latitude': np.append(rng.uniform(-80, 80, 300), 0.0),
+        'longitude': np.append(rng.uniform(-180, 180, 300), 179.9),
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 1000, 301), unit='h')
+    })
+    
+    result = loader.collocate(
+        'globe', targets, max_distance=500.0, time_tolerance=time_tolerance, chunk_size=64
+    )
+    
+    lat1, lat2 = np.radians(targets['latitude'].to_numpy())[:, None], np.radians(df['latitude'].to_numpy())
+    dlon = np.radians(targets['longitude'].to_numpy()[:, None] - df['longitude'].to_numpy())
+    distance = 6371.0088 * np.arccos(np.clip(
+        np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(dlon), -1, 1
+    ))
+    within = distance <= 500.0
+    if time_tolerance is not None:
+        delta = df['timestamp'].to_numpy() - targets['timestamp'].to_numpy()[:, None]
+        within &= np.abs(delta) <= pd.Timedelta(time_tolerance).to_timedelta64()
+    target, observation = np.nonzero(within)
+    
+    assert len(result) > 0
+    # The dataset is stored in cell order, so pairs are compared by value
+    result = result.sort_values(['target', 'value'], ignore_index=True)
+    assert result['target'].tolist() == target.tolist()
+    assert result['value'].tolist() == df['value'].to_numpy()[observation].tolist()
+    np.testing.assert_allclose(result['distance'], distance[target, observation], atol=1e-6)
+    assert ('time_delta' in result.columns) == (time_tolerance is not None)
+    
+    nearest = loader.collocate('globe', targets, max_distance=500.0,
+                               time_tolerance=time_tolerance, nearest=True)
+    assert nearest['target'].is_unique
+    assert set(nearest['target']) == set(target)
+    np.testing.assert_allclose(
+        nearest['distance'], np.where(within, distance, np.inf).min(axis=1)[nearest['target']], atol=1e-6
+    )
+
+def test_collocate_depth(data_dir):
+    """Depth tolerances and column selection in collocation."""
+    loader = DataLoader(str(data_dir))
+    targets = pd.DataFrame({'latitude': [45.0], 'longitude': [-125.0], 'depth': [12.0]})
+    
+    result = loader.collocate('ocean', targets, max_distance=20.0, depth_tolerance=5.0,
+                              variables=['temp'], columns=['value'])
+    
+    assert list(result.columns) == ['target', 'value', 'distance', 'depth_delta']
+    assert len(result) > 0
+    assert (result['depth_delta'].abs() <= 5.0).all()
+    assert (result['distance'] <= 20.0).all()
+    
+    with pytest.raises(ValueError, match='missing columns'):
+        loader.collocate('ocean', targets[['latitude']], max_distance=20.0)
+
+def test_query_cache(data_dir):
+    """Repeated queries are served from the cache."""
+    loader = DataLoader(str(data_dir))
+    query = dict(variables=['temp'], depth_range=(0, 10))
+    
+    first = loader.load_dataset('ocean', **query)
+    second = loader.load_dataset('ocean', variables=['temp', 'temp'], depth_range=(0.0, 10.0))
+    
+    pd.testing.assert_frame_equal(first, second)
+    info = loader.cache_info()
+    assert (info['hits'], info['misses'], info['entries']) == (1, 1, 1)
+    assert info['bytes'] > 0
+
+def test_query_cache_filters_cached_table(data_dir):
+    """Filtered queries reuse a cached unfiltered table."""
+    loader = DataLoader(str(data_dir))
+    uncached = DataLoader(str(data_dir), cache_bytes=0)
+    query = dict(
+        variables=['sal'],
+        time_range=('2023-01-05', '2023-01-07'),
+        bbox={'min_lat': 44.0, 'max_lat': 49.0, 'min_lon': -130.0, 'max_lon': -120.0}
+    )
+    
+    loader.load_dataset('ocean')
+    result = loader.load_dataset('ocean', **query)
+    
+    pd.testing.assert_frame_equal(result, uncached.load_dataset('ocean', **query))
+    assert uncached.cache_info()['entries'] == 0
+
+def test_query_cache_invalidation(data_dir):
+    """Rewriting a dataset invalidates its cached queries."""
+    loader = DataLoader(str(data_dir))
+    assert len(loader.load_dataset('ocean', variables=['temp'])) == 100
+    
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    df[df['variable'] == 'temp'].iloc[:10].to_parquet(data_dir / 'ocean.parquet', index=False)
+    
+    assert len(loader.load_dataset('ocean', variables=['temp'])) == 10
+    assert loader.cache_info()['invalidations'] == 1
+
+def test_query_cache_eviction(data_dir):
+    """The least recently used entries are evicted to stay within budget."""
+    loader = DataLoader(str(data_dir))
+    loader.load_dataset('ocean', variables=['temp'])
+    table_bytes = loader.cache_info()['bytes']
+    
+    loader = DataLoader(str(data_dir), cache_bytes=int(table_bytes * 1.5))
+    loader.load_dataset('ocean', variables=['temp'])
+    loader.load_dataset('ocean', variables=['sal'])
+    loader.load_dataset('ocean', variables=['sal'])
+    loader.load_dataset('ocean', variables=['temp'])
+    
+    info = loader.cache_info()
+    assert info['evictions'] == 2
+    assert (info['hits'], info['misses']) == (1, 3)
+    assert info['bytes'] <= info['max_bytes']
+
+def test_compaction(data_dir):
+    """Compaction merges small files without changing query results."""
+    target = data_dir / 'ocean_small.parquet'
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    for i, start in enumerate(range(0, len(df), 20)):
+        with DatasetWriter(target, partitioned=True, time_partition='month',
+                           append=True, basename=f"chunk{i}") as writer:
+            writer.write(df.iloc[start:start + 20])
+    n_files = len(list(target.rglob('*.parquet')))
+    
+    loader = DataLoader(str(data_dir))
+    query = dict(variables=['temp'], depth_range=(0, 10))
+    
+    def load():
+        result = loader.load_dataset('ocean_small', **query).astype({'variable': str})
+        return result.sort_values(['timestamp', 'depth']).reset_index(drop=True)
+    
+    expected = load()
+    report = Compactor(target, target_bytes=1 << 20).compact()
+    
+    assert report['files_compacted'] == n_files
+    assert report['files_written'] == report['partitions'] == 2
+    assert len(loader._open_dataset('ocean_small').files) == 2
+    pd.testing.assert_frame_equal(load(), expected)
+    
+    # The statistics sidecars now describe the compacted files
+    assert loader._read_stats('ocean_small')['n_observations'] == len(df)
+    
+    # Incremental: nothing is left to compact
+    assert Compactor(target, target_bytes=1 << 20).compact()['files_compacted'] == 0
+    
+    # Files of an interrupted run are ignored, then rolled back
+    compacted = loader._open_dataset('ocean_small').files[0]
+    orphan = Path(compacted).with_name('compact-interrupted-0.parquet')
+    shutil.copy(compacted, orphan)
+    log = CompactionLog.load(target)
+    log.groups.append({
+        'state': 'pending', 'old': [],
+        'new': [orphan.relative_to(target).as_posix()], 'committed_at': None
+    })
+    log.save()
+    pd.testing.assert_frame_equal(load(), expected)
+    
+    # Replaced files are deleted once past the retention period
+    assert Compactor(target).vacuum(retention=0) == n_files + 1
+    assert len(list(target.rglob('*.parquet'))) == 2
+    assert not (target / '_compaction.json').exists()
+    pd.testing.assert_frame_equal(load(), expected)
+    assert loader._read_stats('ocean_small')['n_observations'] == len(df)
+
+def test_load_dataset_output_types(data_dir):
+    """Results can be returned as Arrow, Arrow-backed pandas or Polars."""
+    loader = DataLoader(str(data_dir))
+    query = dict(variables=['temp'], depth_range=(0, 10))
+    expected = loader.load_dataset('ocean', **query)
+    
+    table = loader.load_dataset('ocean', output='arrow', **query)
+    assert isinstance(table, pa.Table)
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+    
+    df = loader.load_dataset('ocean', output='pandas_arrow', **query)
+    assert isinstance(df['variable'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['value'].dtype, pd.ArrowDtype)
+    assert df['value'].tolist() == expected['value'].tolist()
+    
+    with pytest.raises(ValueError):
+        loader.load_dataset('ocean', output='numpy')
+
+def test_load_dataset_polars(data_dir):
+    """Results can be returned as a Polars DataFrame."""
+    pl = pytest.importorskip('polars')
+    loader = DataLoader(str(data_dir))
+    
+    df = loader.load_dataset('ocean', variables=['sal'], output='polars')
+    
+    assert isinstance(df, pl.DataFrame)
+    assert df.height == 100
+
+def test_query_multiple_datasets(data_dir):
+    """Datasets with different column types are combined and tagged."""
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    other = df.assign(
+        value=df['value'].astype('float32'),
+        source=df['source'].astype(str),
+        platform='glider'
+    )
+    pq.write_table(pa.Table.from_pandas(other, preserve_index=False),
+                   data_dir / 'glider.parquet')
+    loader = DataLoader(str(data_dir))
+    
+    table = loader.query(['ocean', 'glider'], variables=['sal'], output='arrow')
+    
+    assert table.num_rows == 200
+    assert table.schema.field('value').type == pa.float64()
+    assert pa.types.is_dictionary(table.schema.field('dataset').type)
+    result = table.to_pandas()
+    assert result['dataset'].astype(str).value_counts().to_dict() == {'ocean': 100, 'glider': 100}
+    assert result.loc[result['dataset'] == 'ocean', 'platform'].isna().all()
+    assert (result.loc[result['dataset'] == 'glider', 'platform'] == 'glider').all()
+
+def test_query_empty_projection_not_cached_as_full(data_dir):
+    """A dataset without any requested column does not poison the cache of the full table."""
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    pq.write_table(pa.Table.from_pandas(df.assign(platform='glider'), preserve_index=False),
+                   data_dir / 'glider.parquet')
+    loader = DataLoader(str(data_dir))
+    
+    table = loader.query(['ocean', 'glider'], columns=['platform'], output='arrow')
+    loader.query(['ocean', 'glider'], columns=['platform'], variables=['sal'], output='arrow')
+    
+    assert table.column_names == ['platform', 'dataset']
+    assert list(loader.load_dataset('ocean').columns) == list(df.columns)
+    assert list(loader.load_dataset('ocean', variables=['sal']).columns) == list(df.columns)
+
+def test_query_stream(data_dir):
+    """Streamed queries yield the same rows as combined ones."""
+    loader = DataLoader(str(data_dir))
+    
+    combined = loader.query(variables=['temp'], depth_range=(0, 10), output='arrow')
+    batches = list(loader.query(variables=['temp'], depth_range=(0, 10), stream=True))
+    
+    assert sorted(loader.list_datasets()) == ['ocean', 'ocean_partitioned']
+    assert all(batch.schema == combined.schema for batch in batches)
+    assert sum(batch.num_rows for batch in batches) == combined.num_rows == 100
+
+@pytest.mark.parametrize('dataset_name', ['ocean', 'ocean_partitioned'])
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_iter_batches(data_dir, dataset_name, prefetch):
+    """Batches hold the same rows as load_dataset, in bounded sizes."""
+    loader = DataLoader(str(data_dir))
+    filters = dict(variables=['sal'], depth_range=(0, 20))
+    
+    batches = list(loader.iter_batches(dataset_name, batch_size=10, prefetch=prefetch, **filters))
+    expected = loader.load_dataset(dataset_name, output='arrow', **filters)
+    
+    assert all(0 < batch.num_rows <= 10 for batch in batches)
+    result = pa.Table.from_batches(batches).to_pandas()
+    expected = expected.to_pandas()
+    sort = ['timestamp', 'variable']
+    pd.testing.assert_frame_equal(
+        result.sort_values(sort).reset_index(drop=True),
+        expected.sort_values(sort).reset_index(drop=True)
+    )
+
+def test_iter_batches_unfiltered(data_dir, monkeypatch):
+    """Without filters, batches are still read one row group at a time."""
+    loader = DataLoader(str(data_dir))
+    fragments = []
+    prefetch = DataLoader._prefetch
+    
+    def record(func, items, n):
+        items = list(items)
+        fragments.extend(items)
+        return prefetch(func, items, n)
+    monkeypatch.setattr(DataLoader, '_prefetch', staticmethod(record))
+    
+    n_rows = sum(batch.num_rows for batch in loader.iter_batches('ocean'))
+    
+    assert n_rows == 200
+    assert len(fragments) == 8
+    assert all(len(fragment.row_groups) == 1 for fragment in fragments)
+
+def test_iter_batches_pandas(data_dir):
+    """Batches can be returned as DataFrames, and stopping early is safe."""
+    loader = DataLoader(str(data_dir))
+    
+    batches = loader.iter_batches('ocean', columns=['value'], batch_size=25, output='pandas')
+    first = next(batches)
+    batches.close()
+    
+    assert isinstance(first, pd.DataFrame)
+    assert list(first.columns) == ['value']
+    assert len(first) == 25
+
+@pytest.mark.parametrize('dataset_name', ['ocean', 'ocean_partitioned'])
+def test_aggregate_matches_pandas(data_dir, dataset_name):
+    """Binned statistics merged across batches match a pandas groupby."""
+    loader = DataLoader(str(data_dir))
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    
+    result = loader.aggregate(
+        dataset_name, by=['variable', 'time', 'depth'],
+        time_bucket='day', depth_bins=15.0, batch_size=7
+    )
+    
+    df['variable'] = df['variable'].astype(str)
+    df['day'] = df['timestamp'].dt.floor('D')
+    df['depth_bin'] = np.floor(df['depth'] / 15.0) * 15.0
+    expected = df.groupby(['variable', 'day', 'depth_bin'])['value'].agg(
+        ['mean', 'min', 'max', 'count']
+    ).reset_index()
+    
+    assert len(result) == len(expected)
+    np.testing.assert_array_equal(result['count'], expected['count'])
+    np.testing.assert_allclose(result['mean'], expected['mean'])
+    np.testing.assert_allclose(result['min'], expected['min'])
+    np.testing.assert_allclose(result['max'], expected['max'])
+    np.testing.assert_allclose(result['depth'], expected['depth_bin'])
+
+def test_aggregate_cells(data_dir):
+    """Cell aggregates are keyed by the cell centre and honour filters."""
+    loader = DataLoader(str(data_dir))
+    
+    result = loader.aggregate('ocean', by=['cell'], resolution=5.0, depth_range=(0, 10))
+    
+    assert result['count'].sum() == 100
+    assert list(result['latitude']) == [42.5, 47.5]
+    assert list(result['longitude']) == [-127.5, -122.5]
+
+def test_aggregate_invalid(data_dir):
+    """Missing keys and unknown time buckets are rejected."""
+    loader = DataLoader(str(data_dir))
+    with pytest.raises(ValueError):
+        loader.aggregate('ocean', by=[])
+    with pytest.raises(ValueError):
+        loader.aggregate('ocean', by=['time'], time_bucket='fortnight')
+
+@pytest.fixture
+def overview_data_dir(data_dir):
+    """The ocean dataset written again with overview pyramids."""
+    df = pd.read_parquet(data_dir / 'ocean.parquet')
+    with DatasetWriter(data_dir / 'ocean_overviews.parquet', row_group_size=25,
+                       overviews=True) as writer:
+        writer.write(df.iloc[:120])
+        writer.write(df.iloc[120:])
+    return data_dir
+
+@pytest.mark.parametrize('by, options, filters', [
+    (['variable'], {}, {}),
+    (['variable', 'time'], {'time_bucket': 'day'}, {}),
+    (['variable', 'time'], {'time_bucket': 'month'}, {'variables': ['sal']}),
+    (['cell'], {'resolution': 5.0}, {}),
+    (['variable', 'depth'], {'depth_bins': [0.0, 20.0, 100.0]}, {}),
+    (['time'], {'time_bucket': 'day'},
+     {'time_range': ('2023-01-03', '2023-01-05 23:59:59.999999'), 'depth_range': (0, 1000)}),
+])
+def test_aggregate_overviews(overview_data_dir, monkeypatch, by, options, filters):
+    """Aggregates answered from overviews match a scan of the data."""
+    loader = DataLoader(str(overview_data_dir))
+    assert 'ocean_overviews' in loader.list_datasets()
+    assert not any(name.startswith('_') for name in loader.list_datasets())
+    
+    expected = loader.aggregate('ocean_overviews', by=by, use_overviews=False, **options, **filters)
+    monkeypatch.setattr(loader, 'iter_batches', None)
+    result = loader.aggregate('ocean_overviews', by=by, **options, **filters)
+    
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+def test_aggregate_overviews_fallback(overview_data_dir):
+    """Filters that cut through overview bins are answered from the data."""
+    loader = DataLoader(str(overview_data_dir))
+    
+    result = loader.aggregate('ocean_overviews', by=['variable'], depth_range=(5, 15))
+    
+    assert result['count'].sum() == 50
+
+def test_aggregate_overviews_stale(overview_data_dir):
+    """Overviews of a dataset rewritten since are not used."""
+    df = pd.read_parquet(overview_data_dir / 'ocean.parquet')
+    pq.write_table(pa.Table.from_pandas(df.iloc[:50], preserve_index=False),
+                   overview_data_dir / 'ocean_overviews.parquet')
+    loader = DataLoader(str(overview_data_dir))
+    
+    result = loader.aggregate('ocean_overviews', by=['variable'])
+    
+    assert result['count'].sum() == 50
+
+def test_load_dataset_missing(data_dir):
+    """Unknown datasets raise FileNotFoundError."""
+    with pytest.raises(FileNotFoundError):
+        DataLoader(str(data_dir)).load_dataset('missing')
+
+def test_query_service_coalesces(data_dir):
+    """Identical requests in flight share one read; results match the loader."""
+    loader = DataLoader(str(data_dir))
+    started, release = threading.Event(), threading.Event()
+    
+    def block(event):
+        started.set()
+        release.wait(10)
+    loader.add_hook(block)
+    
+    with QueryService(loader, max_workers=2) as service:
+        first = service.submit('load_dataset', dataset_name='ocean', variables=['temp'])
+        started.wait(10)
+        second = service.submit('load_dataset', dataset_name='ocean', variables=('temp',))
+        other = service.submit('aggregate', dataset_name='ocean', by=['variable'])
+        assert second is first
+        release.set()
+        
+        assert first.result().equals(loader.load_dataset('ocean', variables=['temp'], output='arrow'))
+        assert other.result().to_pandas().equals(loader.aggregate('ocean', by=['variable']))
+        assert asyncio.run(service.run_async('query', variables=['sal'])).num_rows == 200
+        
+        stats = service.stats()
+        assert (stats['requests'], stats['executed'], stats['coalesced']) == (4, 3, 1)
+        assert stats['in_flight'] == 0
+        
+        with pytest.raises(ValueError):
+            service.submit('load_dataset', dataset_name='ocean', output='pandas')
+
+def test_query_service_http(data_dir):
+    """Results are streamed over HTTP as Arrow IPC, errors as exceptions."""
+    loader = DataLoader(str(data_dir))
+    with QueryService(loader) as service:
+        server = serve(service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            query = dict(variables=['sal'], time_range=('2023-01-05', '2023-01-07'), depth_range=(0, 20))
+            table = fetch(url, 'load_dataset', dataset_name='ocean_partitioned', **query)
+            expected = loader.load_dataset('ocean_partitioned', output='arrow', **query)
+            assert table.num_rows > 0
+            assert table.equals(expected)
+            
+            table = fetch(url, 'aggregate', dataset_name='ocean', by=['variable', 'depth'])
+            assert table.num_rows == 8
+            
+            with pytest.raises(FileNotFoundError):
+                fetch(url, 'load_dataset', dataset_name='missing')
+            with pytest.raises(ValueError):
+                fetch(url, 'drop_dataset', dataset_name='ocean')
+        finally:
+            server.shutdown()
+            server.server_close()
\ No newline at end of file
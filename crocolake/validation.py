@@ -0,0 +1,263 @@
+"""
+CrocoLake data validation
+
+Converted chunks are coerced to the types of a CrocoLakeSchema and checked
+against it with vectorized column checks. Rows violating the schema can be
+rejected, dropped or quarantined to a parquet side file for inspection.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple, Sequence
+
+from .schema import CrocoLakeSchema, ColumnSpec, DEFAULT_SCHEMA
+
+# Suffix of quarantine side files; like the other sidecars the name starts
+# with an underscore
+QUARANTINE_SUFFIX = '.quarantine.parquet'
+
+# Number of violating rows kept as samples in a ValidationResult
+DEFAULT_MAX_SAMPLES = 10
+
+# Column listing the violations of each quarantined or sampled row
+VIOLATIONS_COLUMN = 'violations'
+
+@dataclass
+class ValidationResult:
+    """
+    Outcome of validating a chunk.
+    
+    Attributes:
+        n_rows: Number of rows checked
+        missing_columns: Required columns absent from the chunk
+        dtype_errors: Columns whose dtype does not match their kind
+        counts: Number of violating rows per '<column>:<rule>', where rule
+            is 'null', 'min', 'max' or 'not_finite'
+        masks: Violation mask of each rule in counts
+        invalid: Boolean mask of the rows violating at least one rule
+        samples: First violating rows, with a 'violations' column
+    """
+    n_rows: int
+    missing_columns: List[str] = field(default_factory=list)
+    dtype_errors: Dict[str, str] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    masks: Dict[str, np.ndarray] = field(default_factory=dict)
+    invalid: Optional[np.ndarray] = None
+    samples: Optional[pd.DataFrame] = None
+    
+    @property
+    def structural(self) -> bool:
+        """Whether whole columns are missing or of the wrong type."""
+        return bool(self.missing_columns or self.dtype_errors)
+    
+    @property
+    def n_invalid(self) -> int:
+        """Number of rows violating at least one rule."""
+        return int(self.invalid.sum()) if self.invalid is not None else 0
+    
+    @property
+    def valid(self) -> bool:
+        return not self.structural and self.n_invalid == 0
+    
+    def summary(self) -> str:
+        """One-line description of the violations."""
+        parts = []
+        if self.missing_columns:
+            parts.append(f"missing columns {self.missing_columns}")
+        for column, dtype in self.dtype_errors.items():
+            parts.append(f"column {column} has dtype {dtype}")
+        if self.n_invalid:
+            rules = ', '.join(f"{rule}: {count}" for rule, count in self.counts.items())
+            parts.append(f"{self.n_invalid} of {self.n_rows} rows invalid ({rules})")
+        return '; '.join(parts) or 'valid'
+
+def validate(data: pd.DataFrame, schema: CrocoLakeSchema = DEFAULT_SCHEMA,
+             max_samples: int = DEFAULT_MAX_SAMPLES) -> ValidationResult:
+    """
+    Check a chunk against a schema.
+    
+    Each rule is evaluated on whole columns at once and the per-rule masks
+    are combined into a single row mask; violation labels are only built
+    for the sampled rows.
+    
+    Args:
+        data: CrocoLake-formatted chunk
+        schema: Schema to check against
+        max_samples: Number of violating rows returned as samples
+    
+    Returns:
+        ValidationResult; row checks are skipped if the chunk has
+        structural errors
+    """
+    result = ValidationResult(n_rows=len(data))
+    result.missing_columns = [name for name in schema.columns if name not in data.columns]
+    result.dtype_errors = {
+        name: str(data[name].dtype) for name, spec in schema.columns.items()
+        if name in data.columns and not _dtype_matches(data[name], spec)
+    }
+    if result.structural:
+        return result
+    
+    masks = result.masks = violation_masks(data, schema)
+    result.counts = {rule: int(mask.sum()) for rule, mask in masks.items()}
+    result.invalid = np.logical_or.reduce(list(masks.values())) if masks \
+        else np.zeros(len(data), dtype=bool)
+    if masks:
+        result.samples = violating_rows(data, masks, limit=max_samples)
+    
+    return result
+
+def coerce(data: pd.DataFrame, schema: CrocoLakeSchema = DEFAULT_SCHEMA,
+           numeric: Sequence[str] = ()) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Cast the schema columns present in a chunk to their kind.
+    
+    Timestamps are parsed with the schema's format (much faster than
+    inferring it row by row) and converted to naive UTC; float columns
+    and the extra numeric columns are parsed as numbers.
+    
+    Args:
+        data: Chunk to coerce; modified in place
+        schema: Schema giving the column kinds and timestamp format
+        numeric: Other columns to parse as numbers, e.g. measurements
+            of a wide chunk
+    
+    Returns:
+        The coerced chunk, and the number of non-missing values of each
+        column that could not be parsed and became missing
+    """
+    kinds = {name: spec.kind for name, spec in schema.columns.items()}
+    kinds.update({name: 'float' for name in numeric})
+    
+    errors = {}
+    for name, kind in kinds.items():
+        if name not in data.columns:
+            continue
+        column = data[name]
+        if kind == 'datetime':
+            coerced = _to_datetime(column, schema.timestamp_format, schema.timezone)
+        elif kind == 'float' and not pd.api.types.is_numeric_dtype(column):
+            coerced = pd.to_numeric(column, errors='coerce')
+        else:
+            continue
+        
+        failed = int((coerced.isna() & column.notna()).sum())
+        if failed:
+            errors[name] = failed
+        data[name] = coerced
+    
+    return data, errors
+
+def violating_rows(data: pd.DataFrame, masks: Dict[str, np.ndarray],
+                   limit: Optional[int] = None) -> pd.DataFrame:
+    """
+    Rows violating any rule, with a 'violations' column listing the rules.
+    
+    Args:
+        data: Validated chunk
+        masks: Violation mask of each rule, see validate
+        limit: Optional maximum number of rows returned
+    """
+    positions = np.flatnonzero(np.logical_or.reduce(list(masks.values())))
+    if limit is not None:
+        positions = positions[:limit]
+    
+    rows = data.iloc[positions].copy()
+    labels = [
+        ','.join(rule for rule, mask in masks.items() if mask[position])
+        for position in positions
+    ]
+    rows[VIOLATIONS_COLUMN] = labels
+    return rows
+
+def violation_masks(data: pd.DataFrame, schema: CrocoLakeSchema = DEFAULT_SCHEMA) -> Dict[str, np.ndarray]:
+    """Violation mask of each '<column>:<rule>' with at least one violation."""
+    masks = {}
+    for name, spec in schema.columns.items():
+        for rule, mask in _column_violations(data[name], spec).items():
+            if mask.any():
+                masks[f"{name}:{rule}"] = mask
+    return masks
+
+def quarantine_path(data_path: str) -> Path:
+    """Path of the quarantine side file of a parquet file."""
+    data_path = Path(data_path)
+    return data_path.parent / f"_{data_path.stem}{QUARANTINE_SUFFIX}"
+
+class QuarantineWriter:
+    """
+    Append rejected rows to a parquet side file.
+    
+    Categorical columns are stored as plain strings so chunks with
+    different categories share one schema.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.n_rows = 0
+        self._writer = None
+    
+    def write(self, rows: pd.DataFrame) -> None:
+        """Append rows, which carry a 'violations' column."""
+        if not len(rows):
+            return
+        
+        rows = rows.astype({
+            name: str for name in rows.columns
+            if isinstance(rows[name].dtype, pd.CategoricalDtype)
+        })
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(str(self.path), table.schema.remove_metadata())
+        self._writer.write_table(table.cast(self._writer.schema))
+        self.n_rows += len(rows)
+    
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def _dtype_matches(column: pd.Series, spec: ColumnSpec) -> bool:
+    if spec.kind == 'datetime':
+        return pd.api.types.is_datetime64_any_dtype(column)
+    if spec.kind == 'float':
+        return pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+    return not pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_datetime64_any_dtype(column)
+
+def _column_violations(column: pd.Series, spec: ColumnSpec) -> Dict[str, np.ndarray]:
+    """Violation mask of each rule of a column."""
+    missing = column.isna().to_numpy()
+    masks = {}
+    if not spec.nullable:
+        masks['null'] = missing
+    
+    if spec.kind == 'float':
+        values = column.to_numpy(dtype=float, na_value=np.nan)
+        with np.errstate(invalid='ignore'):
+            masks['not_finite'] = np.isinf(values)
+            if spec.min is not None:
+                masks['min'] = values < spec.min
+            if spec.max is not None:
+                masks['max'] = values > spec.max
+    
+    return masks
+
+def _to_datetime(column: pd.Series, timestamp_format: Optional[str],
+                 timezone: Optional[str]) -> pd.Series:
+    """Parse timestamps and convert them to naive UTC."""
+    if not pd.api.types.is_datetime64_any_dtype(column):
+        # Without a source timezone, naive strings are UTC and offsets are
+        # applied; otherwise naive strings are localized below
+        column = pd.to_datetime(
+            column, format=timestamp_format, errors='coerce', utc=timezone is None
+        )
+    
+    if column.dt.tz is None:
+        if timezone is None:
+            return column
+        column = column.dt.tz_localize(timezone, ambiguous='NaT', nonexistent='NaT')
+    return column.dt.tz_convert('UTC').dt.tz_localize(None)
@@ -13,10 +13,21 @@ setup(
         "dask>=2023.1.0",
         "fsspec>=2023.1.0",
     ],
+    extras_require={
+        "polars": ["polars>=0.20.0"],
+    },
     author="Your Name",
     author_email="your.email@example.com",
     description="A datalake for ocean observations",
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     python_requires=">=3.8",
+    entry_points={
+        "console_scripts": [
+            "crocolake-convert=crocolake.converters.batch:main",
+            "crocolake-compact=crocolake.compaction:main",
+            "crocolake-catalog=crocolake.catalog:main",
+            "crocolake-serve=crocolake.loader.service:main",
+        ],
+    },
 ) 
\ No newline at end of file